@@ -0,0 +1,686 @@
+#!/usr/local/bin/python
+''' benchmark - times the hot paths of tslite and instapost against their
+previous implementations on synthetic data. Only timings are reported here;
+behaviour is covered by test_tslite.py and test_instapost.py.
+
+usage: benchmark.py [-n COUNT] [name ...]
+'''
+
+import argparse, datetime, imp, math, os, random, sys, time, pytz, tslite
+import dateutil.parser as dateparser
+
+benchmarks = []
+
+
+def benchmark(f):
+  benchmarks.append(f)
+  return f
+
+
+def clock(f, *args):
+  '''returns (seconds, result) for a single call of f'''
+  start = time.time()
+  result = f(*args)
+  return time.time() - start, result
+
+
+def loadInstapost():
+  '''imports the instapost script as a module without running it'''
+  path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instapost")
+  sys.dont_write_bytecode = True  # don't leave an "instapostc" behind
+  module = imp.load_source("instapost", path)
+  module.args = argparse.Namespace(verbose=False)
+  return module
+
+
+def report(name, old, new, unit="s"):
+  print "%-28s %10.4f%s %10.4f%s %8.1fx" % (name, old, unit, new, unit, old / max(new, 1e-9))
+
+
+###############################################################################
+
+
+@benchmark
+def timestamps(n):
+  '''tslite.timeparser against dateutil + pytz.localize'''
+  tz = pytz.timezone("US/Pacific")
+  start = datetime.datetime(2017, 1, 1)
+  stamps = [start + datetime.timedelta(minutes=15 * i) for i in xrange(n)]
+  feeds = [
+      ("iso", [t.strftime("%Y-%m-%d %H:%M") for t in stamps]),
+      ("iso_z", [t.strftime("%Y-%m-%dT%H:%M:%SZ") for t in stamps]),
+      ("usbr", [t.strftime("%m/%d/%Y %H:%M") for t in stamps]),
+      ("cwms", [t.strftime("%d-%b-%Y %H%M") for t in stamps]),
+  ]
+
+  def old(keys):
+    output = []
+    for key in keys:
+      tstamp = dateparser.parse(key, fuzzy=True)
+      if tstamp.tzinfo == None:
+        tstamp = tz.localize(tstamp)
+      output.append(tstamp)
+    return output
+
+  def new(keys):
+    parser = tslite.timeparser(tz)
+    return [parser.parse(key) for key in keys]
+
+  for (name, keys) in feeds:
+    t0 = clock(old, keys)[0]
+    t1 = clock(new, keys)[0]
+    report("timestamps/" + name, t0, t1)
+
+
+@benchmark
+def jobs(n):
+  '''instapost --jobs N against a stand-in backend with 5ms round trips'''
+  instapost = loadInstapost()
+
+  class standIn(instapost.dataService):
+    latency = 0.005
+
+    def session(self):
+      output = standIn()
+      output.configuration = self.configuration
+      return output
+
+    def disconnect(self):
+      pass
+
+    def readSeries(self, tsid, start_time, end_time, units):
+      time.sleep(self.latency)
+      return tslite.timeseries()
+
+    def writeToCWMS(self, tsid, units, valueList, cached=None):
+      time.sleep(self.latency)
+
+  start = datetime.datetime(2017, 1, 1)
+  rows = [((start + datetime.timedelta(minutes=15 * j)).strftime("%Y-%m-%d %H:%M"), float(j), None)
+          for j in xrange(96)]
+  tsids = ["Station%d.Flow.Inst.15Minutes.0.RAW" % i for i in xrange(max(n // 96, 1))]
+  opts = argparse.Namespace(snap=None, hardsnap=None)
+
+  def run(count):
+    pool = instapost.workerPool(standIn(), count, opts, None)
+    for tsid in tsids:
+      pool.submit(tsid, {"units": "cfs"}, rows)
+    pool.close()
+
+  t0 = clock(run, 1)[0]
+  for count in (2, 4, 8, 16):
+    t1 = clock(run, count)[0]
+    report("jobs/%d" % count, t0, t1)
+
+
+@benchmark
+def storage(n):
+  '''memory per timeslice, the old nested list against the columnar timeseries'''
+  start = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+  rows = [[start + datetime.timedelta(minutes=15 * i), i / 7.0, 0] for i in xrange(n)]
+  ts = tslite.timeseries(rows)
+  old = sys.getsizeof(rows) + sum(sys.getsizeof(row) + sys.getsizeof(row[0]) + sys.getsizeof(row[1])
+                                  for row in rows)
+  new = sum(sys.getsizeof(column) for column in (ts.times, ts.values, ts.qualities))
+  report("storage/bytes_per_slice", float(old) / n, float(new) / n, "B")
+
+
+@benchmark
+def construct(n):
+  '''building a timeseries from shuffled and sorted rows, insert() per row against one bulk extend()'''
+  start = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+  rows = [[start + datetime.timedelta(minutes=15 * i), i / 7.0, 0] for i in xrange(n)]
+  shuffled = rows[:]
+  random.Random(1).shuffle(shuffled)
+
+  def old(rows):
+    ts = tslite.timeseries()
+    for row in rows:
+      ts.insert(row[0], row[1], quality=row[2])
+    return ts
+
+  def new(rows):
+    return tslite.timeseries().extend(rows)
+
+  for (name, feed) in (("shuffled", shuffled), ("sorted", rows)):
+    t0 = clock(old, feed)[0]
+    t1 = clock(new, feed)[0]
+    report("construct/" + name, t0, t1)
+
+
+@benchmark
+def diff(n):
+  '''timeseries.diff against the findIndex and '%.6f' string comparison it replaced'''
+  def findIndex(data, key):
+    imin = 0
+    imax = len(data) - 1
+    while imax >= imin:
+      imid = imin + ((imax - imin) / 2)
+      if data[imid][0] == key:
+        return imid
+      elif data[imid][0] < key:
+        imin = imid + 1
+      else:
+        imax = imid - 1
+    return -1
+
+  def old(mine, other):
+    output = tslite.timeseries()
+    for slice in mine:
+      i = findIndex(other, slice[0])
+      if i == -1:
+        continue
+      oslice = other[i]
+      if format(slice[1], '.6f') != format(oslice[1], '.6f'):
+        output.insert(oslice[0], oslice[1], quality=oslice[2])
+    for slice in other:
+      if findIndex(mine, slice[0]) == -1:
+        output.insert(slice[0], slice[1], quality=slice[2])
+    return output
+
+  rand = random.Random(2)
+  start = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+  db = [[start + datetime.timedelta(minutes=15 * i), round(rand.uniform(0, 100), 2), 0] for i in xrange(n)]
+  feeds = [
+      ("unchanged", [row[:] for row in db]),
+      ("changed_10pct", [[t, v + 1 if rand.random() < 0.1 else v, q] for (t, v, q) in db]),
+      ("rounding_noise", [[t, v + rand.choice([0, 1e-7, 4e-7, 6e-7, 2e-6]), q] for (t, v, q) in db]),
+      ("shifted_window", [[t + datetime.timedelta(days=30), v, q] for (t, v, q) in db]),
+  ]
+  dbts = tslite.timeseries(db)
+  for (name, rows) in feeds:
+    ts = tslite.timeseries(rows)
+    t0 = clock(old, db, rows)[0]
+    t1 = clock(dbts.diff, ts)[0]
+    report("diff/" + name, t0, t1)
+
+
+@benchmark
+def blend(n):
+  '''tslite.blend of 24 overlapping series against chained merge() with an insert per row'''
+  rand = random.Random(3)
+  start = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+  series = []
+  for k in xrange(24):
+    offset = rand.randint(0, n // 2)
+    series.append(tslite.timeseries([[start + datetime.timedelta(minutes=15 * (offset + i)),
+                                      rand.uniform(0, 100), rand.choice([0, 3, 9, 17])]
+                                     for i in xrange(n // 2)]))
+
+  def old(series):
+    output = tslite.timeseries()
+    for ts in series:
+      output = tslite.timeseries(output.data)
+      for line in ts.data:
+        output.insert(line[0], line[1], quality=line[2])
+    return output
+
+  t0 = clock(old, series)[0]
+  t1 = clock(tslite.blend, series)[0]
+  report("blend/24_series", t0, t1)
+  t1 = clock(tslite.blend, series, "quality")[0]
+  report("blend/24_series_quality", t0, t1)
+
+
+@benchmark
+def window(n):
+  '''movingaverage and movingmax on the sliding window kernel against re-summing each window'''
+  def old(data, interval, f):
+    output = []
+    i = len(data) - 1
+    while i >= 0:
+      endTime = data[i][0]
+      startTime = endTime - interval
+      if startTime < data[0][0]:
+        break
+      k = 0
+      window = []
+      while data[i - k][0] >= startTime:
+        window.append(data[i - k][1])
+        k += 1
+        if i - k < 0:
+          break
+      output.append([endTime, f(window), data[i][2]])
+      i -= 1
+    return tslite.timeseries(output)
+
+  rand = random.Random(4)
+  start = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+  rows = [[start + datetime.timedelta(minutes=15 * i), rand.uniform(0, 100), 0] for i in xrange(n)]
+  ts = tslite.timeseries(rows)
+  for days in (1, 3):
+    interval = datetime.timedelta(days=days)
+    t0 = clock(old, rows, interval, lambda w: sum(w) / len(w))[0]
+    t1 = clock(ts.movingaverage, interval)[0]
+    report("window/mean_%dd" % days, t0, t1)
+    t0 = clock(old, rows, interval, max)[0]
+    t1 = clock(ts.movingmax, interval)[0]
+    report("window/max_%dd" % days, t0, t1)
+
+
+@benchmark
+def resample(n):
+  '''daily mean, min and max in one resample pass against three legacy bucket loops'''
+  def old(data, interval, f):
+    output = []
+    i = 0
+    count = len(data)
+    endTime = data[i][0]
+    while i < count:
+      startTime = endTime
+      endTime = startTime + interval
+      quality = data[i][2]
+      window = []
+      while data[i][0] < endTime:
+        window.append(data[i][1])
+        i += 1
+        if i >= count:
+          break
+      if window:
+        output.append([endTime, f(window), quality])
+    return tslite.timeseries(output)
+
+  def olds(data, interval):
+    return [old(data, interval, f) for f in (lambda w: sum(w) / len(w), min, max)]
+
+  rand = random.Random(5)
+  start = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+  rows = [[start + datetime.timedelta(minutes=15 * i), rand.uniform(0, 100), 0] for i in xrange(n)]
+  ts = tslite.timeseries(rows)
+  interval = datetime.timedelta(days=1)
+  t0 = clock(olds, rows, interval)[0]
+  t1 = clock(ts.resample, interval, ["mean", "min", "max"])[0]
+  report("resample/day_mean_min_max", t0, t1)
+
+
+@benchmark
+def snap(n):
+  '''snapping jittered 15 minute data against the legacy tail-copying snap'''
+  def old(data, interval, buffer):
+    output = []
+    endtime = data[-1][0]
+    t = data[0][0]
+    count = 0
+    while t <= endtime:
+      tlist = []
+      for line in data[count:]:
+        if line[0] >= t - buffer:
+          if line[0] <= t + buffer:
+            count += 1
+            tlist.append(line)
+          else:
+            break
+      if len(tlist) > 0:
+        tline = tlist[0]
+        for line in tlist:
+          if abs(tline[0] - t).seconds > abs(line[0] - t).seconds:
+            tline = line
+        output.append([t, tline[1], tline[2]])
+      t += interval
+    return tslite.timeseries(output)
+
+  rand = random.Random(6)
+  start = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+  rows = sorted([start + datetime.timedelta(minutes=15 * i, seconds=rand.randint(-400, 400)),
+                 rand.uniform(0, 100), 0] for i in xrange(n))
+  ts = tslite.timeseries(rows)
+  interval = datetime.timedelta(minutes=15)
+  t0 = clock(old, rows, interval, interval / 2)[0]
+  t1 = clock(ts.snap, interval, interval / 2)[0]
+  report("snap/15m", t0, t1)
+
+
+@benchmark
+def arithmetic(n):
+  '''local flow (outflow - inflow) and percent against a lookup and lambda per timeslice'''
+  def findIndex(data, key):
+    imin = 0
+    imax = len(data) - 1
+    while imax >= imin:
+      imid = imin + ((imax - imin) / 2)
+      if data[imid][0] == key:
+        return imid
+      elif data[imid][0] < key:
+        imin = imid + 1
+      else:
+        imax = imid - 1
+    return -1
+
+  def old(mine, other, op):
+    output = []
+    for line in mine:
+      i = findIndex(other, line[0])
+      if i != -1 and other[i][1] != None:
+        output.append([line[0], op(line[1], other[i][1]), line[2]])
+    return tslite.timeseries(output)
+
+  rand = random.Random(7)
+  start = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+  outflow = [[start + datetime.timedelta(minutes=15 * i), rand.uniform(1000, 9000), 0] for i in xrange(n)]
+  inflow = [[start + datetime.timedelta(minutes=15 * i), rand.uniform(500, 900), 0] for i in xrange(0, n, 2)]
+  (a, b) = (tslite.timeseries(outflow), tslite.timeseries(inflow))
+  t0 = clock(old, outflow, inflow, lambda x, y: x - y)[0]
+  t1 = clock(a.subtract, b)[0]
+  report("arithmetic/subtract", t0, t1)
+  t0 = clock(old, outflow, inflow, lambda x, y: 100 * float(x / y))[0]
+  t1 = clock(a.percent, b)[0]
+  report("arithmetic/percent", t0, t1)
+
+
+@benchmark
+def climatology(n):
+  '''averageWY over n hourly values against building a datetime per timeslice per water year'''
+  def old(data):
+    def toWY(t):
+      return t.year + 1 if t.month > 9 else t.year
+
+    def fromWY(year, month):
+      return year - 1 if month > 9 else year
+
+    dd = dict((line[0], i) for (i, line) in enumerate(data))
+    output = []
+    startWY = toWY(data[0][0])
+    endWY = toWY(data[-1][0])
+    i = 0
+    while toWY(data[i][0]) != endWY:
+      i += 1
+    while i < len(data):
+      t = data[i][0]
+      total = 0
+      count = 0
+      for WY in xrange(startWY, endWY + 1):
+        try:
+          t2 = datetime.datetime(fromWY(WY, t.month), t.month, t.day, t.hour, t.minute)
+        except ValueError:
+          continue
+        if t2 in dd:
+          total += data[dd[t2]][1]
+          count += 1
+      if count:
+        output.append([t, total / count, data[i][2]])
+      i += 1
+    return tslite.timeseries(output)
+
+  rand = random.Random(8)
+  start = datetime.datetime(1990, 10, 1)
+  rows = [[start + datetime.timedelta(hours=i), rand.uniform(0, 100), 0] for i in xrange(n)]
+  ts = tslite.timeseries(rows)
+  t0 = clock(old, rows)[0]
+  t1 = clock(ts.averageWY)[0]
+  report("climatology/averageWY", t0, t1)
+  t0 = clock(lambda: [old(rows) for k in xrange(3)])[0]
+  t1 = clock(ts.climatology, ["mean", "median", 10, 90])[0]
+  report("climatology/mean_p10_p50_p90", t0, t1)
+
+
+@benchmark
+def regularize(n):
+  '''filling n 15 minute slots from hourly data against a Python step per slot'''
+  def oldInterpolate(data, interval):
+    output = []
+    for i in xrange(0, len(data) - 1):
+      startTime = data[i][0]
+      deltaT = (data[i + 1][0] - startTime).total_seconds()
+      steps = int(deltaT / interval.total_seconds())
+      for j in xrange(0, steps):
+        x = j * interval.total_seconds()
+        value = data[i][1] + x * ((data[i + 1][1] - data[i][1]) / deltaT)
+        output.append([startTime + interval * j, value, data[i][2]])
+    return tslite.timeseries(output)
+
+  def oldFilldown(data, interval):
+    output = []
+    (t, val, qual) = data[0]
+    i = 0
+    while t <= data[-1][0]:
+      while i < len(data) and data[i][0] <= t:
+        (val, qual) = data[i][1:]
+        i += 1
+      output.append([t, val, qual])
+      t += interval
+    return tslite.timeseries(output)
+
+  rand = random.Random(9)
+  start = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+  rows = [[start + datetime.timedelta(hours=i), rand.uniform(0, 100), 0] for i in xrange(n / 4)]
+  ts = tslite.timeseries(rows)
+  interval = datetime.timedelta(minutes=15)
+  t0 = clock(oldInterpolate, rows, interval)[0]
+  t1 = clock(ts.interpolate, interval)[0]
+  report("regularize/interpolate", t0, t1)
+  t0 = clock(oldFilldown, rows, interval)[0]
+  t1 = clock(ts.filldown, interval)[0]
+  report("regularize/filldown", t0, t1)
+
+
+@benchmark
+def statistics(n):
+  '''linreg and variance from one statistics pass against mktime sums and a bucket average plus a second pass'''
+  def oldLinreg(data):
+    sumx = sumx2 = sumxy = sumy = sumy2 = 0.0
+    count = 0
+    for (t, v, q) in data:
+      x = time.mktime(t.timetuple())
+      sumx += x; sumx2 += x ** 2; sumxy += x * v; sumy += v; sumy2 += v ** 2
+      count += 1
+    denom = count * sumx2 - sumx ** 2
+    return ((count * sumxy - sumx * sumy) / denom, (sumy * sumx2 - sumx * sumxy) / denom)
+
+  def oldVariance(data):
+    total = 0.0
+    for (t, v, q) in data[:-1]: # the bucket average of globalAverage
+      total += v
+    mu = total / (len(data) - 1)
+    return sum(math.pow(v - mu, 2) for (t, v, q) in data) / len(data)
+
+  rand = random.Random(10)
+  start = datetime.datetime(2017, 1, 1)
+  rows = [[start + datetime.timedelta(minutes=15 * i), rand.uniform(0, 100) + i * 1e-3, 0] for i in xrange(n)]
+  ts = tslite.timeseries(rows)
+  t0 = clock(oldLinreg, rows)[0]
+  t1 = clock(ts.linreg)[0]
+  report("statistics/linreg", t0, t1)
+  t0 = clock(oldVariance, rows)[0]
+  t1 = clock(ts.variance)[0]
+  report("statistics/variance", t0, t1)
+
+
+@benchmark
+def qc(n):
+  '''outlier screening and smoothing: legacy loops, the array versions and qcstream fed 4 values at a time'''
+  import numpy as np
+  def oldOutliers(data, threshold):
+    a = [row[1] for row in data]
+    avg = np.average(a)
+    a = [avg] + a
+    good = [a[0]]
+    stdm = np.std(a) * threshold
+    output = []
+    for i in xrange(1, len(a)):
+      if abs(a[i] - good[-1]) < stdm:
+        good.append(a[i])
+        output.append(data[i - 1])
+    return tslite.timeseries(output)
+
+  def rescreen(data, step):
+    # screen and smooth the last 30 days again each time 4 values arrive
+    for end in xrange(step, len(data) + 1, step):
+      tslite.timeseries(data[max(0, end - 2880):end]).remove_stddev_outliers().savitzky_golay(5, 2)
+
+  def stream(data, step):
+    qc = tslite.qcstream(1.5, 5, 2)
+    for end in xrange(step, len(data) + 1, step):
+      qc.update(tslite.timeseries(data[end - step:end]))
+    return qc.flush()
+
+  rand = random.Random(11)
+  start = datetime.datetime(2017, 1, 1, tzinfo=pytz.utc)
+  rows = [[start + datetime.timedelta(minutes=15 * i), 10 + rand.gauss(0, 1) + (rand.random() < 0.02) * 50, 0]
+          for i in xrange(n)]
+  ts = tslite.timeseries(rows)
+  t0 = clock(oldOutliers, rows, 1.5)[0]
+  t1 = clock(ts.remove_stddev_outliers, 1.5)[0]
+  report("qc/outliers", t0, t1)
+  recent = rows[-min(n, 2880 + 96):]
+  t0 = clock(rescreen, recent, 4)[0]
+  t1 = clock(stream, recent, 4)[0]
+  report("qc/stream_4_values", t0, t1)
+
+
+@benchmark
+def binary(n):
+  '''saveBinary/loadBinary in the legacy per row "iff" format against the mapped column format, and a one day range read'''
+  import struct, tempfile
+  def oldSave(data, path):
+    with open(path, "wb") as f:
+      for (t, v, q) in data:
+        f.write(struct.pack("iff", time.mktime(t.timetuple()), v, q))
+
+  def oldLoad(path):
+    rows = []
+    with open(path, "rb") as f:
+      while True:
+        record = f.read(12)
+        if len(record) != 12:
+          break
+        (t, v, q) = struct.unpack("iff", record)
+        rows.append([datetime.datetime.fromtimestamp(t), v, q])
+    return tslite.timeseries(rows)
+
+  def load(path, *window):
+    ts = tslite.timeseries()
+    ts.loadBinary(path, *window)
+    return ts
+
+  rand = random.Random(12)
+  start = datetime.datetime(2017, 1, 1)
+  rows = [[start + datetime.timedelta(minutes=15 * i), rand.uniform(0, 100), i % 4] for i in xrange(n)]
+  ts = tslite.timeseries(rows)
+  (handle, old) = tempfile.mkstemp(".bin")
+  os.close(handle)
+  (handle, new) = tempfile.mkstemp(".bin")
+  os.close(handle)
+  try:
+    t0 = clock(oldSave, rows, old)[0]
+    t1 = clock(ts.saveBinary, new)[0]
+    report("binary/save", t0, t1)
+    t0 = clock(oldLoad, old)[0]
+    t1 = clock(load, new)[0]
+    report("binary/load", t0, t1)
+    day = start + datetime.timedelta(minutes=15 * (n // 2))
+    t0 = clock(lambda: oldLoad(old).subSlice(day, day + datetime.timedelta(days=1)))[0]
+    t1 = clock(load, new, day, day + datetime.timedelta(days=1))[0]
+    report("binary/range_read_1_day", t0, t1)
+  finally:
+    os.remove(old)
+    os.remove(new)
+
+
+@benchmark
+def archive(n):
+  '''compressed saveBinary against the legacy "iff" file and the uncompressed format: size and decode time'''
+  import struct, tempfile
+  rand = random.Random(13)
+  start = datetime.datetime(2017, 1, 1)
+  (rows, stage) = ([], 10.0)
+  for i in xrange(n): # a gage height: hundredths that mostly hold, some steps, a few missing
+    stage = round(stage + rand.choice((0, 0, 0, 0.01, -0.01)), 2)
+    rows.append([start + datetime.timedelta(minutes=15 * i), stage if rand.random() > 0.001 else None, 0])
+  ts = tslite.timeseries(rows)
+  paths = []
+  for k in xrange(3):
+    (handle, path) = tempfile.mkstemp(".bin")
+    os.close(handle)
+    paths.append(path)
+  (old, raw, packed) = paths
+  try:
+    with open(old, "wb") as f:
+      for (t, v, q) in ts.data:
+        f.write(struct.pack("iff", time.mktime(t.timetuple()), v, q))
+    ts.saveBinary(raw)
+    ts.saveBinary(packed, None, None, True)
+    sizes = [os.path.getsize(path) for path in paths]
+    print "%-28s %10d %10d %10d %8.1fx" % ("archive/bytes iff,raw,packed", sizes[0], sizes[1], sizes[2],
+                                           float(sizes[0]) / sizes[2])
+    def load(path):
+      output = tslite.timeseries()
+      output.loadBinary(path)
+      return output
+    t0 = clock(load, old)[0]
+    t1 = clock(load, packed)[0]
+    report("archive/load_vs_iff", t0, t1)
+    t0 = clock(load, raw)[0]
+    report("archive/load_vs_raw", t0, t1)
+    day = start + datetime.timedelta(minutes=15 * (n // 2))
+    stored = tslite.binaryfile(packed)
+    t1 = clock(stored.read, day, day + datetime.timedelta(days=1))[0]
+    stored.close()
+    report("archive/range_read_1_day", clock(load, packed)[0], t1)
+  finally:
+    for path in paths:
+      os.remove(path)
+
+
+@benchmark
+def sqlite(n):
+  '''writing and reading 10 series through a table per tsid and formatted INSERTs against sqlitestore'''
+  import shutil, sqlite3, tempfile
+  def oldSave(conn, series):
+    for (tsid, ts) in series:
+      cur = conn.cursor()
+      cur.execute("CREATE TABLE IF NOT EXISTS " + tsid + "(timestamp INTEGER PRIMARY KEY, val REAL, quality REAL)")
+      for line in ts.data:
+        cur.execute("INSERT OR REPLACE INTO " + tsid + " VALUES(%d,%f,%f)" %
+                    (int(time.mktime(line[0].timetuple())), line[1], line[2]))
+      conn.commit()
+      cur.close()
+
+  def oldLoad(conn, tsids, start_time, end_time):
+    output = {}
+    for tsid in tsids:
+      sqltxt = "SELECT * FROM " + tsid + " WHERE timestamp >= " + str(time.mktime(start_time.timetuple())) + \
+               " AND timestamp <= " + str(time.mktime(end_time.timetuple()))
+      ts = tslite.timeseries()
+      ts.extend([datetime.datetime.fromtimestamp(d[0]), d[1], d[2]] for d in conn.execute(sqltxt).fetchall())
+      output[tsid] = ts
+    return output
+
+  rand = random.Random(14)
+  start = datetime.datetime(2017, 1, 1)
+  series = []
+  for k in xrange(10):
+    rows = [[start + datetime.timedelta(minutes=15 * i), round(rand.uniform(0, 100), 2), 0] for i in xrange(n)]
+    series.append(("LOC%d_FLOW" % k, tslite.timeseries(rows)))
+  rows = 10 * n
+  folder = tempfile.mkdtemp()
+  try:
+    old = sqlite3.connect(os.path.join(folder, "old.db"))
+    t0 = clock(oldSave, old, series)[0]
+    store = tslite.sqlitestore(os.path.join(folder, "new.db"))
+    t1 = clock(store.writeMulti, series)[0]
+    report("sqlite/write", t0, t1)
+    print "%-28s %10.0f/s %9.0f/s" % ("sqlite/write_rows", rows / t0, rows / t1)
+    (end_time, tsids) = (start + datetime.timedelta(minutes=15 * (n - 1)), [tsid for (tsid, ts) in series])
+    t0 = clock(oldLoad, old, tsids, start, end_time)[0]
+    t1 = clock(store.readMulti, tsids, start, end_time)[0]
+    report("sqlite/read", t0, t1)
+    print "%-28s %10.0f/s %9.0f/s" % ("sqlite/read_rows", rows / t0, rows / t1)
+    old.close()
+    store.close()
+  finally:
+    shutil.rmtree(folder)
+
+
+###############################################################################
+
+if __name__ == "__main__":
+  p = argparse.ArgumentParser(description=__doc__,
+                              formatter_class=argparse.RawDescriptionHelpFormatter)
+  p.add_argument('-n', '--count', type=int, default=35040,
+                 help='Number of samples per benchmark (default one year of 15 minute data)')
+  p.add_argument('names', nargs='*', help='Benchmarks to run (default all)')
+  args = p.parse_args()
+  print "%-28s %11s %11s %9s" % ("benchmark", "old", "new", "speedup")
+  for f in benchmarks:
+    if not args.names or f.__name__ in args.names:
+      f(args.count)
@@ -0,0 +1,309 @@
+#!/usr/local/bin/python
+''' test_instapost - behaviour tests for the instapost script
+
+usage: python -m unittest discover -s instapost -p "test_*.py"
+
+The script imports cx_Oracle at load time, so these are skipped without it.
+'''
+
+import argparse, datetime, imp, json, os, shutil, sqlite3, StringIO, sys, tempfile, threading, time, unittest
+
+
+def loadInstapost():
+  '''imports the instapost script as a module without running it, or returns None without cx_Oracle'''
+  path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instapost")
+  sys.dont_write_bytecode = True  # don't leave an "instapostc" behind
+  try:
+    module = imp.load_source("instapost", path)
+  except ImportError:
+    return None
+  module.args = argparse.Namespace(verbose=False)
+  return module
+
+instapost = loadInstapost()
+
+
+class trickle:
+  '''a file that hands out one character per read, so every value straddles a refill'''
+
+  def __init__(self, text):
+    self.f = StringIO.StringIO(text)
+
+  def read(self, size=-1):
+    return self.f.read(1)
+
+
+@unittest.skipIf(instapost == None, "instapost needs cx_Oracle")
+class streamTests(unittest.TestCase):
+
+  def testJsonDocuments(self):
+    docs = [{"A.Stage": {"units": "ft", "timeseries": {"2017-06-02 13:00": 10.11, "2017-06-02 14:00": 12345678}},
+             "B.Flow": {"timeseries": {"2017-06-08T00:00:00Z": {"val": 30060.2, "qual": "PROTECTED"}}}},
+            None, {}, {"C.Stage": {"timeseries": None}}]
+    text = "\n---\n".join(json.dumps(doc, indent=1) for doc in docs) + "\n---\n"
+    expected = [("A.Stage", None, None, None), ("A.Stage", "2017-06-02 13:00", 10.11, None),
+                ("A.Stage", "2017-06-02 14:00", 12345678, None), ("B.Flow", None, None, None),
+                ("B.Flow", "2017-06-08T00:00:00Z", 30060.2, "PROTECTED"), ("C.Stage", None, None, None)]
+    for infile in (StringIO.StringIO(text), trickle(text)):
+      stream = instapost.jsonStream(infile)
+      self.assertEqual(sorted(stream.records()), expected)
+      self.assertEqual(stream.documents, 4)
+
+  def testJsonSeriesArriveBeforeTheDocumentEnds(self):
+    stream = instapost.jsonStream(StringIO.StringIO('{"A": {"timeseries": {"x": 1}}, "B": '))
+    records = stream.records()
+    self.assertEqual(records.next(), ("A", "x", 1, None))
+    self.assertEqual(records.next(), ("A", None, None, None))
+    self.assertRaises(ValueError, records.next)
+
+  def testJsonRejectsOtherDocuments(self):
+    for text in ('[1, 2]', '{"A": 1}', '{"A": {"timeseries": {}} "B": {}}'):
+      self.assertRaises(ValueError, list, instapost.jsonStream(StringIO.StringIO(text)).records())
+
+  def testYamlScalarsResolveAsSafeLoad(self):
+    text = ("A:\n  units: ft\n  timeseries:\n"
+            "    '2017-06-02 13:00': .nan\n"
+            "    '2017-06-02 14:00': '10.5'\n"
+            "    '2017-06-02 15:00': 0x1A\n"
+            "    2017-06-08T00:00:00Z: {val: .inf, qual: ~}\n"
+            "B:\n  timeseries: ~\n")
+    stream = instapost.yamlStream(StringIO.StringIO(text))
+    records = list(stream.records())
+    self.assertNotEqual(records[0][2], records[0][2])  # .nan
+    self.assertEqual(records[1][1:], ("2017-06-02 14:00", "10.5", None))
+    self.assertEqual(records[2][2], 26)
+    self.assertEqual(records[3][1].utcoffset(), datetime.timedelta(0))
+    self.assertEqual(records[3][2:], (float("inf"), None))
+    self.assertEqual(stream.meta["B"], {"timeseries": None})
+
+  def testYamlRejectsUnknownTags(self):
+    stream = instapost.yamlStream(StringIO.StringIO("A:\n  timeseries:\n    x: !!python/object 1\n"))
+    self.assertRaises(Exception, list, stream.records())
+
+
+class counted:
+  '''a log parameter that counts how often it is formatted'''
+
+  def __init__(self):
+    self.formatted = 0
+
+  def __str__(self):
+    self.formatted += 1
+    return "counted"
+
+
+@unittest.skipIf(instapost == None, "instapost needs cx_Oracle")
+class logTests(unittest.TestCase):
+
+  def setUp(self):
+    self.lines = []
+    self.writeLog, instapost.writeLog = instapost.writeLog, lambda output, line: self.lines.append(line)
+
+  def tearDown(self):
+    instapost.writeLog = self.writeLog
+    instapost.args.verbose = False
+
+  def testParamsAreOnlyFormattedWhenLogged(self):
+    param = counted()
+    instapost.log("Processing: %s", param)
+    self.assertEqual((param.formatted, self.lines), (0, []))
+    instapost.args.verbose = True
+    instapost.log("Processing: %s", param)
+    instapost.log("100% of %s", level="WARN")  # no params, no formatting
+    self.assertEqual(param.formatted, 1)
+    self.assertEqual([line.split("\t")[1:] for line in self.lines],
+                     [["MSG", "Processing: counted\n"], ["WARN", "100% of %s\n"]])
+
+  def testTimestampsFollowTheWallClock(self):
+    wallclock = time.time
+    try:
+      start = instapost.monotonic()
+      time.time = lambda: 1496408400.25  # the clock was stepped, or the host slept
+      self.assertEqual(instapost.timestamp(),
+                       time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(1496408400)) + ".250000")
+    finally:
+      time.time = wallclock
+    self.assertTrue(0 <= instapost.monotonic() - start < 60)  # durations don't see the step
+
+
+@unittest.skipIf(instapost == None, "instapost needs cx_Oracle")
+class processTests(unittest.TestCase):
+
+  def setUp(self):
+    instapost.profiler = instapost.stageProfile()
+
+  def tearDown(self):
+    instapost.profiler = None
+
+  def testHardsnapWhileProfiling(self):
+    opts = argparse.Namespace(snap=None, hardsnap="1h")
+    rows = [("2017-06-02 13:10", 1.0, None), ("2017-06-02 14:05", 2.0, None)]
+    (tsid, units, ts) = instapost.process("A.Stage", {"units": "ft"}, rows, opts, None)
+    self.assertEqual([(row[0].hour, row[0].minute, row[1]) for row in ts.data], [(13, 0, 1.0), (14, 0, 2.0)])
+    stages = instapost.profiler.metrics()["tsids"]["A.Stage"]
+    self.assertEqual(sorted(stages), ["snap", "timestamps"])
+    self.assertTrue(0 <= stages["snap"] < 60)
+
+
+@unittest.skipIf(instapost == None, "instapost needs cx_Oracle")
+class batchTests(unittest.TestCase):
+
+  def service(self, batchSize, flushInterval):
+    ds = instapost.dataService()
+    ds.configuration.update(batchSize=batchSize, flushInterval=flushInterval)
+    ds.flushed = []
+    def flush():
+      ds.flushed.append(len(ds.pending))
+      ds.pending = []
+    ds.flush = flush
+    return ds
+
+  def testZeroIntervalOnlyFlushesFullBatches(self):
+    ds = self.service(3, 0)
+    for i in xrange(7):
+      ds.queue("A%d" % i, "ft", [0], [1.0], [0])
+    self.assertEqual(ds.flushed, [3, 3])
+    self.assertEqual(len(ds.pending), 1)
+
+  def testIntervalFlushesStaleBatches(self):
+    ds = self.service(100, 60)
+    ds.queue("A", "ft", [0], [1.0], [0])
+    self.assertEqual(ds.flushed, [])
+    ds.pendingSince -= 61
+    ds.queue("B", "ft", [0], [1.0], [0])
+    self.assertEqual(ds.flushed, [2])
+
+  def testShippedConfigurationMatchesDefaults(self):
+    shipped = instapost.conf
+    defaults = instapost.dataService().getDefaultConfiguration()
+    for key in ("batchSize", "flushInterval", "prefetchSize"):
+      self.assertEqual(shipped[key], defaults[key], key)
+    self.assertEqual(shipped.get("cacheFile", defaults["cacheFile"]), "")  # the cache is opt in
+
+  def testDocumentsAreReadInOneQueryByDefault(self):
+    ds = instapost.dataService()
+    (reads, stored) = ([], [])
+    ds.readTSMulti = lambda requests: reads.append([r[0] for r in requests]) or \
+        dict((r[0].upper(), []) for r in requests)
+    ds.readSeries = lambda tsid, start_time, end_time, units: self.fail("read %s on its own" % tsid)
+    ds.writeToCWMS = lambda tsid, units, diff, cached=None: stored.append(tsid)
+    doc = dict(("Loc%d.Stage" % i, {"units": "ft", "timeseries": {"2017-06-02 13:00": i}}) for i in xrange(3))
+    opts = argparse.Namespace(jobs=1, json=True, snap=None, hardsnap=None)
+    writeLog, instapost.writeLog = instapost.writeLog, lambda output, line: None
+    try:
+      instapost.post(ds, StringIO.StringIO(json.dumps(doc)), opts, None)
+    finally:
+      instapost.writeLog = writeLog
+    self.assertEqual([sorted(tsids) for tsids in reads], [sorted(doc)])
+    self.assertEqual(sorted(stored), sorted(doc))
+
+
+@unittest.skipIf(instapost == None, "instapost needs cx_Oracle")
+class cacheTests(unittest.TestCase):
+
+  def testCachesWhatTheDatabaseWillHold(self):
+    ds = instapost.dataService()
+    ds.configuration["diffAbsTolerance"] = 0.01
+    stored = []
+    ds.writeToCWMS = lambda tsid, units, diff, cached=None: stored.append((diff, cached))
+    tz = instapost.pytz.utc
+    t = [datetime.datetime(2017, 6, 2, h, tzinfo=tz) for h in xrange(4)]
+    dbts = instapost.tslite.timeseries([[t[0], 1.0, 0], [t[1], 2.0, 0], [t[2], 3.0, 0]])
+    ts = instapost.tslite.timeseries([[t[1], 2.001, 0], [t[2], 3.5, 5], [t[3], 4.0, 0]])
+    ds.writeDiff("A.Stage", "ft", ts, dbts, cacheable=True)
+    (diff, cached) = stored[0]
+    self.assertEqual([row[0] for row in diff], t[2:])
+    #2.001 is within tolerance so 2.0 stays stored, and t[2] is stored as a null
+    self.assertEqual(cached, (t[1], t[3], [[t[0], 1.0, 0], [t[1], 2.0, 0], [t[3], 4.0, 0]]))
+
+  def testCacheWindows(self):
+    folder = tempfile.mkdtemp()
+    try:
+      path = os.path.join(folder, "cache.db")
+      legacy = sqlite3.connect(path)
+      legacy.execute("CREATE TABLE coverage (tsid TEXT PRIMARY KEY, start INTEGER, end INTEGER, updated REAL)")
+      legacy.execute("CREATE TABLE vals (tsid TEXT, t INTEGER, val REAL, qual INTEGER, PRIMARY KEY (tsid, t))")
+      legacy.execute("INSERT INTO coverage VALUES ('A.STAGE', 0, 2000000000, ?)", (time.time(),))
+      legacy.commit()
+      legacy.close()
+      cache = instapost.postCache(path, 3600)
+      t = [datetime.datetime(2017, 6, 2, h, tzinfo=instapost.pytz.utc) for h in xrange(6)]
+      self.assertEqual(cache.lookup("A.Stage", t[0], t[1]), ([], t[0], t[1]))  # the old cache was dropped
+      cache.store("a.stage", t[1], t[3], [[t[1], 1.0, 0], [t[3], 3.0, 3]])
+      cache.store("A.Stage", t[3], t[4], [[t[4], 4.0, 0]])
+      self.assertEqual(cache.lookup("A.Stage", t[1], t[4]), ([[t[1], 1.0, 0], [t[4], 4.0, 0]], None, None))
+      self.assertEqual(cache.lookup("A.Stage", t[2], t[5]), ([[t[4], 4.0, 0]], t[4], t[5]))
+      cache.invalidate("A.Stage")
+      self.assertEqual(cache.lookup("A.Stage", t[2], t[3]), ([], t[2], t[3]))
+      cache.close()
+    finally:
+      shutil.rmtree(folder)
+
+
+@unittest.skipIf(instapost == None, "instapost needs cx_Oracle")
+class serveTests(unittest.TestCase):
+
+  def testFeedsClaimTheirSessionsAllAtOnce(self):
+    budget = instapost.sessionBudget(4)
+    budget.acquire(3)  # a feed with --jobs 2
+    started = []
+    waiting = threading.Thread(target=lambda: (budget.acquire(3), started.append(True)))
+    waiting.start()
+    time.sleep(0.05)
+    self.assertEqual((started, budget.free), ([], 1))  # the second feed takes nothing while it waits
+    budget.release(3)
+    waiting.join(1)
+    self.assertEqual((started, budget.free), ([True], 1))
+
+
+class recordingSession:
+  '''a dataService session that records which thread posted each series'''
+
+  def __init__(self, posted):
+    self.posted = posted
+    self.status = "OK"
+    self.dbconn = None
+
+  def writeDiffs(self, series):
+    for (tsid, units, ts) in series:
+      time.sleep(0.001)
+      self.posted.append((threading.current_thread().name, tsid, ts[0][1]))
+
+  def flush(self):
+    pass
+
+
+@unittest.skipIf(instapost == None, "instapost needs cx_Oracle")
+class poolTests(unittest.TestCase):
+
+  def setUp(self):
+    self.lines = []
+    self.writeLog, instapost.writeLog = instapost.writeLog, lambda output, line: self.lines.append(line)
+    instapost.args.verbose = True
+
+  def tearDown(self):
+    instapost.writeLog = self.writeLog
+    instapost.args.verbose = False
+
+  def testSeriesOfOneTsidArePostedInOrderByOneThread(self):
+    posted = []
+    ds = instapost.dataService()
+    ds.configuration["prefetchSize"] = 2
+    ds.session = lambda: recordingSession(posted)
+    opts = argparse.Namespace(snap=None, hardsnap=None)
+    manifest = {"A": "X", "B": "X", "C": "C", "D": "D"}  # A and B both post to X
+    pool = instapost.workerPool(ds, 3, opts, manifest)
+    for i in xrange(40):
+      pool.submit("ABCD"[i % 4], {}, [("2017-06-02 13:00", i, None)])
+    pool.close()
+    self.assertEqual(len(posted), 40)
+    for tsid in ("X", "C", "D"):
+      mine = [p for p in posted if p[1] == tsid]
+      self.assertEqual(len(set(p[0] for p in mine)), 1, tsid)
+      self.assertEqual([p[2] for p in mine], sorted(p[2] for p in mine), tsid)
+    #process() runs on the worker, so its lines come back through the batch buffers
+    self.assertEqual(len([line for line in self.lines if "\tProcessing: " in line]), 40)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,630 @@
+#!/usr/local/bin/python
+''' test_tslite - behaviour tests for tslite
+
+usage: python -m unittest discover -s instapost -p "test_*.py"
+'''
+
+import copy, datetime, functools, math, operator, os, pickle, random, shutil, sqlite3, struct, sys, tempfile, time
+import unittest
+import dateutil.parser, dateutil.tz
+import tslite
+try:
+  import pytz
+except ImportError:
+  pytz = None
+
+
+def hours(*rows):
+  '''timeseries of (hour, value[, quality]) rows on 2017-06-02'''
+  return tslite.timeseries([[datetime.datetime(2017, 6, 2, row[0]), row[1], row[2] if len(row) > 2 else 0]
+                            for row in rows])
+
+
+def hourly(ts):
+  '''the (hour, value, quality) rows of ts'''
+  return [(row[0].hour, row[1], row[2]) for row in ts.data]
+
+
+def bothPaths(test):
+  '''runs test on the pure Python code paths and, if numpy is available, on the vectorized ones'''
+  @functools.wraps(test)
+  def wrapper(self):
+    saved = tslite._NUMPY_MIN
+    try:
+      for size in ((sys.maxint, 0) if tslite._NUMPY_AVAILABLE else (sys.maxint,)):
+        tslite._NUMPY_MIN = size
+        test(self)
+    finally:
+      tslite._NUMPY_MIN = saved
+  return wrapper
+
+
+@unittest.skipIf(pytz == None, "timezone tests need pytz")
+class timeparserTests(unittest.TestCase):
+
+  def setUp(self):
+    self.tz = pytz.timezone("US/Pacific")
+
+  def legacy(self, text):
+    t = dateutil.parser.parse(text, fuzzy=True)
+    return self.tz.localize(t) if t.tzinfo == None else t
+
+  def testFormatsAgreeWithDateutilAcrossDst(self):
+    stamps = []
+    for day in (datetime.datetime(2017, 3, 11, 12), datetime.datetime(2017, 11, 4, 12)):
+      stamps.extend(day + datetime.timedelta(minutes=15 * i) for i in xrange(96))
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%SZ", "%m/%d/%Y %H:%M", "%d-%b-%Y %H%M"):
+      parser = tslite.timeparser(self.tz)
+      for t in stamps:
+        text = t.strftime(fmt)
+        (a, b) = (parser.parse(text), self.legacy(text))
+        self.assertEqual((a, a.utcoffset()), (b, b.utcoffset()), text)
+      self.assertEqual((parser.hits, parser.misses), (len(stamps), 0))
+
+  def testOffsetsFractionsAndFallback(self):
+    parser = tslite.timeparser(self.tz)
+    for text in ("2017-06-02T10:30:00+05:30", "2017-06-02 10:30-0800", "2017-06-02T10:30:00.25Z", "2017-06-02"):
+      self.assertEqual(parser.parse(text), self.legacy(text), text)
+    self.assertEqual(parser.parse("June 2, 2017 10:30"), self.legacy("June 2, 2017 10:30"))
+    self.assertEqual(parser.misses, 1)
+    t = datetime.datetime(2017, 1, 1, 4)
+    self.assertEqual(parser.parse(t), self.tz.localize(t))
+
+
+class rowTests(unittest.TestCase):
+
+  def testRowsAreReadOnly(self):
+    ts = hours((0, 1.0), (1, 2.0))
+    for row in (ts.data[0], ts[0], iter(ts.data).next(), ts.data[0:1][0]):
+      self.assertRaises(TypeError, row.__setitem__, 1, 5.0)
+      self.assertRaises(TypeError, row.append, 5.0)
+    self.assertEqual(hourly(ts), [(0, 1.0, 0), (1, 2.0, 0)])
+
+  def testRowsStillCompareCopyAndPickleAsLists(self):
+    ts = hours((0, 1.0, 3))
+    row = ts.data[0]
+    self.assertEqual(row, [datetime.datetime(2017, 6, 2, 0), 1.0, 3])
+    self.assertEqual(pickle.loads(pickle.dumps(row, 2)), row)
+    self.assertEqual(copy.deepcopy(row), row)
+    changed = list(row)
+    changed[1] = 5.0
+    ts.data[0] = changed
+    self.assertEqual(hourly(ts), [(0, 5.0, 3)])
+
+  def testDataRoundTripsRows(self):
+    for tz in (None, dateutil.tz.tzutc(), dateutil.tz.tzoffset(None, -8 * 3600)):
+      start = datetime.datetime(2017, 1, 1, tzinfo=tz)
+      rows = [[start + datetime.timedelta(minutes=15 * i), i / 7.0, i * 1000003 % 2147483647] for i in xrange(300)]
+      ts = tslite.timeseries(rows)
+      self.assertEqual(ts.data[:], rows)
+      self.assertEqual([row[0].utcoffset() for row in ts.data[::100]], [row[0].utcoffset() for row in rows[::100]])
+
+  def testSlicesAreListsOfRows(self):
+    ts = hours((0, 1.0), (1, 2.0), (2, 3.0))
+    self.assertEqual(ts[1:], ts.data[1:])
+    self.assertEqual([row[1] for row in ts[::2]], [1.0, 3.0])
+    self.assertEqual(ts[-1][1], 3.0)
+    self.assertEqual(ts[3], [None, None, None])
+
+  def testTimesAreWholeSeconds(self):
+    t = datetime.datetime(2017, 6, 2, 0, 0, 0, 999999)
+    ts = tslite.timeseries([[t, 1.0, 0], [t.replace(microsecond=1), 2.0, 0]])
+    self.assertEqual(ts.data, [[t.replace(microsecond=0), 2.0, 0]])
+
+
+class extendTests(unittest.TestCase):
+
+  def inserted(self, ts, rows):
+    for row in rows:
+      ts.insert(row[0], row[1], quality=row[2])
+    return ts
+
+  def testExtendMatchesInsertingEachRow(self):
+    rand = random.Random(2)
+    start = datetime.datetime(2017, 1, 1, tzinfo=dateutil.tz.tzutc())
+    def rows(n):
+      return [[start + datetime.timedelta(minutes=15 * rand.randint(0, 200)), rand.choice((1.5, None, rand.random())),
+               rand.choice((0, 3, 2 ** 32 - 3))] for i in xrange(n)]
+    for (base, more) in ((0, 300), (100, 10), (100, 300), (50, 0)):  # empty, per row and merged inserts
+      for feed in (rows(more), sorted(rows(more)), [[start + datetime.timedelta(days=9), 1.0, 0]] * 3 + rows(more)):
+        existing = rows(base)
+        (a, b) = (self.inserted(tslite.timeseries(), existing), tslite.timeseries().extend(existing))
+        self.assertEqual(self.inserted(a, feed).data[:], b.extend(feed).data[:])
+
+  def testLaterRowsWin(self):
+    ts = hours((1, 1.0)).extend([[datetime.datetime(2017, 6, 2, h), v, 0] for (h, v) in ((2, 2.0), (1, 3.0), (2, 4.0))])
+    self.assertEqual(hourly(ts), [(1, 3.0, 0), (2, 4.0, 0)])
+
+
+class diffTests(unittest.TestCase):
+
+  @bothPaths
+  def testDefaultComparesSixDecimals(self):
+    db = hours((0, 1.0), (1, 1.0), (2, 2.0), (3, 3.0), (4, 4.0))
+    db.values[3] = float("nan")
+    feed = hours((1, 1.0000001), (2, 2.00001), (3, 0.0), (4, 4.0), (5, 5.0))
+    feed.values[2] = float("nan")
+    self.assertEqual(hourly(db.diff(feed)), [(2, 2.00001, 0), (5, 5.0, 0)])
+
+  @bothPaths
+  def testTolerance(self):
+    db = hours((0, 2.0), (1, 2.0), (2, 100.0), (3, 100.0))
+    feed = hours((0, 2.005), (1, 2.02), (2, 105.0), (3, 120.0))
+    self.assertEqual(hourly(db.diff(feed, atol=0.01)), [(1, 2.02, 0), (2, 105.0, 0), (3, 120.0, 0)])
+    self.assertEqual(hourly(db.diff(feed, rtol=0.1)), [(3, 120.0, 0)])
+    self.assertEqual(hourly(db.diff(feed, atol=0.01, rtol=0.1)), [(3, 120.0, 0)])
+
+  @bothPaths
+  def testQualityOnlyChanges(self):
+    db = hours((0, 1.0, 0), (1, 2.0, 3))
+    feed = hours((0, 1.0, 3), (1, 2.0, 3))
+    self.assertEqual(hourly(db.diff(feed)), [])
+    self.assertEqual(hourly(db.diff(feed, quality=True)), [(0, 1.0, 3)])
+    self.assertEqual(hourly(db.diff(feed, atol=0.5, quality=True)), [(0, 1.0, 3)])
+
+
+class blendTests(unittest.TestCase):
+
+  def setUp(self):
+    self.observed = hours((0, 1.0, 3), (1, 1.0, 3), (2, 1.0, 17))
+    self.forecast = hours((1, 2.0, 0), (2, 2.0, 9), (3, 2.0, 0))
+    self.revised = hours((1, 3.0, 3), (3, 3.0, 17))
+    self.series = [self.observed, tslite.timeseries(), self.forecast, self.revised]
+
+  @bothPaths
+  def testLastAndFirst(self):
+    self.assertEqual(hourly(tslite.blend(self.series)), [(0, 1.0, 3), (1, 3.0, 3), (2, 2.0, 9), (3, 3.0, 17)])
+    self.assertEqual(hourly(tslite.blend(self.series, "first")),
+                     [(0, 1.0, 3), (1, 1.0, 3), (2, 1.0, 17), (3, 2.0, 0)])
+    self.assertEqual(hourly(self.observed.merge(self.forecast)), [(0, 1.0, 3), (1, 2.0, 0), (2, 2.0, 9), (3, 2.0, 0)])
+    self.assertEqual(hourly(self.observed.merge(self.forecast, "first")),
+                     [(0, 1.0, 3), (1, 1.0, 3), (2, 1.0, 17), (3, 2.0, 0)])
+
+  @bothPaths
+  def testQualityThenLatest(self):
+    #screened okay beats unscreened beats questionable beats missing beats rejected; ties go to the latest
+    self.assertEqual(hourly(tslite.blend(self.series, "quality")),
+                     [(0, 1.0, 3), (1, 3.0, 3), (2, 2.0, 9), (3, 2.0, 0)])
+    self.assertEqual([tslite.qualityRank(q) for q in (17, 5, 9, 0, 3, -2147483645)], [0, 1, 2, 3, 4, 4])
+
+  def testRankFunction(self):
+    self.assertEqual(hourly(tslite.blend(self.series, lambda q: -q)),
+                     [(0, 1.0, 3), (1, 2.0, 0), (2, 2.0, 9), (3, 2.0, 0)])
+
+
+class resampleTests(unittest.TestCase):
+
+  def setUp(self):
+    self.ts = hours((0, 1.0, 3), (1, 3.0), (2, 0.0, 8), (3, 5.0, 4), (5, 7.0))
+    self.ts.values[2] = float("nan")
+
+  @bothPaths
+  def testBucketsSkipMissingValuesAndEmptyBuckets(self):
+    hows = ["mean", "sum", "min", "max", "count", "first", "last"]
+    out = self.ts.resample(datetime.timedelta(hours=2), hows)
+    self.assertEqual(dict((how, hourly(ts)) for (how, ts) in zip(hows, out)),
+                     {"mean": [(2, 2.0, 3), (4, 5.0, 4), (6, 7.0, 0)], "sum": [(2, 4.0, 3), (4, 5.0, 4), (6, 7.0, 0)],
+                      "min": [(2, 1.0, 3), (4, 5.0, 4), (6, 7.0, 0)], "max": [(2, 3.0, 3), (4, 5.0, 4), (6, 7.0, 0)],
+                      "count": [(2, 2, 3), (4, 1, 4), (6, 1, 0)], "first": [(2, 1.0, 3), (4, 5.0, 4), (6, 7.0, 0)],
+                      "last": [(2, 3.0, 3), (4, 5.0, 4), (6, 7.0, 0)]})
+    self.assertEqual(hourly(self.ts.resample(datetime.timedelta(hours=2), lambda w: len(w))), hourly(out[4]))
+
+  @bothPaths
+  def testAnchorLabelAndCalendarDays(self):
+    out = self.ts.resample(datetime.timedelta(hours=2), anchor=datetime.datetime(2017, 6, 2, 1), label="start")
+    self.assertEqual([(row[0], row[1]) for row in out.data],
+                     [(datetime.datetime(2017, 6, 1, 23), 1.0), (datetime.datetime(2017, 6, 2, 1), 3.0),
+                      (datetime.datetime(2017, 6, 2, 3), 5.0), (datetime.datetime(2017, 6, 2, 5), 7.0)])
+    start = datetime.datetime(2017, 6, 2, 1)
+    days = tslite.timeseries([[start + datetime.timedelta(hours=i), float(i), 0] for i in xrange(48)])
+    self.assertEqual([(row[0], row[1]) for row in days.resample("day").data],
+                     [(datetime.datetime(2017, 6, 3), 11.0), (datetime.datetime(2017, 6, 4), 34.5),
+                      (datetime.datetime(2017, 6, 5), 47.0)])
+
+
+class arithmeticTests(unittest.TestCase):
+
+  @bothPaths
+  def testSeriesOperandsLineUpOnSharedTimes(self):
+    outflow = hours((0, 10.0, 3), (1, 20.0), (2, 0.0), (3, 40.0, 5))
+    outflow.values[2] = float("nan")
+    inflow = hours((1, 5.0, 9), (2, 1.0), (3, 0.0), (4, 1.0))
+    inflow.values[2] = float("nan")
+    self.assertEqual(hourly(outflow.subtract(inflow)), [(1, 15.0, 0), (2, None, 0)])
+    self.assertEqual(hourly(outflow.operation(operator.sub, 1.0, reverse=True)),
+                     [(0, -9.0, 3), (1, -19.0, 0), (2, None, 0), (3, -39.0, 5)])
+    self.assertEqual(hourly(outflow.operation(lambda x, y: x - y if x > 15 else None, inflow)), [(1, 15.0, 0)])
+
+  @bothPaths
+  def testPercentLeavesOutZeroDenominators(self):
+    ts = hours((0, 1.0), (1, 2.0, 3), (2, 3.0, 4)).percent(hours((0, 4.0), (1, 0.0), (2, -6.0)))
+    self.assertEqual(hourly(ts), [(0, 25.0, 0), (2, -50.0, 4)])
+    self.assertEqual(hourly(hours((0, 1.0), (1, 2.0)).div(0.0)), [])
+
+
+class climatologyTests(unittest.TestCase):
+
+  def setUp(self):
+    rows = [((2015, 10, 1), 1.0, 0), ((2016, 10, 1), 3.0, 0), ((2017, 10, 1), 8.0, 3), ((2016, 2, 29), 5.0, 0),
+            ((2016, 3, 1), 6.0, 0), ((2017, 3, 1), 2.0, 0), ((2015, 3, 1), 0.0, 0)]
+    self.ts = tslite.timeseries([[datetime.datetime(*day + (12,)), v, q] for (day, v, q) in rows])
+    self.ts.values[0] = float("nan")  # 2015-03-01, water year 2015
+
+  def days(self, ts):
+    return [(row[0].timetuple()[:4], row[1], row[2]) for row in ts.data]
+
+  @bothPaths
+  def testStatisticsAcrossWaterYears(self):
+    out = self.ts.climatology(["mean", "median", "min", "max", "count", 90])
+    self.assertEqual([self.days(ts) for ts in out],
+                     [[((2017, 10, 1, 12), v, 0), ((2018, 3, 1, 12), w, 0)]
+                      for (v, w) in ((4.0, 4.0), (3.0, 4.0), (1.0, 2.0), (8.0, 6.0), (3, 2), (7.0, 5.6))])
+    self.assertEqual(self.days(self.ts.climatology("mean", endWY=2017)),
+                     [((2016, 10, 1, 12), 2.0, 0), ((2017, 3, 1, 12), 4.0, 0)])
+    self.assertEqual(self.days(self.ts.climatology("mean", 2016, 2016)),
+                     [((2015, 10, 1, 12), 1.0, 0), ((2016, 2, 29, 12), 5.0, 0), ((2016, 3, 1, 12), 6.0, 0)])
+
+  @bothPaths
+  def testAverageWYCoversTheLastWaterYear(self):
+    self.assertEqual(self.days(self.ts.averageWY()), [((2017, 10, 1, 12), 4.0, 3)])
+
+
+class statisticsTests(unittest.TestCase):
+
+  @bothPaths
+  def testMomentsIgnoreMissingValues(self):
+    ts = hours((0, 1.0, 3), (1, 3.0), (2, 0.0), (3, 5.0), (4, 7.0, 4))
+    ts.values[2] = float("nan")
+    stats = ts.statistics((10, 50, 100))
+    (first, last) = (datetime.datetime(2017, 6, 2, 0), datetime.datetime(2017, 6, 2, 4))
+    self.assertEqual((stats["count"], stats["mean"], stats["variance"], stats["min"], stats["max"]),
+                     (4, 4.0, 5.0, [first, 1.0, 3], [last, 7.0, 4]))
+    self.assertEqual([round(stats["percentiles"][p], 9) for p in (10, 50, 100)], [1.6, 4.0, 7.0])
+    self.assertEqual((ts.variance(), ts.stddev()[1], ts.globalAverage()[1]), ([last, 5.0, 0], math.sqrt(5.0), 4.0))
+    offset = ts.add(1e9).statistics()
+    self.assertAlmostEqual(offset["variance"], 5.0, places=6)
+    self.assertRaises(ValueError, ts.statistics, (101,))
+    self.assertEqual((tslite.timeseries().statistics(), tslite.timeseries().linreg()), (None, (0, 0, 0)))
+
+  @bothPaths
+  def testLinregFitsALine(self):
+    ts = hours(*[(h, 1.0 + h / 2.0) for h in xrange(6)])
+    (m, b, r) = ts.linreg()
+    self.assertAlmostEqual(m * 3600, 0.5, places=9)
+    self.assertAlmostEqual(m * ts.times[0] + b, 1.0, places=5)
+    self.assertAlmostEqual(r, 1.0, places=9)
+    self.assertEqual(hours((0, 2.0), (1, 2.0)).linreg()[::2], (0.0, 0.0))
+    self.assertEqual(hours((0, 2.0)).linreg(), (0.0, 0.0, 0.0))
+
+
+class windowTests(unittest.TestCase):
+
+  def setUp(self):
+    self.ts = hours((0, 1.0, 0), (1, 2.0, 1), (2, 0.0, 2), (3, 4.0, 3), (5, 8.0, 4))
+    self.ts.values[2] = float("nan")
+    self.span = datetime.timedelta(hours=2)
+
+  @bothPaths
+  def testCenteredWindow(self):
+    #each window runs an hour either side, missing values are skipped and the ends aren't cut off
+    self.assertEqual(hourly(self.ts.centerMovingAverage(self.span)),
+                     [(0, 1.5, 0), (1, 1.5, 1), (2, 3.0, 2), (3, 4.0, 3), (5, 8.0, 4)])
+    self.assertEqual([row[1] for row in self.ts.movingcount(self.span, "center").data], [2, 2, 2, 1, 1])
+    self.assertEqual([row[1] for row in self.ts.movingmax(self.span, "center").data], [2.0, 2.0, 4.0, 4.0, 8.0])
+
+  @bothPaths
+  def testTrailingAndLeadingWindows(self):
+    self.assertEqual(hourly(self.ts.movingaverage(self.span)), [(2, 1.5, 2), (3, 3.0, 3), (5, 6.0, 4)])
+    self.assertEqual(hourly(self.ts.movingsum(self.span)), [(2, 3.0, 2), (3, 6.0, 3), (5, 12.0, 4)])
+    self.assertEqual(hourly(self.ts.movingmin(self.span)), [(2, 1.0, 2), (3, 2.0, 3), (5, 4.0, 4)])
+    #rollingaverage looks forward and labels each window with its end
+    self.assertEqual(hourly(self.ts.rollingaverage(self.span)), [(2, 1.5, 0), (3, 3.0, 1), (4, 4.0, 2), (5, 6.0, 3)])
+
+
+class snapTests(unittest.TestCase):
+
+  def series(self, *rows):
+    return tslite.timeseries([[datetime.datetime(2017, 6, 2) + datetime.timedelta(minutes=m), v, 0] for (m, v) in rows])
+
+  def snapped(self, ts):
+    return [((row[0] - datetime.datetime(2017, 6, 2)).seconds / 60, row[1]) for row in ts.data]
+
+  @bothPaths
+  def testClosestWithinTheBufferAndTheTrailingSlot(self):
+    ts = self.series((0, 0.0), (15, 1.0), (20, 2.0), (55, 3.0), (70, 4.0), (80, 5.0))
+    interval = datetime.timedelta(minutes=30)
+    #55 is 5 minutes before 60 and beats 70, 10 after; 80 snaps to 90, after the last timeslice
+    expected = [(0, 0.0), (30, 2.0), (60, 3.0), (90, 5.0)]
+    self.assertEqual(self.snapped(ts.snap(interval, interval / 2)), expected)
+    self.assertEqual(self.snapped(ts.snap(interval, interval * 2)), expected)  # buffer is at most half the interval
+    self.assertEqual(self.snapped(ts.snap2(interval, interval / 2)), expected)
+    self.assertEqual(self.snapped(ts.snap(interval, datetime.timedelta(minutes=5))), [(0, 0.0), (60, 3.0)])
+
+  @bothPaths
+  def testStarttimeAndTies(self):
+    ts = self.series((-20, 9.0), (50, 1.0), (70, 2.0), (105, 3.0))
+    start = datetime.datetime(2017, 6, 2)
+    #times before the first buffer are dropped, a tie goes to the earlier timeslice and a
+    #timeslice halfway between two snapped times to the earlier snapped time
+    self.assertEqual(self.snapped(ts.snap(datetime.timedelta(minutes=30), datetime.timedelta(minutes=15), start)),
+                     [(60, 1.0), (90, 3.0)])
+
+
+def minutes(ts):
+  '''the (minutes past midnight, value, quality) rows of ts'''
+  return [((row[0] - datetime.datetime(2017, 6, 2)).seconds / 60, row[1], row[2]) for row in ts.data]
+
+
+class regularizeTests(unittest.TestCase):
+
+  hour = datetime.timedelta(hours=1)
+
+  @bothPaths
+  def testInterpolateRunsThroughTheLastSample(self):
+    ts = hours((0, 0.0, 3), (1, 2.0, 0), (2, 0.0, 0), (3, 6.0, 9))
+    ts.values[2] = float("nan")  # interpolated across
+    self.assertEqual(minutes(ts.interpolate(self.hour / 2)),
+                     [(0, 0.0, 3), (30, 1.0, 3), (60, 2.0, 0), (90, 3.0, 0), (120, 4.0, 0), (150, 5.0, 0),
+                      (180, 6.0, 9)])
+
+  @bothPaths
+  def testInterpolateSingleGridTime(self):
+    self.assertEqual(minutes(hours((0, 1.0)).interpolate(self.hour)), [(0, 1.0, 0)])
+    short = tslite.timeseries([[datetime.datetime(2017, 6, 2, 0, m), float(m), 0] for m in (0, 20)])
+    self.assertEqual(minutes(short.interpolate(self.hour / 2)), [(0, 0.0, 0)])
+
+  @bothPaths
+  def testMaxgap(self):
+    ts = hours((0, 0.0), (1, 2.0), (4, 8.0))
+    self.assertEqual(minutes(ts.interpolate(self.hour / 2, maxgap=self.hour)),
+                     [(0, 0.0, 0), (30, 1.0, 0), (60, 2.0, 0), (240, 8.0, 0)])
+    self.assertEqual(minutes(hours((0, 1.0), (3, 2.0)).filldown(self.hour, maxgap=self.hour)),
+                     [(0, 1.0, 0), (180, 2.0, 0)])
+
+  @bothPaths
+  def testFilldown(self):
+    ts = hours((1, 5.0, 3), (3, 7.0, 0))
+    filled = [(60, 5.0, 3), (120, 5.0, 3), (180, 7.0, 0)]
+    self.assertEqual(minutes(ts.filldown(self.hour)), filled)
+    self.assertEqual(minutes(ts.filldown(self.hour, starttime=datetime.datetime(2017, 6, 2))), [(0, 0.0, 0)] + filled)
+    #filling runs on to the first interval at or after _endtime, or the offset after midnight
+    self.assertEqual(minutes(ts.filldown(self.hour, _endtime=datetime.datetime(2017, 6, 2, 4, 30))),
+                     filled + [(240, 7.0, 0), (300, 7.0, 0)])
+    self.assertEqual(minutes(ts.filldown(self.hour, offset=datetime.timedelta(hours=6))),
+                     filled + [(240, 7.0, 0), (300, 7.0, 0), (360, 7.0, 0)])
+
+
+@unittest.skipIf(not tslite._NUMPY_AVAILABLE, "qcstream needs numpy")
+class qcTests(unittest.TestCase):
+
+  def setUp(self):
+    rand = random.Random(11)
+    self.ts = tslite.timeseries([[datetime.datetime(2017, 6, 2) + datetime.timedelta(minutes=15 * i),
+                                  10 + rand.gauss(0, 1) + (rand.random() < 0.05) * 50, 0] for i in xrange(300)])
+
+  def join(self, parts):
+    output = tslite.timeseries()
+    for part in parts:
+      output.extendEpochs(part.times, part.values, part.qualities)
+    return output
+
+  @bothPaths
+  def testOutliersMatchTheLegacyLoop(self):
+    values = list(self.ts.values)
+    mean = math.fsum(values) / len(values)
+    limit = 1.5 * math.sqrt(math.fsum((v - mean) ** 2 for v in values) / (len(values) + 1))
+    kept = [mean]
+    for v in values:
+      if abs(v - kept[-1]) < limit:
+        kept.append(v)
+    screened = self.ts.remove_stddev_outliers(1.5)
+    self.assertEqual(list(screened.values), kept[1:])
+    self.assertTrue(0 < len(screened.times) < len(self.ts.times))
+
+  @bothPaths
+  def testSmoothingIsTheSameInAnyBatches(self):
+    whole = self.ts.savitzky_golay(5, 2)
+    self.assertEqual(list(whole.times), list(self.ts.times))  # the last timeslice is kept too
+    for size in (1, 2, 7, 300):
+      qc = tslite.qcstream(None, 5, 2)
+      parts = [qc.update(self.ts.indexSlice(k, k + size)) for k in xrange(0, 300, size)]
+      streamed = self.join(parts + [qc.flush()])
+      self.assertEqual(list(streamed.times), list(whole.times), size)
+      self.assertTrue(max(abs(x - y) for (x, y) in zip(streamed.values, whole.values)) < 1e-9, size)
+
+  def testSmoothingKeepsAQuadratic(self):
+    ts = tslite.timeseries([[datetime.datetime(2017, 6, 2, k), float(k * k), 3] for k in xrange(12)])
+    smoothed = ts.savitzky_golay(5, 2)
+    self.assertEqual([round(v, 9) for v in smoothed.values[2:-2]], [float(k * k) for k in xrange(2, 10)])
+    self.assertEqual(set(smoothed.qualities), set([0]))
+
+  @bothPaths
+  def testScreeningCarriesOverBatches(self):
+    qc = tslite.qcstream(1.5)
+    first = qc.update(self.ts.indexSlice(0, 200))
+    self.assertEqual(list(first.values), list(self.ts.indexSlice(0, 200).remove_stddev_outliers(1.5).values))
+    #the next batch is tested against the last value kept, whatever its own figures
+    later = tslite.timeseries([[datetime.datetime(2017, 6, 5, 0), 60.0, 0],
+                               [datetime.datetime(2017, 6, 5, 1), first.values[-1], 0]])
+    self.assertEqual(list(qc.update(later).values), [first.values[-1]])
+    self.assertEqual(len(qc.update(tslite.timeseries()).times), 0)
+
+
+class binaryTests(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.path = os.path.join(self.folder, "ts.bin")
+    utc = dateutil.tz.tzutc()
+    self.ts = tslite.timeseries([[datetime.datetime(2017, 6, 2, tzinfo=utc) + datetime.timedelta(minutes=m), v, q]
+                                 for (m, v, q) in ((0, 1.5, 0), (15, -0.0, 3), (45, 1e300, -2147483645),
+                                                   (60, 0.1, 17), (75, 2.0, 5), (1440, 3.0, 0))])
+    self.ts.values[4] = float("nan")
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def load(self, *window):
+    ts = tslite.timeseries()
+    ts.loadBinary(self.path, *window)
+    return ts
+
+  def assertSame(self, a, b):
+    self.assertEqual((list(a.times), [repr(v) for v in a.values], list(a.qualities)),
+                     (list(b.times), [repr(v) for v in b.values], list(b.qualities)))
+    self.assertEqual(a.data[0][0].utcoffset(), b.data[0][0].utcoffset())
+
+  def testRoundTrip(self):
+    self.ts.saveBinary(self.path, "A.Stage", "ft")
+    self.assertSame(self.load(), self.ts)
+    stored = tslite.binaryfile(self.path)
+    self.assertEqual((stored.version, len(stored), stored.tsid, stored.units, stored.compressed),
+                     (1, 6, "A.Stage", "ft", False))
+    if tslite._NUMPY_AVAILABLE:
+      (times, values, qualities) = stored.columns()
+      self.assertEqual((times.tolist(), qualities.tolist()), (list(self.ts.times), list(self.ts.qualities)))
+    stored.close()
+
+  def testRangeReads(self):
+    self.ts.saveBinary(self.path)
+    t = self.ts.datetimes()
+    self.assertSame(self.load(t[1], t[3]), self.ts.indexSlice(1, 4))  # both ends are included
+    self.assertSame(self.load(t[1] + datetime.timedelta(seconds=1), None), self.ts.indexSlice(2, 6))
+    minute = datetime.timedelta(minutes=1)
+    self.assertEqual(len(self.load(t[3] + minute, t[4] - minute).times), 0)
+
+  def testEmptyAndNewerFiles(self):
+    tslite.timeseries().saveBinary(self.path)
+    self.assertEqual(len(self.load().times), 0)
+    with open(self.path, "r+b") as f:
+      f.seek(8)
+      f.write(struct.pack("<I", 99))
+    self.assertRaises(ValueError, tslite.binaryfile, self.path)
+
+  def testLegacyRows(self):
+    with open(self.path, "wb") as f:
+      for h in (0, 1):
+        f.write(struct.pack("iff", time.mktime(datetime.datetime(2017, 6, 2, h).timetuple()), h + 0.5, 3))
+    self.assertEqual(self.load().data, [[datetime.datetime(2017, 6, 2, 0), 0.5, 3],
+                                        [datetime.datetime(2017, 6, 2, 1), 1.5, 3]])
+
+
+class archiveTests(binaryTests):
+
+  @bothPaths
+  def testChunksRoundTrip(self):
+    rand = random.Random(13)
+    rows = []
+    (t, stage) = (datetime.datetime(2017, 6, 2), 10.0)
+    for i in xrange(500):  # mostly regular times and slowly changing values, with jumps and gaps
+      t += datetime.timedelta(minutes=rand.choice((15, 15, 15, 15, 5, 60 * 24)), seconds=rand.choice((0, 0, 0, 1)))
+      stage = round(stage + rand.choice((0, 0, 0.01, -0.01, 1e6, -1e6)), 2)
+      rows.append([t, stage, rand.choice((0, 0, 0, 3, -2147483645))])
+    ts = tslite.timeseries(rows)
+    ts.values[7] = float("nan")
+    ts.values[8] = -0.0
+    for chunk in (1, 3, 128, 8192):
+      ts.saveBinary(self.path, "A.Stage", "ft", compress=True, chunk=chunk)
+      self.assertSame(self.load(), ts)
+      t = ts.datetimes()
+      self.assertSame(self.load(t[100], t[299]), ts.indexSlice(100, 300))
+      stored = tslite.binaryfile(self.path)
+      self.assertEqual((stored.compressed, len(stored), len(stored.chunks)), (True, 500, (500 + chunk - 1) // chunk))
+      stored.close()
+
+  def testRoundTrip(self):
+    self.ts.saveBinary(self.path, "A.Stage", "ft", compress=True)
+    self.assertSame(self.load(), self.ts)
+    stored = tslite.binaryfile(self.path)
+    self.assertEqual((len(stored), stored.tsid, stored.units, stored.compressed), (6, "A.Stage", "ft", True))
+    stored.close()
+
+  def testRangeReads(self):
+    self.ts.saveBinary(self.path, compress=True, chunk=2)
+    t = self.ts.datetimes()
+    self.assertSame(self.load(t[1], t[3]), self.ts.indexSlice(1, 4))
+    self.assertSame(self.load(t[1] + datetime.timedelta(seconds=1), None), self.ts.indexSlice(2, 6))
+
+  def testEmptyAndNewerFiles(self):
+    tslite.timeseries().saveBinary(self.path, compress=True)
+    self.assertEqual(len(self.load().times), 0)
+
+
+class sqliteTests(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.path = os.path.join(self.folder, "ts.db")
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def tables(self, conn):
+    return sorted(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+  def testRoundTrip(self):
+    ts = hours((0, 1.5, 3), (1, 0.0, 5), (2, 2.25, 0))
+    ts.values[1] = float("nan")
+    store = tslite.sqlitestore(self.path)
+    self.assertEqual(store.read("A.Stage"), None)
+    self.assertEqual(store.writeMulti([("A.Stage", ts, "ft"), ("b.flow", hours((5, 2.0)))]), 4)
+    self.assertEqual(store.catalog(), [("A.STAGE", "ft"), ("B.FLOW", None)])
+    out = store.read("a.stage")
+    self.assertEqual((list(out.times), list(out.qualities)), (list(ts.times), list(ts.qualities)))
+    self.assertEqual([repr(v) for v in out.values], ["1.5", "nan", "2.25"])
+    self.assertEqual(hourly(store.read("A.STAGE", *[datetime.datetime(2017, 6, 2, h) for h in (1, 2)])),
+                     [(1, None, 5), (2, 2.25, 0)])
+    store.write("A.Stage", hours((2, 9.0)), replace=True)
+    self.assertEqual(store.delete("b.flow"), 1)
+    self.assertEqual(sorted((k, hourly(v)) for (k, v) in store.readMulti(["A.Stage", "B.Flow", "C"]).items()),
+                     [("A.Stage", [(2, 9.0, 0)]), ("B.Flow", [])])
+    self.assertRaises(AttributeError, store.writeMulti, [("new", ts), ("bad", None)])
+    self.assertEqual(store.read("new"), None)  # rolled back
+    store.close()
+
+  def testReadMultiWindowsEverySeries(self):
+    store = tslite.sqlitestore(self.path)
+    store.writeMulti([("LOC%d_FLOW" % k, hours(*[(h, h + k / 10.0) for h in xrange(6)])) for k in xrange(3)])
+    (start, end) = [datetime.datetime(2017, 6, 2, h) for h in (2, 4)]
+    out = store.readMulti(["LOC%d_FLOW" % k for k in xrange(3)], start, end)
+    self.assertEqual(sorted((k, hourly(v)) for (k, v) in out.items()),
+                     [("LOC%d_FLOW" % k, [(h, h + k / 10.0, 0) for h in (2, 3, 4)]) for k in xrange(3)])
+    for (k, v) in out.items():
+      self.assertEqual(hourly(v), hourly(store.read(k, start, end)))
+    store.close()
+
+  def testHandedConnectionsAreLeftToTheCaller(self):
+    conn = sqlite3.connect(self.path)
+    journal = conn.execute("PRAGMA journal_mode").fetchone()
+    store = tslite.sqlitestore(conn)
+    self.assertEqual(store.read("A"), None)
+    self.assertEqual(self.tables(conn), [])  # reads don't create the schema
+    store.write("A", hours((0, 1.0)))
+    conn.execute("CREATE TABLE other (x)")
+    store.write("B", hours((0, 2.0)))
+    conn.rollback()
+    self.assertEqual(sorted(store.readMulti(["A", "B"])), ["A"])  # B went with the caller's rollback
+    store.write("C", hours((0, 3.0)))
+    other = sqlite3.connect(self.path)
+    self.assertEqual(other.execute("SELECT count(*) FROM tsids").fetchone()[0], 1)  # C isn't committed
+    store.close()
+    conn.commit()
+    self.assertEqual(other.execute("SELECT count(*) FROM tsids").fetchone()[0], 2)
+    self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone(), journal)
+
+  def testLegacyTablesLoadWithoutTheNewSchema(self):
+    ts = tslite.timeseries()
+    conn = ts.SQLITE3connect(self.path)
+    conn.execute("CREATE TABLE OLDTS (timestamp INTEGER PRIMARY KEY, val REAL, quality REAL)")
+    conn.execute("INSERT INTO OLDTS VALUES (?, 1.5, 0)", (time.mktime(datetime.datetime(2017, 6, 2).timetuple()),))
+    conn.commit()
+    self.assertEqual(ts.loadSQLITE3(conn, "OLDTS").data, [[datetime.datetime(2017, 6, 2), 1.5, 0]])
+    self.assertEqual(self.tables(conn), ["OLDTS"])
+    hours((0, 1.0)).saveSQLITE3(conn, "new.ts")
+    self.assertEqual(hourly(ts.loadSQLITE3(conn, "NEW.TS")), [(0, 1.0, 0)])
+    self.assertEqual(ts.getStatus(), "OK")
+    ts.SQLITE3disconnect(conn)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -5,9 +5,12 @@ v1.4.1
 Author: Gunnar Leffler
 '''
 
-import sys,os,time,datetime,struct,math,re
+import sys,os,time,datetime,struct,math,re,bisect,heapq,collections,operator,mmap,json,zlib
 import dateutil.parser as dateparser
+import dateutil.tz
+from array import array
 from functools import wraps
+from itertools import izip, repeat, groupby, chain
 
 ##Load optional libraries
 try:
@@ -63,22 +66,216 @@ def requires_heclib(f):
       return f(*args, **kwargs)
   return wrapper
 
-            
-class timeseries:
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_UTC_EPOCH = _EPOCH.replace(tzinfo = dateutil.tz.tzutc())
+_TIME_TYPE = "l" if array("l").itemsize == 8 else "d"  # 64 bit epoch seconds
+_NAN = float("nan")
+#tslite binary format: a header of magic, version, metadata length and count, JSON metadata padded
+#to 8 bytes, then little endian columns of int64 epoch seconds, float64 values and int32 qualities
+_BINARY_MAGIC = "TSLITE\x00\x00"
+_BINARY_HEADER = struct.Struct("<8sIIQ")
+_BINARY_VERSION = 1
+_LITTLE_ENDIAN = sys.byteorder == "little"
+#compressed variant: the same header and metadata followed by chunks (see encodeChunk) instead of columns
+_ARCHIVE_MAGIC = "TSLITEZ\x00"
+_ARCHIVE_CHUNK = 8192  # timeslices per chunk
+_CHUNK_HEADER = struct.Struct("<IqqIII")  # count, first and last time, length of each compressed stream
+_SQLITE_ROWS = 250  # rows per INSERT in sqlitestore, which spreads the per statement cost of sqlite3
+#days from October 1 to the first of each month (index 1-12) in a water year with a February 29th
+_WY_MONTH_DAYS = [None, 92, 123, 152, 183, 213, 244, 274, 305, 336, 0, 31, 61]
+_WY_MONTH_STARTS = sorted(_WY_MONTH_DAYS[1:]) # October first
+_NUMPY_MIN = 256  # timeslices below which numpy's per call overhead outweighs it
+#operator module functions that operation and cull apply to whole columns at once
+_UFUNCS = {}
+if _NUMPY_AVAILABLE:
+  _UFUNCS = {operator.add: np.add, operator.sub: np.subtract, operator.mul: np.multiply,
+             operator.div: np.divide, operator.truediv: np.true_divide, operator.pow: np.power,
+             operator.lt: np.less, operator.le: np.less_equal, operator.gt: np.greater,
+             operator.ge: np.greater_equal, operator.eq: np.equal, operator.ne: np.not_equal}
+
+
+class timeslicerow(list):
+  '''A [datetime, value, quality] row read from a timeseries. Rows are built
+     from the timeseries arrays on each access, so changing one could never
+     change the timeseries; rather than silently doing nothing, changing one
+     raises TypeError. Assign the row back with ts.data[i] = row, or take a
+     list(row) copy to work on.
+  '''
+  __slots__ = ()
+
+  def readonly (self, *args):
+    raise TypeError("timeslice rows are read only, assign to ts.data[i] instead")
+
+  __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = readonly
+  append = extend = insert = pop = remove = sort = reverse = readonly
+
+  def __reduce__ (self):
+    return (timeslicerow, (list(self),))
+
+
+class timeslices(object):
+  '''A list-like view of a timeseries as [datetime, value, quality] rows.
+     This is what timeseries.data returns, so code written against the old
+     nested list keeps working, except that the rows are read only, see
+     timeslicerow. Use data[i] = row, append or insert to change timeslices.
+  '''
+  __slots__ = ("ts",)
+
+  def __init__ (self, ts):
+    self.ts = ts
+
+  def __len__ (self):
+    return len(self.ts.times)
+
+  def __getitem__ (self, idx):
+    if isinstance(idx, slice):
+      return [self.ts.timeslice(i) for i in xrange(*idx.indices(len(self)))]
+    if idx < 0:
+      idx += len(self)
+    if idx < 0 or idx >= len(self):
+      raise IndexError("timeslice index out of range")
+    return self.ts.timeslice(idx)
+
+  def __iter__ (self):
+    ts = self.ts
+    for (t, v, q) in izip(ts.datetimes(), ts.values, ts.qualities):
+      yield timeslicerow((t, None if v != v else v, q))
+
+  def __setitem__ (self, idx, row):
+    del self[idx]
+    self.ts.insert(row[0], row[1], quality = row[2])
+
+  def __delitem__ (self, idx):
+    ts = self.ts
+    if idx < 0:
+      idx += len(self)
+    del ts.times[idx]
+    del ts.values[idx]
+    del ts.qualities[idx]
+
+  def __eq__ (self, other):
+    if not isinstance(other, (list, tuple, timeslices)):
+      return False
+    return len(self) == len(other) and list(self) == list(other)
+
+  def __ne__ (self, other):
+    return not self == other
+
+  def __add__ (self, other):
+    return list(self) + list(other)
+
+  def __repr__ (self):
+    return repr(list(self))
+
+  def append (self, row):
+    self.ts.insert(row[0], row[1], quality = row[2])
+
+  def extend (self, rows):
+    self.ts.extend(rows)
+
+  def insert (self, idx, row):
+    '''timeslices are kept in time order, so idx is ignored'''
+    self.append(row)
+
+
+class timeseries(object):
+  '''Timeslices are stored in three parallel typed arrays: times (epoch
+     seconds, 64 bit), values (64 bit floats, NaN for a missing value) and
+     qualities (32 bit ints), about 20 bytes a timeslice. Timestamps are handed
+     back as datetimes in tz, the timezone of the first one inserted (naive if
+     that one was naive, in which case naive times are taken to be UTC).
+     Times are whole seconds: the microseconds of an inserted datetime are
+     dropped, so two timestamps within the same second are the same time.
+  '''
+  __slots__ = ("status", "decimals", "times", "values", "qualities", "tz")
+
   def __init__ (self, data = None):
     '''"overloaded" timeseries constructor
         expects data to be tuple of datetime obj, observation value (typically float), and a quality flag)'''
 
     self.status = "OK"
-    #Data is a nested list with the following structure [datetime,float value, float quality]
-    self.data = []
     self.decimals = 3
+    self.clear()
     if data != None:
       #set internal data member to data and filter out blanks
-      for row in data:
-        if row != []:
-          if row[1] != None: 
-            self.insert(row[0],row[1],quality=row[2])  
+      self.data = data
+
+  def clear (self):
+    '''removes every timeslice from self'''
+    self.times = array(_TIME_TYPE)
+    self.values = array("d")
+    self.qualities = array("i")
+    self.tz = None
+
+  def getData (self):
+    return timeslices(self)
+
+  def setData (self, data):
+    if isinstance(data, timeslices):
+      other = data.ts
+      (times, values, qualities, tz) = (other.times[:], other.values[:], other.qualities[:], other.tz)
+      self.clear()
+      (self.times, self.values, self.qualities, self.tz) = (times, values, qualities, tz)
+      return
+    self.clear()
+    self.extend(row for row in data if row != [] and row[1] != None)
+
+  #Nested list view with the following structure [datetime,float value, float quality]
+  data = property(getData, setData)
+
+  def __getstate__ (self):
+    return (self.status, self.decimals, self.times, self.values, self.qualities, self.tz)
+
+  def __setstate__ (self, state):
+    (self.status, self.decimals, self.times, self.values, self.qualities, self.tz) = state
+
+  def toEpoch (self, dt):
+    '''returns a datetime as whole seconds past the epoch, naive datetimes are taken to be UTC'''
+    if dt.tzinfo == None:
+      d = dt - _EPOCH
+    else:
+      d = dt - _UTC_EPOCH
+    return d.days * 86400 + d.seconds
+
+  def fromEpoch (self, t):
+    '''returns seconds past the epoch as a datetime in self.tz'''
+    dt = _EPOCH + datetime.timedelta(seconds = t)
+    if self.tz == None:
+      return dt
+    return self.tz.fromutc(dt.replace(tzinfo = self.tz))
+
+  def datetimes (self):
+    '''returns every timestamp in self as a list of datetimes'''
+    fromEpoch = self.fromEpoch
+    return [fromEpoch(t) for t in self.times]
+
+  def timeslice (self, idx):
+    '''returns the timeslice at idx as a read only [datetime, value, quality] timeslicerow'''
+    v = self.values[idx]
+    if v != v:
+      v = None
+    return timeslicerow((self.fromEpoch(self.times[idx]), v, self.qualities[idx]))
+
+  def indexSlice (self, a, b):
+    '''returns a timeseries of the timeslices from index a up to (not including) b'''
+    output = timeseries()
+    output.tz = self.tz
+    output.times = self.times[a:b]
+    output.values = self.values[a:b]
+    output.qualities = self.qualities[a:b]
+    return output
+
+  def copy (self):
+    '''returns a copy of self'''
+    return self.indexSlice(0, len(self.times))
+
+  @requires_numpy
+  def numpyColumns (self):
+    '''returns copies of the times (int64 epoch seconds), values (float64) and qualities (int32) as numpy arrays'''
+    return (np.frombuffer(self.times, dtype = np.int64 if _TIME_TYPE == "l" else np.float64).copy(),
+            np.frombuffer(self.values, dtype = np.float64).copy(),
+            np.frombuffer(self.qualities, dtype = np.int32).copy())
 
   #========================================================================
   # IO and data manipulation methods
@@ -97,26 +294,75 @@ class timeseries:
     return output
 
   def __getitem__(self,idx):
-    ''' returns (gets) a timeslice from self.data from supplied index. Example : ts[1] would return [datetime,value,quality]'''
-    if idx >= len(self.data): return [None,None,None]
-    return self.data[idx]
+    ''' returns (gets) a timeslice from self.data from supplied index. Example : ts[1] would return [datetime,value,quality]
+        a slice returns a list of timeslices, as slicing self.data does'''
+    if isinstance(idx, slice): return self.data[idx]
+    if idx >= len(self.times): return [None,None,None]
+    return self.timeslice(idx)
 
   def __eq__(self, other):
     if other == None:
       return False
-    if len(self.data) == 0 and  len(other.data) == 0: return True
-    if len(self.data) != len(other.data): 
+    if len(self.times) == 0 and  len(other.times) == 0: return True
+    if len(self.times) != len(other.times): 
       return False
-    for i in xrange (len(self.data)):
-      if format(self.data[i][1],'.6f') != format(other.data[i][1],'.6f'):
+    for (x, y) in izip(self.values, other.values):
+      if format(x,'.6f') != format(y,'.6f'):
         return False
     return True
 
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  #Arithmetic works timeslice by timeslice against a number or, on the times both have, another
+  #timeseries. Comparisons cull: ts > 5 is the timeslices of ts above 5. == and != compare whole series.
+  def __add__(self, other):
+    return self.add(other)
+
+  def __radd__(self, other):
+    return self.operation(operator.add, other, reverse = True)
+
+  def __sub__(self, other):
+    return self.subtract(other)
+
+  def __rsub__(self, other):
+    return self.operation(operator.sub, other, reverse = True)
+
+  def __mul__(self, other):
+    return self.mul(other)
+
+  def __rmul__(self, other):
+    return self.operation(operator.mul, other, reverse = True)
+
+  def __div__(self, other):
+    return self.div(other)
+
+  def __rdiv__(self, other):
+    return self.operation(operator.truediv, other, reverse = True)
+
+  __truediv__ = __div__
+  __rtruediv__ = __rdiv__
+
+  def __neg__(self):
+    return self.operation(operator.mul, -1.0)
+
+  def __lt__(self, other):
+    return self.cull(operator.lt, other)
+
+  def __le__(self, other):
+    return self.cull(operator.le, other)
+
+  def __gt__(self, other):
+    return self.cull(operator.gt, other)
+
+  def __ge__(self, other):
+    return self.cull(operator.ge, other)
+
   def toDict(self): 
     '''Turns self.data into a dictionary for efficiency purposes'''
     output = {}
-    for i in xrange(len(self.data)):
-      output[self.data[i][0]]=i  
+    for (i, t) in enumerate(self.datetimes()):
+      output[t]=i  
     return output
 
   def saveTSV(self,path):
@@ -132,7 +378,9 @@ class timeseries:
        This method mutates the object, and also returns a pointer to self.
     '''
     lines = ( line.rstrip( "\n" ) for line in open( path, "r" ) )
+    parser = timeparser()
     count = 0
+    rows = []
     for s in lines:
       count += 1
       s = re.sub( r'#.*', '', s )               # Strip comments
@@ -140,33 +388,91 @@ class timeseries:
         tokens = s.split("\t")
         try:
           if len (tokens) == 2:
-            self.insert(dateparser.parse(tokens[0],fuzzy=True),float(tokens[1]))
+            rows.append([parser.parse(tokens[0]),float(tokens[1]),0])
           elif len (tokens) > 2:
-            self.insert(dateparser.parse(tokens[0],fuzzy=True),float(tokens[1]), quality = float(tokens[2]) )
+            rows.append([parser.parse(tokens[0]),float(tokens[1]),float(tokens[2])])
         except:
           self.status = "Error Parsing %s on line %u" % (path,count)
-    return self
-
-  def saveBinary(self,path):
-    '''Outputs the timeseries to a binary file'''
-    f = open(path,"wb")
-    for line in self.data:
-      f.write(struct.pack("iff",int(time.mktime(line[0].timetuple())),line[1],line[2]))
-    f.close()
-
-  def loadBinary(self,path):
-    '''Reads the timeseries from a binary file and inserts values into self'''
+    return self.extend(rows)
+
+  def metadata(self):
+    '''returns a dict describing tz that JSON can hold and metadataTz turns back into a tzinfo'''
+    tz = self.tz
+    name = getattr(tz, "zone", None) or ("UTC" if isinstance(tz, dateutil.tz.tzutc) else None)
+    offset = None
+    if tz != None and self.times:
+      offset = int(self.fromEpoch(self.times[0]).utcoffset().total_seconds())
+    return {"tz": name, "utcoffset": offset, "aware": tz != None}
+
+  def saveBinary(self,path,tsid = None,units = None,compress = False,chunk = _ARCHIVE_CHUNK):
+    '''Outputs the timeseries to a binary file in the tslite binary format (see binaryfile)
+       tsid, units: optional names stored in the header
+       compress: write chunks of delta-of-delta times, XORed values and quality runs (see encodeChunk)
+       chunk: timeslices per compressed chunk
+    '''
+    metadata = self.metadata()
+    metadata.update(tsid = tsid, units = units)
+    metadata = json.dumps(metadata)
+    metadata += " " * (-len(metadata) % 8)
+    if compress:
+      with open(path, "wb") as f:
+        f.write(_BINARY_HEADER.pack(_ARCHIVE_MAGIC, _BINARY_VERSION, len(metadata), len(self.times)))
+        f.write(metadata)
+        for i in xrange(0, len(self.times), chunk):
+          f.write(encodeChunk(self.times[i:i + chunk], self.values[i:i + chunk], self.qualities[i:i + chunk]))
+      return
+    times = self.times[:] if _TIME_TYPE == "l" else array("c", struct.pack("<%dq" % len(self.times), *map(int, self.times)))
+    columns = [times, self.values[:], self.qualities[:]]
+    if not _LITTLE_ENDIAN:
+      for column in columns:
+        column.byteswap()
+    with open(path, "wb") as f:
+      f.write(_BINARY_HEADER.pack(_BINARY_MAGIC, _BINARY_VERSION, len(metadata), len(self.times)))
+      f.write(metadata)
+      for column in columns:
+        column.tofile(f)
+
+  def loadBinary(self,path,start_time = None,end_time = None):
+    '''Reads the timeseries from a binary file and inserts values into self
+       start_time, end_time: optional datetimes to only read the timeslices between (inclusive)
+       Reads the tslite binary format written by saveBinary, compressed or not, and the older
+       headerless "iff" rows of local time, float value and float quality.
+    '''
     with open(path, "rb") as f:
-      while True:
-        bytes_read = f.read(struct.calcsize("iff"))
-        if not bytes_read: break
-        d = struct.unpack("iff", bytes_read)
-        row = [datetime.datetime.fromtimestamp(d[0])]
-        row.append(d[1])
-        row.append(d[2])
-        self.insert(row[0],row[1],quality=row[2])
-    f.close()
-    return self
+      magic = f.read(len(_BINARY_MAGIC))
+    if magic in (_BINARY_MAGIC, _ARCHIVE_MAGIC):
+      stored = binaryfile(path)
+      try:
+        ts = stored.read(start_time, end_time)
+      finally:
+        stored.close()
+      if not self.times:
+        self.tz = ts.tz
+      return self.extendEpochs(ts.times, ts.values, ts.qualities)
+    with open(path, "rb") as f:
+      data = f.read()
+    size = struct.calcsize("iff")
+    data = data[:len(data) - len(data) % size]
+    times = array("i", data)[0::3]
+    fields = array("f", data)
+    rows = [[datetime.datetime.fromtimestamp(t), v, q] for (t, v, q) in izip(times, fields[1::3], fields[2::3])]
+    if start_time != None or end_time != None:
+      rows = [row for row in rows if (start_time == None or row[0] >= start_time) and
+                                     (end_time == None or row[0] <= end_time)]
+    return self.extend(rows)
+
+  def loadColumns(self, times, values, qualities, tz = None):
+    '''Inserts parallel sequences of epoch seconds, values and qualities into self
+       times are converted to datetimes in tz, or naive UTC if tz is None.
+       Rows whose value is None are skipped. This method mutates the object, and also returns a pointer to self.
+    '''
+    if not self.times:
+      self.tz = tz
+    keep = [i for (i, v) in enumerate(values) if v != None]
+    if len(keep) == len(values):
+      return self.extendEpochs([int(t) for t in times], values, qualities)
+    return self.extendEpochs([int(times[i]) for i in keep], [values[i] for i in keep],
+                             [qualities[i] for i in keep])
 
   @requires_SQLITE3
   def SQLITE3connect(self, dbPath):
@@ -181,10 +487,10 @@ class timeseries:
     try :
       dbconn = sqlite3.connect(dbPath)
       if not dbconn :
-        self.status = "\nCould not connect to %s\n" % dbname
+        self.status = "\nCould not connect to %s\n" % dbPath
         self.status += "\n%s"
     except Exception,e:
-        self.status = "\nCould not connect to %s\n" % dbname
+        self.status = "\nCould not connect to %s\n" % dbPath
         self.status += "\n%s"+str(e)
     return dbconn
 
@@ -196,52 +502,43 @@ class timeseries:
   @requires_SQLITE3
   def loadSQLITE3 (self,conn, tsid, start_time =None, end_time=None):
     '''loads a timeseries from a SQLITE3 database
-    Reads a time series from the database#
+    Reads a time series from the database (see sqlitestore), or from the table of the same name
+    that older versions of saveSQLITE3 created
     conn - SQLITE3 connection
     tsid - string LOC_PARAM
     start_time - datetime
     end_time - datetime
     '''
-    cur = conn.cursor()
     ts = timeseries()
-    sqltxt = "SELECT * FROM "+tsid
-    if start_time != None and end_time != None:
-      start = time.mktime(start_time.timetuple())
-      end = time.mktime(end_time.timetuple())
-      sqltxt += " WHERE timestamp >= "+str(start)+" AND timestamp <= "+str(end)
     try:
-      cur.execute (sqltxt)
-      rows = cur.fetchall()
-      for d in rows:
-        ts.insert(datetime.datetime.fromtimestamp(d[0]),d[1],quality=d[2])
+      ts = sqlitestore(conn).read(tsid, start_time, end_time)
+      if ts == None:
+        ts = timeseries()
+        sqltxt = 'SELECT timestamp, val, quality FROM "%s"' % tsid.replace('"', '""')
+        binds = ()
+        if start_time != None and end_time != None:
+          sqltxt += " WHERE timestamp >= ? AND timestamp <= ?"
+          binds = (time.mktime(start_time.timetuple()), time.mktime(end_time.timetuple()))
+        rows = conn.execute(sqltxt, binds).fetchall()
+        ts.extend([datetime.datetime.fromtimestamp(d[0]),d[1],d[2]] for d in rows)
     except Exception,e:
         self.status = "\nCould not read %s\n" % tsid
         self.status += "\n%s"+str(e)
-    cur.close()
-    return ts    
+    return ts
 
   @requires_SQLITE3
   def saveSQLITE3 (self,conn,tsid, replace_table = False):
     '''saves a timeseries from to SQLITE3 database
-    Reads a time series from the database#
+    Writes the time series to the database (see sqlitestore)
     conn - SQLITE3 connection
     tsid - string LOC_PARAM
     replace_table = False - Set to true to replace the ts in the database
     '''
-
-    tsid = tsid.upper()
     try:
-      cur = conn.cursor()
-      if replace_table == True:
-        cur.execute ("CREATE TABLE IF NOT EXISTS "+tsid+"(timestamp INTEGER PRIMARY KEY, val REAL, quality REAL)")
-        cur.execute ("DROP TABLE "+tsid)
-      cur.execute ("CREATE TABLE IF NOT EXISTS "+tsid+"(timestamp INTEGER PRIMARY KEY, val REAL, quality REAL)")
-      for line in self.data:  
-        sqltxt = "INSERT OR REPLACE INTO "+tsid+" VALUES(%d,%f,%f)" % (int(time.mktime(line[0].timetuple())),line[1],line[2])
-        cur.execute(sqltxt)
+      sqlitestore(conn).write(tsid, self, replace = replace_table)
       conn.commit()
-      cur.close()
     except Exception, e:
+      conn.rollback()
       self.status = "\nCould not store "+tsid
       self.status += "\n%s" % str(e)
 
@@ -264,28 +561,29 @@ class timeseries:
   def findIndex(self, key):
     '''  returns the index of a given timestamp
     returns -1 if not found'''
-    imin = 0
-    imax = len(self.data) -1
-    while (imax >= imin):
-      imid = imin + ((imax - imin) / 2)
-      if(self.data[imid][0] == key):
-        return imid 
-      elif (self.data[imid][0] < key):
-        imin = imid + 1 #change min index to search upper subarray
-      else:
-        imax = imid - 1; #change max index to search lower subarray
+    return self.findEpoch(self.toEpoch(key))
+
+  def findEpoch(self, t):
+    '''  returns the index of a given time in epoch seconds
+    returns -1 if not found'''
+    i = bisect.bisect_left(self.times, t)
+    if i < len(self.times) and self.times[i] == t:
+      return i
     return -1 # Key not found
  
   def findClosestIndex(self, key):
     '''  returns the index of a given timestamp
     returns closest index if not found'''
+    key = self.toEpoch(key)
+    times = self.times
     imin = 0
-    imax = len(self.data) -1
+    imax = len(times) -1
+    imid = 0
     while (imax >= imin):
       imid = imin + ((imax - imin) / 2)
-      if(self.data[imid][0] == key):
+      if(times[imid] == key):
         return imid
-      elif (self.data[imid][0] < key):
+      elif (times[imid] < key):
         imin = imid + 1 #change min index to search upper subarray
       else:
         imax = imid - 1; #change max index to search lower subarray
@@ -313,52 +611,202 @@ class timeseries:
   def insert (self, datestamp, value, quality=0):
     '''Inserts a timestamp, value and quality into the timseries.
        this module assumes that datetimes are in acending order, as such please use this method when adding data'''
-    l = len(self.data)
-    if l == 0:
-      self.data.append([datestamp, value, quality])
-      return
-    if datestamp > self.data[-1][0]:
-      self.data.append([datestamp, value, quality])
+    if not self.times:
+      self.tz = datestamp.tzinfo
+    self.insertEpoch(self.toEpoch(datestamp), value, quality)
+
+  def insertEpoch (self, t, value, quality=0):
+    '''Inserts a time in epoch seconds, value and quality into the timeseries, see insert'''
+    if value == None:
+      value = _NAN
+    quality = int(quality or 0)
+    if quality > 2147483647 or quality < -2147483648:
+      quality = (quality + 2147483648) % 4294967296 - 2147483648  # quality codes are 32 bit flags
+    times = self.times
+    if not times or t > times[-1]:
+      times.append(t)
+      self.values.append(value)
+      self.qualities.append(quality)
       return
-    i = self.findClosestIndex(datestamp)
-    if datestamp == self.data[i][0]:
-        self.data[i] = [datestamp, value, quality]
-        return
-    i -= 2
-    if i < 0: i = 0
-    while i < l:
-      if datestamp < self.data[i][0]:
-        self.data.insert(i,[datestamp, value, quality])
-        return
-      i += 1
-    self.data.append([datestamp, value, quality])
+    i = bisect.bisect_left(times, t)
+    if times[i] == t:
+      self.values[i] = value
+      self.qualities[i] = quality
+    else:
+      times.insert(i, t)
+      self.values.insert(i, value)
+      self.qualities.insert(i, quality)
+
+  def extend (self, rows):
+    '''Inserts [datetime, value, quality] rows in any order, with the same result as
+       calling insert for each in turn: a row replaces any earlier one with the same time.
+       The rows are sorted once, or not at all if they are already in order.
+       This method mutates the object, and also returns a pointer to self.
+    '''
+    times, values, qualities = [], [], []
+    toEpoch = self.toEpoch
+    for row in rows:
+      if not self.times and not times:
+        self.tz = row[0].tzinfo
+      times.append(toEpoch(row[0]))
+      values.append(row[1])
+      qualities.append(row[2])
+    return self.extendEpochs(times, values, qualities)
+
+  def extendEpochs (self, times, values, qualities):
+    '''Inserts parallel sequences of epoch seconds, values and qualities, see extend'''
+    n = len(times)
+    if any(times[i] >= times[i+1] for i in xrange(n - 1)):
+      #one stable sort, then keep the last of each run of equal times
+      order = sorted(xrange(n), key = times.__getitem__)
+      order = [order[i] for i in xrange(n) if i == n - 1 or times[order[i]] != times[order[i+1]]]
+      times = [times[i] for i in order]
+      values = [values[i] for i in order]
+      qualities = [qualities[i] for i in order]
+    try:
+      times = array(_TIME_TYPE, times)
+      values = array("d", values)
+      qualities = array("i", qualities)
+    except (TypeError, OverflowError):
+      #missing values or qualities that need converting, do it the slow way
+      new = timeseries()
+      for (t, v, q) in izip(times, values, qualities):
+        new.insertEpoch(t, v, q)
+      (times, values, qualities) = (new.times, new.values, new.qualities)
+    if not times:
+      return self
+    if not self.times or times[0] > self.times[-1]:
+      self.times.extend(times)
+      self.values.extend(values)
+      self.qualities.extend(qualities)
+    elif len(times) < 32:
+      for i in xrange(len(times)):
+        self.insertEpoch(times[i], values[i], qualities[i])
+    else:
+      self.mergeColumns(times, values, qualities)
+    return self
 
+  def mergeColumns (self, times, values, qualities):
+    '''merges sorted, unique columns into self in one pass, their values win on equal times'''
+    (t0, v0, q0) = (self.times, self.values, self.qualities)
+    (t1, v1, q1) = (array(_TIME_TYPE), array("d"), array("i"))
+    i = j = 0
+    n = len(t0)
+    m = len(times)
+    while i < n and j < m:
+      if t0[i] < times[j]:
+        t1.append(t0[i]); v1.append(v0[i]); q1.append(q0[i])
+        i += 1
+      else:
+        if t0[i] == times[j]:
+          i += 1
+        t1.append(times[j]); v1.append(values[j]); q1.append(qualities[j])
+        j += 1
+    t1.extend(t0[i:]); v1.extend(v0[i:]); q1.extend(q0[i:])
+    t1.extend(times[j:]); v1.extend(values[j:]); q1.extend(qualities[j:])
+    (self.times, self.values, self.qualities) = (t1, v1, q1)
+
+
+  def merge (self, other, precedence = "last"):
+     '''Merges another timeseries into self, retruns resultant timeseries
+        precedence: which timeslice is kept when both have the same time, see blend
+     '''
+     if precedence == "last":
+       output = self.copy()
+       if not output.times:
+         output.tz = other.tz
+       return output.extendEpochs(other.times, other.values, other.qualities)
+     return blend([self, other], precedence)
+
+  def diff (self, other, atol = None, rtol = 0.0, quality = False):
+     '''Returns the timeslices of other that are new or changed compared to self
+        By default values are changed if they differ when rounded to 6 decimals.
+        atol, rtol: a value y in other is changed from x in self if |x - y| > atol + rtol * |y|
+        quality: a change of quality alone also counts as a change
+     '''
+     output = timeseries()
+     output.tz = other.tz
+     if _NUMPY_AVAILABLE and len(other.times) >= _NUMPY_MIN:
+       return output.diffNumpy(self, other, atol, rtol, quality)
+     def changed(x, y):
+       if x != x and y != y:
+         return False
+       if atol == None and rtol == 0:
+         #-0.0 and 0.0 format differently, as the 6 decimal comparison always has
+         if x == y and (x != 0 or math.copysign(1, x) == math.copysign(1, y)):
+           return False
+         return abs(x - y) >= 2e-6 or format(x,'.6f') != format(y,'.6f')
+       return x != y and (x != x or y != y or not abs(x - y) <= (atol or 0.0) + rtol * abs(y))
+     (st, sv, sq) = (self.times, self.values, self.qualities)
+     (ot, ov, oq) = (other.times, other.values, other.qualities)
+     keep = []
+     i = 0
+     n = len(st)
+     for k in xrange(len(ot)):
+       t = ot[k]
+       while i < n and st[i] < t:
+         i += 1
+       if i == n or st[i] != t or changed(sv[i], ov[k]) or (quality and sq[i] != oq[k]):
+         keep.append(k)
+     return output.extendEpochs([ot[k] for k in keep], [ov[k] for k in keep], [oq[k] for k in keep])
 
-  def merge (self, other):
-     '''Merges another timeseries into self, retruns resultant timeseries'''
-     output = timeseries(self.data)
-     for line in other.data:
-       output.insert(line[0],line[1],quality=line[2])
-     return output
+  @requires_numpy
+  def diffNumpy (self, old, new, atol = None, rtol = 0.0, quality = False):
+     '''vectorized new.diff, the changed timeslices of new are put into self, which is returned'''
+     (st, sv, sq) = old.numpyColumns()
+     (ot, ov, oq) = new.numpyColumns()
+     idx = np.minimum(np.searchsorted(st, ot), max(len(st) - 1, 0))
+     if len(st) == 0:
+       keep = np.ones(len(ot), dtype = bool)
+     else:
+       (x, y) = (sv[idx], ov)
+       bothnan = np.isnan(x) & np.isnan(y)
+       with np.errstate(invalid = "ignore"):
+         if atol == None and rtol == 0:
+           changed = ((x != y) | (np.signbit(x) != np.signbit(y))) & ~bothnan
+           #values less than 2e-6 apart may still round to the same 6 decimals
+           close = np.nonzero(changed & (np.abs(x - y) < 2e-6))[0]
+           (a, b) = (x[close] * 1e6, y[close] * 1e6)
+           (ra, rb) = (np.rint(a), np.rint(b))
+           #rint agrees with formatting unless the product lands within rounding error of a half
+           slack = (np.abs(a) + np.abs(b)) * 2.0**-50 + 1e-9
+           sure = (np.abs(a - np.floor(a) - 0.5) > slack) & (np.abs(b - np.floor(b) - 0.5) > slack)
+           changed[close[sure]] = (ra[sure] != rb[sure]) | (np.signbit(ra[sure]) != np.signbit(rb[sure]))
+           for i in close[~sure]:
+             changed[i] = format(x[i],'.6f') != format(y[i],'.6f')
+         else:
+           changed = (x != y) & ~(np.abs(x - y) <= (atol or 0.0) + rtol * np.abs(y)) & ~bothnan
+       if quality:
+         changed |= sq[idx] != oq
+       keep = (st[idx] != ot) | changed
+     return self.fromNumpyColumns(ot[keep], ov[keep], oq[keep])
 
-  def diff (self, other):
-     '''Returns the differences between self and timeseries other governs'''
-     output = timeseries()
-     for slice in self.data:
-       i = other.findIndex(slice[0])
-       if i == -1:
-         #output.insert(slice[0],slice[1],quality=slice[2])
-         continue
-       oslice = other.data[i]
-       if format(slice[1],'.6f') != format(oslice[1],'.6f'):
-         #print "different"+str(slice)+str(oslice)
-         output.insert(oslice[0],oslice[1],quality=oslice[2])
-     for slice in other.data:
-       i = self.findIndex(slice[0])
-       if i == -1:
-         #print "NOT FOUND"+str(slice)
-         output.insert(slice[0],slice[1],quality=slice[2])
-     return output
+  @requires_numpy
+  def blendNumpy (self, series, precedence):
+    '''vectorized blend, the blended timeslices are put into self, which is returned'''
+    columns = [ts.numpyColumns() for ts in series]
+    times = np.concatenate([c[0] for c in columns])
+    values = np.concatenate([c[1] for c in columns])
+    qualities = np.concatenate([c[2] for c in columns])
+    rank = np.concatenate([np.full(len(c[0]), k, dtype = np.int64) for (k, c) in enumerate(columns)])
+    if precedence == "first":
+      rank = -rank
+    elif precedence == qualityRank:
+      q = qualities.astype(np.int64) & 0xFFFFFFFF
+      quality = np.where(q & 16, 0, np.where(q & 4, 1, np.where(q & 8, 2, np.where(q & 3 == 3, 4, 3))))
+      rank += quality * len(columns)
+    order = np.lexsort((rank, times))
+    times = times[order]
+    keep = np.append(times[1:] != times[:-1], True) # the highest rank of each time sorts last
+    return self.fromNumpyColumns(times[keep], values[order][keep], qualities[order][keep])
+
+  @requires_numpy
+  def fromNumpyColumns (self, times, values, qualities):
+    '''replaces the timeslices of self with numpy columns that are already sorted and unique, returns self'''
+    self.times = array(_TIME_TYPE, times.astype(np.int64 if _TIME_TYPE == "l" else np.float64).tostring())
+    self.values = array("d", values.astype(np.float64).tostring())
+    self.qualities = array("i", qualities.astype(np.int32).tostring())
+    return self
 
   def toHTML (self, css = "",thead =""):
     '''like __str__ only it outputs a HTML table'''
@@ -398,72 +846,361 @@ class timeseries:
     output = y0 + (x - x0) * m
     return output
 
-  def interpolate(self,interval):
+  def interpolate(self,interval,maxgap = None):
     '''interpolates timeseries based on a given interval of type timedelta
+    maxgap: timedelta, gaps between timeslices longer than this are not interpolated across
+    Times run from the first timeslice on a regular interval, missing values are interpolated across.
     returns a timeseries object
     '''
-    _data = []
+    return self.regularize(interval, "linear", maxgap)
+
+  def regularize(self, interval, how = "linear", maxgap = None, starttime = None, endtime = None, initial = None):
+    '''Puts self on a regular grid of times in one pass
+       interval: timedelta between grid times
+       how: "linear" interpolates between the timeslices either side of a grid time, ignoring missing
+            values, "previous" carries forward the last value at or before it
+       maxgap: timedelta, grid times inside a gap between timeslices longer than this (or, for
+               "previous", further than this after the last timeslice) are left out
+       starttime, endtime: datetimes the grid runs between, default the first and last timeslice
+       initial: (value, quality) given to grid times before the first timeslice, left out by default
+       Each grid time takes the quality of the timeslice at or before it.
+       returns a timeseries object
+    '''
+    output = timeseries()
+    if not self.times:
+      return output
     try:
-      for i in xrange(0,len(self.data)-1):
-        startTime = self.data[i][0]
-        deltaT = (self.data[i+1][0] - startTime)
-        steps = int(deltaT.total_seconds()/interval.total_seconds())
-        quality = self.data[i][2]
-        for j in xrange(0,steps):
-          value = self.interpolateValue(0,self.data[i][1],deltaT.total_seconds(),self.data[i+1][1],j*interval.total_seconds())
-          _data.append([startTime+(interval*j),value,quality])
+      step = interval.total_seconds()
+      if step <= 0:
+        raise ValueError("regularize interval must be positive")
+      start = self.times[0] if starttime == None else self.toEpoch(starttime)
+      end = self.times[-1] if endtime == None else self.toEpoch(endtime)
+      output.tz = self.tz if starttime == None else starttime.tzinfo
+      grid = self.regularGrid(start, step, 0, int(math.floor((end - start) / step)))
+      output = self.fillGrid(output, grid, how, maxgap, initial)
     except Exception,e:
       self.status = str(e)
-    return timeseries(_data)
+      return timeseries()
+    return output
+
+  def regularGrid(self, start, step, first, last):
+    '''returns the epoch times start + k * step for k from first to last'''
+    if _NUMPY_AVAILABLE and last - first >= _NUMPY_MIN:
+      return (start + np.arange(first, last + 1) * step).astype(np.int64 if _TIME_TYPE == "l" else np.float64)
+    return [int(start + k * step) for k in xrange(first, last + 1)]
+
+  def fillGrid(self, output, grid, how, maxgap = None, initial = None):
+    '''fills output with the values of self at the epoch times of grid, see regularize, returns output'''
+    if how not in ("linear", "previous"):
+      raise ValueError("Unknown fill %s" % how)
+    source = self
+    if how == "linear" and any(v != v for v in self.values):
+      source = self.cull(operator.eq, self) # NaN != NaN, so this drops the missing values
+    maxgap = None if maxgap == None else maxgap.total_seconds()
+    if _NUMPY_AVAILABLE and len(grid) >= _NUMPY_MIN:
+      return output.fromNumpyColumns(*source.fillNumpy(np.asarray(grid), how, maxgap, initial))
+    times, values, qualities = [], [], []
+    (st, sv, sq) = (source.times, source.values, source.qualities)
+    n = len(st)
+    i = -1 # the last timeslice at or before the grid time
+    for t in grid:
+      while i + 1 < n and st[i + 1] <= t:
+        i += 1
+      if i == -1:
+        if initial != None:
+          times.append(t); values.append(initial[0]); qualities.append(initial[1])
+        continue
+      if st[i] != t:
+        if i + 1 < n:
+          if maxgap != None and st[i + 1] - st[i] > maxgap:
+            continue
+        elif how == "linear" or (maxgap != None and t - st[i] > maxgap):
+          continue
+      if how == "linear" and st[i] != t:
+        values.append(self.interpolateValue(st[i], sv[i], st[i + 1], sv[i + 1], t))
+      else:
+        values.append(sv[i])
+      times.append(t); qualities.append(sq[i])
+    return output.extendEpochs(times, values, qualities)
+
+  @requires_numpy
+  def fillNumpy(self, grid, how, maxgap, initial):
+    '''vectorized fillGrid, returns the filled times, values and qualities'''
+    (times, values, qualities) = self.numpyColumns()
+    n = len(times)
+    i = np.searchsorted(times, grid, "right") - 1
+    before = i < 0
+    i = np.maximum(i, 0)
+    j = np.minimum(i + 1, n - 1)
+    on = times[i] == grid
+    inside = i + 1 < n
+    keep = ~before & (on | inside) if how == "linear" else ~before
+    if maxgap != None:
+      keep &= on | np.where(inside, times[j] - times[i] <= maxgap, grid - times[i] <= maxgap)
+    if how == "linear":
+      with np.errstate(all = "ignore"):
+        filled = values[i] + (grid - times[i]) * ((values[j] - values[i]) / (times[j] - times[i]))
+      filled = np.where(on, values[i], filled)
+    else:
+      filled = values[i]
+    filledq = qualities[i]
+    if initial != None:
+      filled = np.where(before, initial[0], filled)
+      filledq = np.where(before, initial[1], filledq)
+      keep |= before
+    return (grid[keep], filled[keep], filledq[keep])
 
   def average(self,interval):
     '''averages timeseries based on a given interval of type timedelta
        returns a timeseries object
     '''
-    _data = []
-    if self.data == []:
-      return timeSeries()
+    return self.resample(interval, "mean")
+
+  def resample(self, interval, how = "mean", anchor = None, label = "end", tz = None):
+    '''Aggregates timeseries into buckets in one pass
+       interval: timedelta, or "day", "month", "year" or "wateryear" for calendar buckets
+       how: "mean", "sum", "min", "max", "count", "first" or "last", a function that is given the
+            values in each bucket, or a list of these to compute several in the same pass
+       anchor: datetime a timedelta bucket starts on, defaults to the first timeslice
+       label: "end" (the default) or "start", the time each bucket is labelled with
+       tz: timezone calendar buckets follow, defaults to the timezone of the timeseries
+       Missing values are ignored, empty buckets are left out and each bucket takes the quality
+       of its first timeslice.
+       returns a timeseries object, or a list of them if how is a list
+    '''
+    hows = how if isinstance(how, (list, tuple)) else [how]
+    outputs = [timeseries() for h in hows]
     try:
-      i = 0
-      count = len(self.data)     
-      endTime = self.data[i][0]
-      while i < count:
-        startTime = endTime 
-        endTime = startTime + interval
-        quality = self.data[i][2]
-        n = 0
-        sum = 0
-        while self.data[i][0] < endTime:
-          sum += self.data[i][1]
-          n += 1
-          i += 1
-          if i >= count:
-            break
-        if n != 0:
-          _data.append([endTime,sum/n,quality])
+      vectorize = _NUMPY_AVAILABLE and len(self.times) >= _NUMPY_MIN and not any(callable(h) for h in hows)
+      if vectorize:
+        (times, values, qualities) = self.numpyColumns()
+        keep = values == values
+        if not keep.all():
+          (times, values, qualities) = (times[keep], values[keep], qualities[keep])
+      else:
+        keep = [i for (i, v) in enumerate(self.values) if v == v]
+        times = [self.times[i] for i in keep]
+        values = [self.values[i] for i in keep]
+        qualities = [self.qualities[i] for i in keep]
+      if len(times):
+        (buckets, bounds) = self.buckets(times, interval, anchor, tz)
+        if vectorize:
+          columns = self.resampleNumpy(buckets, values, qualities, hows)
+        else:
+          columns = self.resampleColumns(buckets, values, qualities, hows)
+        labels = [bounds(k + (label != "start")) for k in columns[0]]
+        for (output, column) in izip(outputs, columns[2:]):
+          output.tz = self.tz
+          output.extendEpochs(labels, column, columns[1])
     except Exception,e:
       self.status = str(e)
-    return timeseries(_data)
+    return outputs if isinstance(how, (list, tuple)) else outputs[0]
+
+  def buckets(self, times, interval, anchor = None, tz = None):
+    '''returns the bucket number of each of times (sorted epoch seconds, a list or a numpy array)
+       for resample, and a function that gives the time in epoch seconds bucket k starts at'''
+    vector = _NUMPY_AVAILABLE and isinstance(times, np.ndarray)
+    if isinstance(interval, datetime.timedelta):
+      step = interval.total_seconds()
+      if step <= 0:
+        raise ValueError("resample interval must be positive")
+      start = times[0] if anchor == None else self.toEpoch(anchor)
+      if vector:
+        buckets = np.floor((times - start) / step).astype(np.int64)
+      else:
+        buckets = [int(math.floor((t - start) / step)) for t in times]
+      return (buckets, lambda k: int(start + k * step))
+    if tz == None:
+      tz = self.tz
+    def local(naive):
+      if tz == None:
+        return self.toEpoch(naive)
+      if hasattr(tz, "localize"):
+        return self.toEpoch(tz.localize(naive))
+      return self.toEpoch(naive.replace(tzinfo = tz))
+    def floor(dt):
+      if interval == "day":
+        return datetime.datetime(dt.year, dt.month, dt.day)
+      if interval == "month":
+        return datetime.datetime(dt.year, dt.month, 1)
+      if interval == "year":
+        return datetime.datetime(dt.year, 1, 1)
+      if interval == "wateryear":
+        return datetime.datetime(dt.year if dt.month > 9 else dt.year - 1, 10, 1)
+      raise ValueError("Unknown resample interval %s" % interval)
+    def next(dt):
+      if interval == "day":
+        return dt + datetime.timedelta(days = 1)
+      if interval == "month":
+        return datetime.datetime(dt.year + dt.month / 12, dt.month % 12 + 1, 1)
+      return datetime.datetime(dt.year + 1, dt.month, 1)
+    first = _EPOCH + datetime.timedelta(seconds = times[0])
+    if tz != None:
+      first = tz.fromutc(first.replace(tzinfo = tz)).replace(tzinfo = None)
+    edge = floor(first)
+    bounds = [local(edge)]
+    while bounds[-1] <= times[-1]:
+      edge = next(edge)
+      bounds.append(local(edge))
+    if vector:
+      buckets = np.searchsorted(bounds, times, "right") - 1
+    else:
+      buckets = [bisect.bisect_right(bounds, t) - 1 for t in times]
+    return (buckets, bounds.__getitem__)
+
+  def resampleColumns(self, buckets, values, qualities, hows):
+    '''aggregates sorted values by bucket for resample
+       returns [bucket numbers, qualities, one column per how]'''
+    output = [[], []] + [[] for h in hows]
+    n = len(values)
+    a = 0
+    while a < n:
+      b = a
+      while b < n and buckets[b] == buckets[a]:
+        b += 1
+      window = values[a:b]
+      output[0].append(buckets[a])
+      output[1].append(qualities[a])
+      for (column, how) in izip(output[2:], hows):
+        if callable(how):
+          column.append(how(list(window)))
+        elif how == "mean":
+          column.append(sum(window) / (b - a))
+        elif how == "sum":
+          column.append(sum(window))
+        elif how == "min":
+          column.append(min(window))
+        elif how == "max":
+          column.append(max(window))
+        elif how == "count":
+          column.append(b - a)
+        elif how == "first":
+          column.append(window[0])
+        elif how == "last":
+          column.append(window[-1])
+        else:
+          raise ValueError("Unknown resample function %s" % how)
+      a = b
+    return output
+
+  @requires_numpy
+  def resampleNumpy(self, buckets, values, qualities, hows):
+    '''vectorized resampleColumns'''
+    buckets = np.asarray(buckets, dtype = np.int64)
+    values = np.asarray(values, dtype = np.float64)
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    ends = np.append(starts[1:], len(buckets))
+    counts = ends - starts
+    output = [buckets[starts].tolist(), np.asarray(qualities)[starts].tolist()]
+    for how in hows:
+      if how == "mean":
+        column = np.add.reduceat(values, starts) / counts
+      elif how == "sum":
+        column = np.add.reduceat(values, starts)
+      elif how == "min":
+        column = np.minimum.reduceat(values, starts)
+      elif how == "max":
+        column = np.maximum.reduceat(values, starts)
+      elif how == "count":
+        column = counts
+      elif how == "first":
+        column = values[starts]
+      elif how == "last":
+        column = values[ends - 1]
+      else:
+        raise ValueError("Unknown resample function %s" % how)
+      output.append(column.tolist())
+    return output
+
+  def statistics (self, percentiles = ()):
+    '''Descriptive statistics of the values of self in one pass, missing values are ignored
+       percentiles: percentiles (0-100) to compute as well, e.g. (10, 50, 90)
+       returns a dictionary, or None if self has no values, of
+         count, mean, variance (population variance), stddev
+         min, max - the timeslices with the smallest and largest value, the first one on a tie
+         percentiles - {percentile: value}, interpolating linearly between values
+         slope, intercept, r - least squares line value = slope * x + intercept, x in seconds past
+                               the epoch, and its correlation coefficient (all 0 if x does not vary)
+    '''
+    if _NUMPY_AVAILABLE and len(self.times) >= _NUMPY_MIN:
+      (n, mean, m2, xmean, xm2, cxy, lo, hi, ordered) = self.momentsNumpy()
+    else:
+      (n, mean, m2, xmean, xm2, cxy, lo, hi, ordered) = self.moments()
+    if n == 0:
+      return None
+    output = {"count": n, "mean": mean, "variance": m2 / n, "stddev": math.sqrt(m2 / n),
+              "min": self.timeslice(lo), "max": self.timeslice(hi), "percentiles": {},
+              "slope": 0.0, "intercept": 0.0, "r": 0.0}
+    for p in percentiles:
+      if not 0 <= p <= 100:
+        raise ValueError("percentile %s is not between 0 and 100" % p)
+      (k, frac) = divmod(p / 100.0 * (n - 1), 1)
+      k = int(k)
+      output["percentiles"][p] = ordered[k] + (ordered[min(k + 1, n - 1)] - ordered[k]) * frac
+    if xm2 > 0:
+      output["slope"] = cxy / xm2
+      output["intercept"] = mean - output["slope"] * xmean
+      if m2 > 0:
+        output["r"] = cxy / math.sqrt(xm2 * m2)
+    return output
+
+  def moments (self):
+    '''returns (count, mean, sum of squared deviations, mean time, sum of squared time deviations,
+       sum of time and value deviation products, index of the min, index of the max, sorted values)
+       of the values of self for statistics, in one pass with Welford's updates'''
+    n = 0
+    (mean, m2, xmean, xm2, cxy) = (0.0, 0.0, 0.0, 0.0, 0.0)
+    (lo, hi) = (None, None)
+    values = self.values
+    for (i, (t, v)) in enumerate(izip(self.times, values)):
+      if v != v:
+        continue
+      n += 1
+      dx = t - xmean
+      xmean += dx / n
+      dy = v - mean
+      mean += dy / n
+      m2 += dy * (v - mean)
+      xm2 += dx * (t - xmean)
+      cxy += dx * (v - mean)
+      if lo == None or v < values[lo]:
+        lo = i
+      if hi == None or v > values[hi]:
+        hi = i
+    return (n, mean, m2, xmean, xm2, cxy, lo, hi, sorted(v for v in values if v == v))
+
+  @requires_numpy
+  def momentsNumpy (self):
+    '''vectorized moments, with two pass sums'''
+    (times, values, qualities) = self.numpyColumns()
+    index = np.flatnonzero(values == values)
+    if not len(index):
+      return (0, 0.0, 0.0, 0.0, 0.0, 0.0, None, None, [])
+    (times, values) = (times[index].astype(np.float64), values[index])
+    (mean, xmean) = (values.mean(), times.mean())
+    (dy, dx) = (values - mean, times - xmean)
+    return (len(index), float(mean), float(np.dot(dy, dy)), float(xmean), float(np.dot(dx, dx)),
+            float(np.dot(dx, dy)), int(index[values.argmin()]), int(index[values.argmax()]), np.sort(values))
 
   def globalAverage (self):
     '''averages entire timeseries returns a timeslice'''
-    if len (self.data) != 0:
-      interval = self.data[-1][0] - self.data[0][0]
-      return self.average(interval).data[0]
+    stats = self.statistics()
+    if stats != None:
+      return [self.timeslice(len(self.times) - 1)[0], stats["mean"], self.qualities[0]]
     return None
 
   def globalMax (self):
     '''finds the max of a timeseries returns a timeslice'''
-    if len (self.data) != 0:
-      interval = self.data[-1][0] - self.data[0][0]
-      return self.maxmin(interval, lambda x,y: x > y).data[0]
+    stats = self.statistics()
+    if stats != None:
+      return stats["max"]
     return None
 
   def globalMin (self):
-    '''averages minimum of a timeseries returns a timeslice'''
-    if len (self.data) != 0:
-      interval = self.data[-1][0] - self.data[0][0]
-      return self.maxmin(interval, lambda x,y: x < y).data[0]
+    '''finds the minimum of a timeseries returns a timeslice'''
+    stats = self.statistics()
+    if stats != None:
+      return stats["min"]
     return None
 
   def linreg (self):
@@ -474,52 +1211,23 @@ class timeseries:
         r - correlation coeeficient
         NOTE: x is in seconds past the epoch
     '''
-    sumx = 0.0  #sum of x
-    sumx2 = 0.0 #sum of x**2
-    sumxy = 0.0 #sum of x * y
-    sumy = 0.0  #sum of y
-    sumy2 = 0.0 #sum of y**2
-    n =0
-    for tmslice in self.data:   
-      if tmslice[1] != None:
-        x = time.mktime(tmslice[0].timetuple())
-        y = tmslice[1]
-        sumx  += x;       
-        sumx2 += x**2;  
-        sumxy += x * y;
-        sumy  += y;      
-        sumy2 += y**2; 
-        n+=1
-    denom = (n * sumx2 - (sumx**2));
-    if (denom == 0): # singular matrix. can't solve the problem.
+    stats = self.statistics()
+    if stats == None:
       return (0,0,0)
-    m = (n * sumxy  -  sumx * sumy) / denom
-    b = (sumy * sumx2  -  sumx * sumxy) / denom
-    #compute correlation coeff     
-    r = (sumxy - sumx * sumy / n) / math.sqrt((sumx2 - (sumx**2)/n) * (sumy2 - (sumy**2)/n))
-    return (m,b,r)
- 
+    return (stats["slope"], stats["intercept"], stats["r"])
+
   def trendline (self):
     '''trendline performs a least squares regression on self. It returns a timeseries that contains the best fit values for each timeslice '''
+    (m, b, r) = self.linreg()
     output = timeseries()
-    coeff = self.linreg()
-    m = coeff[0]
-    b = coeff[1]
-    for tmslice in self.data:
-      x = time.mktime(tmslice[0].timetuple())
-      output.insert(tmslice[0],m*x+b,quality=tmslice[2] )
-    return output  
+    output.tz = self.tz
+    return output.extendEpochs(self.times, [m * x + b for x in self.times], self.qualities)
 
   def variance(self):
     '''returns the variance of the timeseries as a timeslice'''
-    ss = 0
-    mu = self.globalAverage()
-    if mu != None:
-      n = 0
-      for t in self.data:
-        n += 1
-        ss += math.pow(t[1] - mu[1],2)
-      return [mu[0],ss/n,0]
+    stats = self.statistics()
+    if stats != None:
+      return [self.timeslice(len(self.times) - 1)[0], stats["variance"], 0]
     return None
 
   def stddev(self):
@@ -531,21 +1239,9 @@ class timeseries:
 
   def subSlice (self, starttime, endtime):
     '''returns a timeseries betweeen the specified start and end datetimes'''
-    output = timeseries()
-    if self.data == []:
-      return output()
-    if 1 == 1:
-      pos = self.findClosestIndex(starttime)
-      a = pos -2 #subtract a few to be sure
-      if a < 0: a = 0
-      while a < len(self.data):
-        line = self.data[a]
-        if line[0] > endtime:
-          break
-        if line[0] >= starttime:
-          output.insert(line[0],line[1],quality=line[2])
-        a += 1
-    return output
+    a = bisect.bisect_left(self.times, self.toEpoch(starttime))
+    b = bisect.bisect_right(self.times, self.toEpoch(endtime))
+    return self.indexSlice(a, max(a, b))
 
   def getWY (self, WY):
     '''Gets a water year'''
@@ -556,88 +1252,180 @@ class timeseries:
 
   def averageWY(self):
     '''averages each element in the timeseries in previous water years
-    returns a timeseries object
+    returns a timeseries object with a timeslice for each timeslice of the last water year, holding the
+    average across all water years at that time of the water year
     '''
-    def toWY(t):
-      output = t.year
-      if t.month > 9: output += 1
-      return output
-
-    def fromWY(year,month):
-      output = year
-      if month > 9: output -= 1
-      return output
-
-    def inWY(WY,t):
-      if t.month < 10 and WY == t.year:
-        return True
-      if t.month > 9 and WY == (t.year +1):
-        return True
-      return False
-    
-    _data = []
-    if self.data == []:
-      return timeseries()
-    dd = self.toDict()
+    (normals, current) = align([self.climatology("mean"), self])
+    normals.qualities = current.qualities
+    return normals
+
+  def climatology(self, how = "mean", startWY = None, endWY = None):
+    '''Statistics across water years of each time of the water year (day and time of day in the
+       timezone of self), computed in a single grouped pass
+       how: "mean", "median", "min", "max", "count", a percentile from 0 to 100 (e.g. 10 or 90), or
+            a list of these to compute them all in the same pass
+       startWY, endWY: water years to include, defaults to all of them
+       Percentiles interpolate linearly between the values of the years. Missing values are ignored.
+       returns a timeseries object, or a list of them if how is a list, with a timeslice for every time
+       of the water year that has data, dated in water year endWY (the last water year by default)
+    '''
+    hows = how if isinstance(how, (list, tuple)) else [how]
+    outputs = [timeseries() for h in hows]
     try:
-      i = 0
-      startWY= toWY(self.data[0][0])
-      endWY = toWY(self.data[-1][0])
-      count = len(self.data)
-      #advance to the latest WY      
-      while i < count and not inWY(endWY,self.data[i][0]): i+= 1
-      #average current timeslice
-      while i < count:
-        sum = 0
-        t = self.data[i][0]
-        n = 0
-        for WY in xrange(startWY,endWY+1):
-          try:
-            t2 = datetime.datetime(year = fromWY(WY,t.month),month=t.month,day=t.day,hour=t.hour,minute=t.minute)
-            if t2 in dd:
-              val = self.data[dd[t2]][1]
-              n+=1
-              sum += val
-          except:
-            pass
-        quality = self.data[i][2]
-        if n != 0:
-          _data.append([t,sum/n,quality])
-        i+=1
+      vectorize = _NUMPY_AVAILABLE and len(self.times) >= _NUMPY_MIN
+      if vectorize:
+        (slots, wys, values) = self.waterYearSlotsNumpy(startWY, endWY)
+      else:
+        (slots, wys, values) = self.waterYearSlots(startWY, endWY)
+      if len(slots):
+        if endWY == None:
+          endWY = int(max(wys))
+        if vectorize:
+          columns = self.climatologyNumpy(slots, values, hows)
+        else:
+          columns = self.climatologyColumns(slots, values, hows)
+        labels = [self.fromWaterYear(endWY, slot) for slot in columns[0]]
+        keep = [i for (i, t) in enumerate(labels) if t != None]
+        for (output, column) in izip(outputs, columns[1:]):
+          output.tz = self.tz
+          output.extendEpochs([labels[i] for i in keep], [column[i] for i in keep], [0] * len(keep))
     except Exception,e:
       self.status = str(e)
-    return timeseries(_data)
+    return outputs if isinstance(how, (list, tuple)) else outputs[0]
+
+  def waterYearSlots(self, startWY = None, endWY = None):
+    '''returns (slots, water years, values) of the values of self in water years startWY to endWY, a
+       slot being the seconds since October 1st (in a water year with a February 29th) in local time'''
+    slots, wys, values = [], [], []
+    dates = {}
+    for (t, v) in izip(self.localEpochs(), self.values):
+      (day, seconds) = divmod(t, 86400)
+      if day not in dates:
+        dates[day] = (_EPOCH + datetime.timedelta(days = day)).timetuple()[:3]
+      (year, month, mday) = dates[day]
+      wy = year + 1 if month > 9 else year
+      if v == v and (startWY == None or wy >= startWY) and (endWY == None or wy <= endWY):
+        slots.append((_WY_MONTH_DAYS[month] + mday - 1) * 86400 + seconds)
+        wys.append(wy)
+        values.append(v)
+    return (slots, wys, values)
+
+  @requires_numpy
+  def waterYearSlotsNumpy(self, startWY = None, endWY = None):
+    '''vectorized waterYearSlots'''
+    local = np.array(self.localEpochs(), dtype = np.int64)
+    values = np.frombuffer(self.values, dtype = np.float64)
+    (days, seconds) = np.divmod(local, 86400)
+    days = days.astype("datetime64[D]")
+    months = days.astype("datetime64[M]")
+    month = months.astype(np.int64) % 12 + 1
+    wys = months.astype(np.int64) // 12 + 1970 + (month > 9)
+    mday = (days - months.astype("datetime64[D]")).astype(np.int64) + 1
+    keep = values == values
+    if startWY != None:
+      keep &= wys >= startWY
+    if endWY != None:
+      keep &= wys <= endWY
+    offsets = np.array([0] + _WY_MONTH_DAYS[1:], dtype = np.int64)
+    slots = (offsets[month] + mday - 1) * 86400 + seconds
+    return (slots[keep], wys[keep], values[keep])
+
+  def localEpochs(self):
+    '''returns the times of self as local wall clock seconds, the epoch seconds of the local time
+       taken as UTC. UTC offsets are looked up once a day, and per timeslice on days they change.'''
+    if self.tz == None:
+      return self.times
+    offsets = {}
+    def offset(t):
+      return int(self.fromEpoch(t).utcoffset().total_seconds())
+    output = []
+    for t in self.times:
+      day = t // 86400
+      if day not in offsets:
+        (a, b) = (offset(day * 86400), offset(day * 86400 + 86399))
+        offsets[day] = a if a == b else None
+      o = offsets[day]
+      output.append(t + (o if o != None else offset(t)))
+    return output
+
+  def fromWaterYear(self, WY, slot):
+    '''returns the epoch time of slot (seconds since October 1st in a water year with a February 29th)
+       in water year WY in the timezone of self, None for February 29th in a year without one'''
+    (day, seconds) = divmod(slot, 86400)
+    month = (bisect.bisect_right(_WY_MONTH_STARTS, day) + 8) % 12 + 1
+    try:
+      dt = datetime.datetime(WY - 1 if month > 9 else WY, month, day - _WY_MONTH_DAYS[month] + 1) + \
+           datetime.timedelta(seconds = seconds)
+    except ValueError:
+      return None
+    if self.tz == None:
+      return self.toEpoch(dt)
+    if hasattr(self.tz, "localize"):
+      return self.toEpoch(self.tz.localize(dt))
+    return self.toEpoch(dt.replace(tzinfo = self.tz))
+
+  def climatologyColumns(self, slots, values, hows):
+    '''groups values by slot for climatology
+       returns [slots, one column per how]'''
+    groups = collections.defaultdict(list)
+    for (slot, v) in izip(slots, values):
+      groups[slot].append(v)
+    output = [sorted(groups)] + [[] for h in hows]
+    for slot in output[0]:
+      group = sorted(groups[slot])
+      n = len(group)
+      for (column, how) in izip(output[1:], hows):
+        if how == "mean":
+          column.append(sum(group) / n)
+        elif how == "min":
+          column.append(group[0])
+        elif how == "max":
+          column.append(group[-1])
+        elif how == "count":
+          column.append(n)
+        else:
+          p = 50 if how == "median" else float(how)
+          if not 0 <= p <= 100:
+            raise ValueError("Unknown climatology statistic %s" % how)
+          (lo, frac) = divmod(p / 100.0 * (n - 1), 1)
+          lo = int(lo)
+          column.append(group[lo] + (group[min(lo + 1, n - 1)] - group[lo]) * frac)
+    return output
+
+  @requires_numpy
+  def climatologyNumpy(self, slots, values, hows):
+    '''vectorized climatologyColumns'''
+    slots = np.asarray(slots, dtype = np.int64)
+    values = np.asarray(values, dtype = np.float64)
+    order = np.lexsort((values, slots))
+    (slots, values) = (slots[order], values[order])
+    starts = np.flatnonzero(np.concatenate(([True], slots[1:] != slots[:-1])))
+    counts = np.diff(np.append(starts, len(slots)))
+    output = [slots[starts].tolist()]
+    for how in hows:
+      if how == "mean":
+        column = np.add.reduceat(values, starts) / counts
+      elif how == "min":
+        column = values[starts]
+      elif how == "max":
+        column = values[starts + counts - 1]
+      elif how == "count":
+        column = counts
+      else:
+        p = 50 if how == "median" else float(how)
+        if not 0 <= p <= 100:
+          raise ValueError("Unknown climatology statistic %s" % how)
+        (frac, lo) = np.modf(p / 100.0 * (counts - 1))
+        lo = starts + lo.astype(np.int64)
+        hi = np.minimum(lo + 1, starts + counts - 1)
+        column = values[lo] + (values[hi] - values[lo]) * frac
+      output.append(column.tolist())
+    return output
 
   def accumulate(self,interval, override_startTime = None):
     '''accumulates timeseries based on a given interval of type timedelta
      returns a timeseries object'''
-    _data = []
-    if self.data == []:
-      return timeSeries()
-    try:
-      i = 0
-      count = len(self.data)
-      if override_startTime != None:
-        endTime = override_startTime
-      else:
-        endTime = self.data[i][0]
-      while i < count:
-        startTime = endTime
-        endTime = startTime + interval
-        quality = self.data[i][2]
-        n = 0
-        sum = 0
-        while self.data[i][0] < endTime:
-          sum += self.data[i][1]
-          n += 1
-          i += 1
-          if i >= count:
-            break
-        if n != 0:
-          _data.append([endTime,sum,quality])
-    except Exception,e:
-      self.status = str(e)
-    return timeSeries(_data)
+    return self.resample(interval, "sum", anchor = override_startTime)
 
   def accumulateWY(self,interval,incrTS, offset = datetime.timedelta(days = 0)):
     '''
@@ -683,12 +1471,12 @@ class timeseries:
     '''calculates the delta between successive, results are in the same units as the time series
      returns a timeseries object'''
     output = timeseries()
-    if len(self.data) < 2:
+    if len(self.times) < 2:
       return output
+    output.tz = self.tz
     try:
-      for i in xrange(1,len(self.data)):
-        d = self.data[i][1]-self.data[i-1][1]
-        output.insert(self.data[i][0],d,quality=self.data[i][2])
+      v = self.values
+      output.extendEpochs(self.times[1:], [v[i]-v[i-1] for i in xrange(1,len(v))], self.qualities[1:])
     except Exception,e:
       self.status = str(e)
     return output
@@ -696,31 +1484,12 @@ class timeseries:
 
   def maxmin(self,interval,cmp):
     '''returns a max or a min based for a given interval of type datetime
+       cmp: "max", "min", or a function of (value, best so far) that is True when value is better
        returns a timeseries object
     '''
-    _data = []
-    if self.data == []:
-      return timeseries()
-    try:
-      i = 0
-      count = len(self.data)     
-      endTime = self.data[i][0]
-      while i < count:
-        startTime = endTime 
-        endTime = startTime + interval
-        quality = self.data[i][2]
-        n = 0
-        probe = self.data[i][1]
-        while self.data[i][0] < endTime:
-          if cmp (self.data[i][1],probe):
-            probe = self.data[i][1]
-          i += 1
-          if i >= count:
-            break
-        _data.append([endTime,probe,quality])
-    except Exception,e:
-      self.status = str(e)
-    return timeseries(_data)
+    if cmp in ("max", "min"):
+      return self.resample(interval, cmp)
+    return self.resample(interval, lambda values: reduce(lambda probe, v: v if cmp(v, probe) else probe, values))
 
   @requires_numpy
   def savitzky_golay(self, window_size, order, deriv=0, rate=1):
@@ -729,435 +1498,425 @@ class timeseries:
        order: polynomial order
        deriv: defaults to 0
        rate : defaults to 1
+       the ends are padded with the first and last value, qualities are set to 0
+       returns a timeseries object
     '''
-    try:
-      window_size = np.abs(np.int(window_size))
-      order = np.abs(np.int(order))
-    except ValueError:
-      raise ValueError("SGFilter:window size and order must be of type int")
-
-    if window_size % 2 != 1 or window_size < 1:
-      raise TypeError("SGFilter:window size must be positive number")
-    if window_size < order + 2:
-      raise TypeError("SGFilter:window size is too small for the polynomials order")
-
-    y = []
-
-    _data = self.data
-
-    for x in xrange(0, len(_data)-1):
-      yy = _data[x][1]
-      y.append(yy)
-
-    order_range = range(order+1)
-    half_window = (window_size -1) // 2
-
-    # precomute coefficients
-    b = np.mat([[k**i for i in order_range] for k in range(-half_window, half_window+1)])
-    m = np.linalg.pinv(b).A[deriv] * rate**deriv * factorial(deriv)
-
-    # pad the signal at the extremes with values taken from the signal itself
-    #firstvals = y[0] - np.abs( y[1:half_window+1][::-1] - y[0] )
-
-    firstvals = []
-    v = y[0]
-
-    for i in range(half_window):
-      firstvals.append(v)
-
-    #lastvals = y[-1] + np.abs(y[-half_window-1:-1][::-1] - y[-1])
-    lastvals = []
-    v = (y[len(y)-1:])[0]
-
-    for i in range(half_window):
-      lastvals.append(v)
-
-    y = np.concatenate((firstvals, y, lastvals))
-
-    tsd = np.convolve( m[::-1], y, mode='same')
-    # remove the appended/padded values at beginning/end of data
-    tsd = tsd[(window_size-1)/2:len(tsd)-(window_size-1)/2]
-
-    _data = []
-    for x in range(0, len(self.data)-1):
-      _data.append([self.data[x][0], tsd[x], 0])
-
-    return timeseries(_data)
+    stream = qcstream(None, window_size, order, deriv, rate)
+    output = stream.update(self)
+    rest = stream.flush()
+    return output.extendEpochs(rest.times, rest.values, rest.qualities)
 
   @requires_numpy
   def remove_stddev_outliers(self, threshold=1.5):
-    '''Remove Outliers using Standard Deviation'''
-    good = []
-    _data = []
-    a = []
-
-    # get the slice of values from timeseries
-    # y = np.array(self.data)
-    # a = y[:,1]
-    for rec in self.data:
-      a.append(rec[1])
-
-    avg = np.average(a)
-
-    # pad the first element with average
-    a = [avg] + a
-    out = [None] * len(a)
-    good.append(a[0])
-
-    std = np.std(a)
-    stdm = std * threshold
-
-    for n in range(1, len(a) ):
-      dev = abs(a[n] - good[-1])
-
-      if dev < stdm:
-        good.append(a[n])
-        out[n]=a[n]
-      else:
-        out[n] = None
-
-    # remove the first (avg) element
-    out = out[1:]
-
-    # replace the values, only non nulls
-    # these will get interpolated later
-    for x in range(0, len(self.data)):
-      if out[x] != None:
-        _data.append([self.data[x][0],out[x],self.data[x][2]])
-
-    return timeseries(_data)
-
+    '''Remove Outliers using Standard Deviation
+       A value is kept if it is within threshold standard deviations of the last value kept (the
+       average for the first one). Missing values are removed.
+       returns a timeseries object
+    '''
+    return qcstream(threshold).update(self)
 
   def rollingaverage(self,interval):
     '''averages timeseries based on a given interval of type timedelta. Moving average looking forward. 
        returns a timeseries object'''
-    _data = []
-    if self.data == []:
-      return timeseries()
-    try:
-      i = 0
-      count = len(self.data)     
-      while i < count:
-        startTime = self.data[i][0]
-        endTime = startTime + interval
-        if endTime > self.data[-1][0]:
-          break
-        quality = self.data[i][2]
-        n = 0
-        sum = 0
-        while self.data[i+n][0] <= endTime:
-          sum += self.data[i+n][1]
-          n += 1
-          if i+n >= count:
-            break
-        if n != 0:
-          _data.append([endTime,sum/n,quality])
-        i+=1
-    except Exception,e:
-      self.status = str(e)
-    return timeseries(_data)
+    return self.window(interval, "mean", "leading")
 
   def movingaverage(self,interval):
     '''averages timeseries based on a given interval of type timedelta. This differs from rollingaverage because it looks backwards. 
        returns a timeseries object'''
-    _data = []
-    if self.data == []:
-      return timeseries()
-    try:
-      i = len(self.data) -1
-      while i >= 0:
-        endTime = self.data[i][0]
-        startTime = endTime - interval
-        if startTime < self.data[0][0]:
-          break
-        quality = self.data[i][2]
-        n = 0
-        sum = 0
-        while self.data[i-n][0] >= startTime:
-          sum += self.data[i-n][1]
-          n += 1
-          if i-n < 0:
-            break
-        if n != 0:
-          _data.append([endTime,sum/n,quality])
-        i-=1
-    except Exception,e:
-      self.status = str(e)
-    return timeseries(_data)
-
+    return self.window(interval, "mean", "trailing")
 
   def centerMovingAverage(self,interval):
     '''averages timeseries based on a given interval of type timedelta 
       returns a timeseries object containing center moving average'''
-    _data = []
-    if self.data == []:
-      return timeseries()
+    return self.window(interval, "mean", "center")
+
+  def movingsum(self, interval, align = "trailing"):
+    '''sums timeseries over a moving window of type timedelta, see window
+       returns a timeseries object'''
+    return self.window(interval, "sum", align)
+
+  def movingmin(self, interval, align = "trailing"):
+    '''minimum of timeseries over a moving window of type timedelta, see window
+       returns a timeseries object'''
+    return self.window(interval, "min", align)
+
+  def movingmax(self, interval, align = "trailing"):
+    '''maximum of timeseries over a moving window of type timedelta, see window
+       returns a timeseries object'''
+    return self.window(interval, "max", align)
+
+  def movingcount(self, interval, align = "trailing"):
+    '''number of values in a moving window of type timedelta, see window
+       returns a timeseries object'''
+    return self.window(interval, "count", align)
+
+  def window(self, interval, how = "mean", align = "trailing"):
+    '''applies how ("mean", "sum", "min", "max" or "count") over a moving window of type timedelta
+       align: "trailing" - the window ends at each timeslice, and starts no earlier than the first
+              "leading" - the window starts at each timeslice and ends no later than the last,
+                          labelled with its end time as rollingaverage always has been
+              "center" - the window is centered on each timeslice
+       Windows include both ends and take the quality of the timeslice they are built around.
+       returns a timeseries object'''
+    output = timeseries()
+    if not self.times:
+      return output
+    output.tz = self.tz
+    span = interval.total_seconds()
+    times = self.times
+    if align == "leading":
+      (before, after) = (0, span)
+    elif align == "center":
+      (before, after) = (span / 2.0, span / 2.0)
+    else:
+      (before, after) = (span, 0)
     try:
-      i = 0
-      interval = interval
-      count = len(self.data)     
-      while i < count:
-        startTime = self.data[i][0] - interval /2
-        endTime = startTime + interval
-        if startTime > self.data[-1][0]:
-          break
-        if startTime < self.data[0][0]:
-          startTime = self.data[0][0]
-        if endTime > self.data[-1][0]:
-          endTime = self.data[-1][0]
-        quality = self.data[i][2]
-        n = 0
-        sum = 0
-        while self.data[i+n][0] <= endTime:
-          sum += self.data[i+n][1]
-          n += 1
-          if i+n >= count:
-            break
-        if n != 0:
-          _data.append([self.data[i][0],sum/n,quality])
-        i+=1
+      result = self.slidingWindow(before, after, how)
     except Exception,e:
       self.status = str(e)
-    return timeseries(_data)
+      return output
+    keep = []
+    for i in xrange(len(times)):
+      if result[i] != result[i]:
+        continue
+      if align == "leading" and times[i] + span > times[-1]:
+        continue
+      if align == "trailing" and times[i] - span < times[0]:
+        continue
+      keep.append(i)
+    shift = int(span) if align == "leading" else 0
+    return output.extendEpochs([times[i] + shift for i in keep], [result[i] for i in keep],
+                               [self.qualities[i] for i in keep])
+
+  def slidingWindow(self, before, after, how = "mean"):
+    '''returns the how ("mean", "sum", "min", "max" or "count") of the values from
+       before seconds before to after seconds after each timeslice, as a list.
+       Missing values are ignored, a window without values gives NaN (0 for count).
+       Runs in linear time, using a running sum and a monotonic deque for min and max.'''
+    if _NUMPY_AVAILABLE and len(self.times) >= _NUMPY_MIN:
+      return self.slidingWindowNumpy(before, after, how)
+    (times, values) = (self.times, self.values)
+    n = len(times)
+    output = []
+    lo = hi = count = 0
+    total = 0.0
+    extremes = collections.deque() # indices of values that may yet be the min or max
+    for i in xrange(n):
+      while hi < n and times[hi] <= times[i] + after:
+        v = values[hi]
+        if v == v:
+          total += v
+          count += 1
+          if how == "max":
+            while extremes and values[extremes[-1]] <= v: extremes.pop()
+          elif how == "min":
+            while extremes and values[extremes[-1]] >= v: extremes.pop()
+          extremes.append(hi)
+        hi += 1
+      while lo < hi and times[lo] < times[i] - before:
+        v = values[lo]
+        if v == v:
+          total -= v
+          count -= 1
+          if count == 0: total = 0.0 # don't carry rounding error into the next window
+        lo += 1
+      while extremes and extremes[0] < lo:
+        extremes.popleft()
+      if how == "count":
+        output.append(count)
+      elif count == 0:
+        output.append(_NAN)
+      elif how == "sum":
+        output.append(total)
+      elif how == "mean":
+        output.append(total / count)
+      elif how in ("min", "max"):
+        output.append(values[extremes[0]])
+      else:
+        raise ValueError("Unknown window function %s" % how)
+    return output
 
+  @requires_numpy
+  def slidingWindowNumpy(self, before, after, how = "mean"):
+    '''vectorized slidingWindow, from cumulative sums and a sparse table for min and max'''
+    (t, v, q) = self.numpyColumns()
+    lo = np.searchsorted(t, t - before, "left")
+    hi = np.searchsorted(t, t + after, "right")
+    present = ~np.isnan(v)
+    counts = np.concatenate(([0], np.cumsum(present)))
+    count = counts[hi] - counts[lo]
+    if how == "count":
+      return count.tolist()
+    if how in ("sum", "mean"):
+      sums = np.concatenate(([0.0], np.cumsum(np.where(present, v, 0.0))))
+      result = sums[hi] - sums[lo]
+      if how == "mean":
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+          result = result / count
+    elif how in ("min", "max"):
+      (f, fill) = (np.minimum, np.inf) if how == "min" else (np.maximum, -np.inf)
+      #levels[j][i] holds the min or max of the 2**j values starting at i
+      levels = [np.where(present, v, fill)]
+      length = np.maximum(hi - lo, 1)
+      while (1 << len(levels)) <= length.max():
+        prev = levels[-1]
+        half = 1 << (len(levels) - 1)
+        levels.append(f(prev[:-half], prev[half:]))
+      k = np.floor(np.log2(length)).astype(int)
+      result = np.empty(len(t))
+      for j in xrange(len(levels)):
+        sel = np.nonzero(k == j)[0]
+        result[sel] = f(levels[j][lo[sel]], levels[j][hi[sel] - (1 << j)])
+    else:
+      raise ValueError("Unknown window function %s" % how)
+    result[count == 0] = np.nan
+    return result.tolist()
 
   def percent(self,denom):
     '''Calculates the percentage of two timeseries
        numerator : self
        denominator : denom
-       returns a timeseries object of percentages
+       returns a timeseries object of percentages, leaving out times where denom is 0
     '''
-    _data = []
-    denom_data = {}
-    try:
-      #turn denominator data into a dictionary and filter out zeros (no division by 0 allowed!)
-      for line in denom.data:
-        if line[1] != 0:
-          denom_data[line[0]] = line
-      for line in self.data:
-        key = line[0] 
-        if key in denom_data:
-          _data.append([line[0],100*float(line[1]/denom_data[key][1]),line[2]])
-    except Exception,e:
-      self.status = str(e)
-      return timeseries()
-    return timeseries(_data)
+    return self.operation(operator.truediv, denom).operation(operator.mul, 100.0)
 
   def snap2(self,interval,buffer,starttime = None):
-    ''' Snaps a timeseries (experimental version )
-        interval: interval at which time series is snapped
-        buffer : lookahead and lookback
-        returns a snapped timeseries '''
-    _data = []
-    if self.data == []:
-      return timeSeries()
-    try:
-      if buffer > interval/2:
-        buffer = interval/2
-      #setup the initial start time
-      endtime = self.data[-1][0]+buffer
-      if starttime != None:
-        t = starttime
-      else:
-        t = self.data[0][0]
-      pos = 0
-      while t <= endtime:
-        tlist = []
-        pos = self.findClosestIndex(t)
-        if self.data[pos][0] >= t-buffer and self.data[pos][0] <= t+buffer:
-          a = pos -2
-          b = pos +2
-          if a < 0: a = 0
-          if b > len(self.data)-1:b=len(self.data)-1
-          tlist = self.data[a:b]
-        if len (tlist) > 0:
-          tline = tlist[0]
-          for line in tlist:
-            curdiff = abs(tline[0] - t).seconds
-            newdiff = abs(line[0] - t).seconds
-            if (curdiff > newdiff):
-              tline = line
-          _data.append([t,tline[1],tline[2]])
-        t += interval
-    except Exception,e:
-      self.status = str(e)
-      return timeSeries()
-    return timeSeries(_data)
+    ''' Snaps a timeseries (experimental version, now the same as snap)'''
+    return self.snap(interval, buffer, starttime)
 
   def snap(self,interval,buffer,starttime = None):
     ''' Snaps a timeseries
         interval: interval at which time series is snapped
-        buffer : lookahead and lookback 
+        buffer : lookahead and lookback, at most half the interval
+        starttime: first snapped time, defaults to the first timeslice
+        Each snapped time takes the closest timeslice within the buffer around it, the earlier one on
+        a tie. A timeslice exactly between two snapped times belongs to the earlier one, and the last
+        snapped time may lie up to buffer after the last timeslice.
         returns a snapped timeseries '''
-    _data = []
-    if self.data == []:
-      return timeseries()
+    output = timeseries()
+    if not self.times:
+      return output
     try:
       if buffer > interval/2:
         buffer = interval/2
+      step = interval.total_seconds()
+      if step <= 0:
+        raise ValueError("snap interval must be positive")
+      buffer = buffer.total_seconds()
       #setup the initial start time
-      endtime = self.data[-1][0]
       if starttime != None:
-        t = starttime
+        start = self.toEpoch(starttime)
+        output.tz = starttime.tzinfo
+      else:
+        start = self.times[0]
+        output.tz = self.tz
+      if _NUMPY_AVAILABLE and len(self.times) >= _NUMPY_MIN:
+        (slots, picks) = self.snapNumpy(start, step, buffer)
       else:
-        t = self.data[0][0]
-      count = 0
-      while t <= endtime:
-        tlist = []
-        for line in self.data[count:]:
-          if line[0] >= t - buffer:
-            if line[0] <= t+ buffer:
-              count += 1
-              tlist.append(line)
-            else:
-              break
-        if len(tlist) > 0: 
-          tline = tlist[0]
-          for line in tlist:
-            curdiff = abs(tline[0] - t).seconds
-            newdiff = abs(line[0] - t).seconds
-            if (curdiff > newdiff):
-              tline = line
-          _data.append([t,tline[1],tline[2]])
-        t += interval
+        (slots, picks) = self.snapColumns(start, step, buffer)
+      output.extendEpochs([int(start + k * step) for k in slots], [self.values[i] for i in picks],
+                          [self.qualities[i] for i in picks])
     except Exception,e:
       self.status = str(e)
       return timeseries()
-    return timeseries(_data)
+    return output
 
-  def filldown(self,interval,starttime = None,offset = None,_endtime = None):
+  def snapColumns(self, start, step, buffer):
+    '''returns the snapped time numbers (k for start + k * step) and the index of the timeslice
+       each one takes, for snap'''
+    slots = []
+    picks = []
+    first = bisect.bisect_left(self.times, start - buffer)
+    for i in xrange(first, len(self.times)):
+      t = self.times[i]
+      # the earliest snapped time whose buffer reaches t, if t is inside that buffer at all
+      k = int(math.ceil((t - start - buffer) / step))
+      d = abs(t - (start + k * step))
+      if d > buffer:
+        continue
+      if slots and slots[-1] == k:
+        if d < abs(self.times[picks[-1]] - (start + k * step)):
+          picks[-1] = i
+      else:
+        slots.append(k)
+        picks.append(i)
+    return (slots, picks)
+
+  @requires_numpy
+  def snapNumpy(self, start, step, buffer):
+    '''vectorized snapColumns'''
+    times = self.numpyColumns()[0]
+    index = np.arange(np.searchsorted(times, start - buffer, "left"), len(times))
+    times = times[index].astype(np.float64)
+    k = np.ceil((times - start - buffer) / step).astype(np.int64)
+    d = np.abs(times - (start + k * step))
+    inside = d <= buffer
+    (index, k, d) = (index[inside], k[inside], d[inside])
+    if not len(index):
+      return ([], [])
+    starts = np.flatnonzero(np.concatenate(([True], k[1:] != k[:-1])))
+    closest = np.repeat(np.minimum.reduceat(d, starts), np.diff(np.append(starts, len(k))))
+    # first (earliest) timeslice of each snapped time at the smallest distance
+    best = np.flatnonzero(d == closest)
+    best = best[np.concatenate(([True], k[best][1:] != k[best][:-1]))]
+    return (k[best].tolist(), index[best].tolist())
+
+  def filldown(self,interval,starttime = None,offset = None,_endtime = None,maxgap = None):
     '''fills timeslices in timeseries from the previous value until a new value is detected
        if start time is specified, It will fill with zeroes on the interval until a value is found
        if a timezone offset is passed, it will fill to the offset
+       if maxgap (timedelta) is passed, gaps longer than it are not filled
        returns a timeseries object
     '''
-    ts = timeseries()
-    if self.data == []:
-      return ts()
+    output = timeseries()
+    if not self.times:
+      return output
     try:
-      #setup the initial start time and value
-      val = 0
-      qual = 0
-      i = 0
-      endtime = self.data[-1][0]
-      if _endtime != None: endtime = _endtime
+      step = interval.total_seconds()
+      if step <= 0:
+        raise ValueError("filldown interval must be positive")
+      #setup the initial start time and the time to fill to
+      endtime = self.timeslice(len(self.times) - 1)[0] if _endtime == None else _endtime
       if offset != None:
+        midnight = endtime.replace(hour = 0, minute = 0, second = 0, microsecond = 0)
         if endtime.hour < offset.seconds/3600:
-          endtime = datetime.datetime(year=endtime.year,day=endtime.day,month=endtime.month)+offset
-          #endtime += offset
+          endtime = midnight + offset
         else:
-          endtime = datetime.datetime(year=endtime.year,day=endtime.day,month=endtime.month)
-          endtime += offset+ datetime.timedelta(days=1)
+          endtime = midnight + offset + datetime.timedelta(days=1)
       if starttime != None:
-        t = starttime
+        start = self.toEpoch(starttime)
+        output.tz = starttime.tzinfo
       else:
-        t = self.data[0][0]
-        val = self.data[0][1]
-        qual = self.data[0][2]
-      #print endtime
-      #print t
-      while t <= endtime and i < len(self.data):
-        while self.data[i][0] <= t:
-          val = self.data[i][1]
-          qual = self.data[i][2]
-          i += 1
-          if i == len(self.data): #fill to the end time
-            while t < endtime:
-              ts.insert(t,val,quality=qual)
-              t += interval
-            break
-        ts.insert(t,val,quality=qual)
-        t += interval
+        start = self.times[0]
+        output.tz = self.tz
+      end = self.toEpoch(endtime)
+      #the interval on which the last timeslice is taken up; once it is, filling runs on to the
+      #first interval at or after endtime, otherwise it stops at the last one before endtime
+      last = max(int(math.ceil((self.times[-1] - start) / step)), 0)
+      if start + last * step <= end:
+        count = int(math.ceil((end - start) / step))
+      else:
+        count = int(math.floor((end - start) / step))
+      grid = self.regularGrid(start, step, 0, count)
+      output = self.fillGrid(output, grid, "previous", maxgap, initial = (0.0, 0))
     except Exception,e:
       self.status = str(e)
       return timeseries()
-    return ts
+    return output
 
 
   def timeshift(self,tdelta):
     ''' Shifts each timestamp a given time interval
         tdelta: timedelta to shift
         returns a timeseries object '''
-    _data = []
     if self.data == []:
       return timeseries()
     try:
-      for line in self.data:
-        _data.append([line[0]+tdelta,line[1],line[2]])
+      shift = int(tdelta.total_seconds())
+      output = self.copy()
+      output.times = array(_TIME_TYPE, [t + shift for t in self.times])
     except Exception,e:
       self.status = str(e)
       print e
       return timeseries()
-    return timeseries(_data)
+    return output
 
   def subtract (self, operand):
     '''Subtracts an operand timeseries or constant from self'''
-    return self.operation(lambda x,y: x-y,operand)
+    return self.operation(operator.sub,operand)
 
   def add (self, operand):
-    '''Subtracts an operand timeseries or constant from self'''
-    return self.operation(lambda x,y: x+y,operand)
+    '''Adds an operand timeseries or constant to self'''
+    return self.operation(operator.add,operand)
 
   def mul (self, operand):
     '''multiplies an operand timeseries or constant to self'''
-    return self.operation(lambda x,y: x*y,operand)
+    return self.operation(operator.mul,operand)
 
   def div (self, operand):
     '''divides an self by an operand timeseries or constant'''
-    return self.operation(lambda x,y: x/y,operand)
-            
-  def operation(self,op,operand):
+    return self.operation(operator.truediv,operand)
+
+  def alignOperand(self, operand, vectorize):
+    '''lines self up with operand for operation and cull
+       returns (times, values, qualities, operand values) of the times self and operand both have,
+       operand values being the operand itself when it is a number'''
+    if isinstance(operand, timeseries):
+      (times, values, qualities) = alignColumns([self, operand], vectorize = vectorize)
+      present = values[1] == values[1] if vectorize else [v == v for v in values[1]]
+      if vectorize:
+        return (times[present], values[0][present], qualities[0][present], values[1][present])
+      keep = [i for (i, p) in enumerate(present) if p]
+      return ([times[i] for i in keep], [values[0][i] for i in keep], [qualities[0][i] for i in keep],
+              [values[1][i] for i in keep])
+    if vectorize:
+      return self.numpyColumns() + (operand,)
+    return (self.times, self.values, self.qualities, repeat(operand))
+
+  def operation(self,op,operand,reverse = False):
     '''Performs an operation on self
-       op: lambda function to perform eg lambda x,y: x+y
-       operand: could be a timeseries or a float
+       op: function of two values eg lambda x,y: x+y. Functions from the operator module
+           (operator.add, operator.truediv etc.) are applied to whole columns at once.
+       operand: could be a timeseries or a number. A timeseries is matched to self on the times both have.
+       reverse: perform op(operand, value) instead of op(value, operand)
+       Timeslices where op returns None, or a non finite number from finite values (a division by 0),
+       are left out. Each result keeps the quality of self.
        returns a timeseries object
     '''
-    _data = []
-    if self.data == []:
-      return timeseries()
+    output = timeseries()
+    if not self.times:
+      return output
+    output.tz = self.tz
     try:
-      if type (operand) is float or type(operand) is int:
-        for line in self.data:
-          _data.append([line[0],op(line[1],operand),line[2]])
-      else:
-        for line in self.data:
-          val = operand.findValue(line[0])
-          if val != None:
-            _data.append([line[0],op(line[1],val),line[2]])
+      vectorize = op in _UFUNCS and len(self.times) >= _NUMPY_MIN
+      (times, x, qualities, y) = self.alignOperand(operand, vectorize)
+      if vectorize:
+        with np.errstate(all = "ignore"):
+          result = (_UFUNCS[op](y, x) if reverse else _UFUNCS[op](x, y)).astype(np.float64)
+        keep = np.isfinite(result) | ~(np.isfinite(x) & np.isfinite(y))
+        return output.fromNumpyColumns(times[keep], result[keep], qualities[keep])
+      _times, values, _qualities = [], [], []
+      for (t, a, b, q) in izip(times, x, y, qualities):
+        try:
+          v = op(b, a) if reverse else op(a, b)
+        except ZeroDivisionError:
+          continue
+        #x - x is 0 only for finite x
+        if v == None or (v - v != 0 and a - a == 0 and b - b == 0):
+          continue
+        _times.append(t); values.append(v); _qualities.append(q)
     except Exception,e:
       self.status = str(e)
       print e
       return timeseries()
-    return timeseries(_data)
+    return output.extendEpochs(_times, values, _qualities)
 
   def cullvalues (self, value):
-    return self.cull(lambda x,y: x!=y,float(value))
+    return self.cull(operator.ne,float(value))
 
   def cull(self,op,operand):
     ''' culls data from self
-        op: lambda function to perform eg lambda x,y: x>y
-        operand: could be a timeseries or a float
-        returns a timeseries object
+        op: lambda function to perform eg lambda x,y: x>y. Functions from the operator module
+            (operator.gt, operator.ne etc.) are applied to whole columns at once.
+        operand: could be a timeseries or a number. A timeseries is matched to self on the times both have.
+        returns a timeseries object of the timeslices for which op(value, operand) is true
     '''
-    _data = []
-    if self.data == []:
-      return timeseries()
+    output = timeseries()
+    if not self.times:
+      return output
+    output.tz = self.tz
     try:
-      if type (operand) is float:
-        for line in self.data:
-          if op(line[1],operand):
-            _data.append(line)
-      else:
-        for line in self.data:
-          val = operand.findValue(line[0])
-          if val != None:
-            if op(val,operand):
-              _data.append([line])
+      vectorize = op in _UFUNCS and len(self.times) >= _NUMPY_MIN
+      (times, x, qualities, y) = self.alignOperand(operand, vectorize)
+      if vectorize:
+        keep = _UFUNCS[op](x, y).astype(bool)
+        return output.fromNumpyColumns(times[keep], x[keep], qualities[keep])
+      keep = [i for (i, (a, b)) in enumerate(izip(x, y)) if op(a, b)]
     except Exception,e:
       self.status = str(e)
       print e
       return timeseries()
-    return timeseries(_data)
+    return output.extendEpochs([times[i] for i in keep], [x[i] for i in keep], [qualities[i] for i in keep])
 
   #This takes a relative time and turns it into a timedelta
   #eg input 7d6h9m
@@ -1192,6 +1951,741 @@ class timeseries:
     return output
 
 
+def qualityRank (quality):
+  '''ranks a CWMS quality code from 0 (rejected) to 4 (screened and okay) for blend'''
+  quality &= 0xFFFFFFFF
+  if quality & 16: return 0 # rejected
+  if quality & 4: return 1  # missing
+  if quality & 8: return 2  # questionable
+  if quality & 3 == 3: return 4 # screened okay
+  return 3
+
+
+def blend (series, precedence = "last"):
+  '''Merges any number of timeseries into one in a single pass, returns a timeseries
+     series: list of timeseries, e.g. observed, forecast and revised series
+     precedence: which timeslice is kept when several share a time
+       "last" - the one from the latest series in the list (what merge does)
+       "first" - the one from the earliest series in the list
+       "quality" - the one with the best qualityRank, then the latest series
+       or a function of a quality code returning a rank, the highest rank wins
+  '''
+  output = timeseries()
+  series = [ts for ts in series if ts.times]
+  if not series:
+    return output
+  output.tz = series[0].tz
+  if precedence == "quality":
+    precedence = qualityRank
+  if _NUMPY_AVAILABLE and precedence in ("last", "first", qualityRank) and \
+      sum(len(ts.times) for ts in series) >= _NUMPY_MIN:
+    return output.blendNumpy(series, precedence)
+  times, values, qualities = [], [], []
+  last = None
+  #heapq.merge yields (time, series, index) ordered by time and then by series
+  for (t, k, i) in heapq.merge(*[izip(ts.times, repeat(k), xrange(len(ts.times)))
+                                 for (k, ts) in enumerate(series)]):
+    (v, q) = (series[k].values[i], series[k].qualities[i])
+    if t != last:
+      times.append(t); values.append(v); qualities.append(q)
+      last = t
+    elif precedence == "last" or \
+        (precedence != "first" and precedence(q) >= precedence(qualities[-1])):
+      values[-1] = v
+      qualities[-1] = q
+  return output.extendEpochs(times, values, qualities)
+
+
+def align (series, join = "inner"):
+  '''Lines up any number of timeseries on a common set of times in one pass
+     join: "inner" keeps the times every series has, "outer" the times any series has
+     returns a list of timeseries, one per series, that all have the same times. Values a
+     series does not have (outer join) are missing (None) with quality 0.
+  '''
+  (times, values, qualities) = alignColumns(series, join)
+  output = []
+  for (ts, v, q) in izip(series, values, qualities):
+    aligned = timeseries()
+    aligned.tz = ts.tz
+    if isinstance(times, list):
+      aligned.extendEpochs(times, v, q)
+    else:
+      aligned.fromNumpyColumns(times, v, q)
+    output.append(aligned)
+  return output
+
+
+def alignColumns (series, join = "inner", vectorize = None):
+  '''The alignment engine behind align, operation and cull
+     returns (times, values, qualities): the common epoch times and a values and a qualities column
+     per series, lists or, if vectorize (the default when there are enough timeslices), numpy arrays.
+     Values a series does not have are NaN with quality 0.
+  '''
+  if join not in ("inner", "outer"):
+    raise ValueError("Unknown join %s" % join)
+  if vectorize == None:
+    vectorize = _NUMPY_AVAILABLE and sum(len(ts.times) for ts in series) >= _NUMPY_MIN
+  if vectorize:
+    return alignNumpy(series, join)
+  n = len(series)
+  times = []
+  values = [[] for ts in series]
+  qualities = [[] for ts in series]
+  row = None
+  #heapq.merge yields (time, series, index) ordered by time and then by series
+  for (t, k, i) in heapq.merge(*[izip(ts.times, repeat(k), xrange(len(ts.times)))
+                                 for (k, ts) in enumerate(series)]):
+    if row == None or t != row[0]:
+      if row != None and (join == "outer" or row[3] == n):
+        times.append(row[0])
+        for k2 in xrange(n):
+          values[k2].append(row[1][k2]); qualities[k2].append(row[2][k2])
+      row = [t, [_NAN] * n, [0] * n, 0]
+    row[1][k] = series[k].values[i]
+    row[2][k] = series[k].qualities[i]
+    row[3] += 1
+  if row != None and (join == "outer" or row[3] == n):
+    times.append(row[0])
+    for k2 in xrange(n):
+      values[k2].append(row[1][k2]); qualities[k2].append(row[2][k2])
+  return (times, values, qualities)
+
+
+@requires_numpy
+def alignNumpy (series, join):
+  '''vectorized alignColumns'''
+  columns = [ts.numpyColumns() for ts in series]
+  if join == "inner":
+    times = reduce(lambda a, b: np.intersect1d(a, b, assume_unique = True), [c[0] for c in columns])
+  else:
+    times = reduce(np.union1d, [c[0] for c in columns])
+  values, qualities = [], []
+  for (t, v, q) in columns:
+    if not len(t):
+      values.append(np.full(len(times), np.nan)); qualities.append(np.zeros(len(times), dtype = np.int32))
+      continue
+    idx = np.minimum(np.searchsorted(t, times), len(t) - 1)
+    found = t[idx] == times
+    values.append(np.where(found, v[idx], np.nan)); qualities.append(np.where(found, q[idx], 0).astype(np.int32))
+  return (times, values, qualities)
+
+
+class qcstream:
+  '''Realtime quality control of one series, a batch of newly arrived timeslices at a time.
+     Each batch is screened for outliers like timeseries.remove_stddev_outliers, and what passes is
+     smoothed like timeseries.savitzky_golay. Only the new timeslices are worked on: the running mean
+     and deviation, the last value kept and the last half window of values carry over from batch to
+     batch. Smoothing a value needs the half window after it, so update returns the timeslices that
+     are final and holds the rest back until later values arrive or flush is called.
+     threshold: outlier limit in standard deviations, None to not screen
+     window_size, order, deriv, rate: Savitzky-Golay parameters, window_size None to not smooth
+  '''
+
+  def __init__ (self, threshold = 1.5, window_size = None, order = None, deriv = 0, rate = 1):
+    self.status = "OK"
+    self.threshold = threshold
+    #running count, mean and sum of squared deviations of every value screened
+    self.count = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.last = None # the last value kept
+    self.coefficients = None
+    if window_size != None:
+      self.coefficients = self.savitzkyGolay(window_size, order, deriv, rate)
+    self.history = None # the half window of values before the pending timeslices
+    self.pending = timeseries() # timeslices waiting on later values to be smoothed
+
+  @requires_numpy
+  def savitzkyGolay (self, window_size, order, deriv, rate):
+    '''returns the Savitzky-Golay convolution coefficients'''
+    try:
+      window_size = np.abs(np.int(window_size))
+      order = np.abs(np.int(order))
+    except ValueError:
+      raise ValueError("SGFilter:window size and order must be of type int")
+    if window_size % 2 != 1 or window_size < 1:
+      raise TypeError("SGFilter:window size must be positive number")
+    if window_size < order + 2:
+      raise TypeError("SGFilter:window size is too small for the polynomials order")
+    order_range = range(order+1)
+    half_window = (window_size -1) // 2
+    b = np.mat([[k**i for i in order_range] for k in range(-half_window, half_window+1)])
+    return np.linalg.pinv(b).A[deriv] * rate**deriv * factorial(deriv)
+
+  def update (self, ts):
+    '''screens and smooths ts, which follows the timeslices of the earlier batches
+       returns a timeseries of the timeslices that are final'''
+    output = ts.copy() if self.threshold == None else self.screen(ts)
+    if self.coefficients is None:
+      return output
+    return self.smooth(output, False)
+
+  def flush (self):
+    '''returns the smoothed timeslices held back by update, padding the end with the last value'''
+    if self.coefficients is None:
+      return timeseries()
+    return self.smooth(timeseries(), True)
+
+  def screen (self, ts):
+    '''returns the timeslices of ts within threshold standard deviations of the last value kept'''
+    output = timeseries()
+    output.tz = ts.tz
+    vectorize = _NUMPY_AVAILABLE and len(ts.times) >= _NUMPY_MIN
+    if vectorize:
+      (times, values, qualities) = ts.numpyColumns()
+      present = values[values == values]
+      (n, mean) = (len(present), present.mean() if len(present) else 0.0)
+      m2 = float(np.dot(present - mean, present - mean))
+    else:
+      present = [v for v in ts.values if v == v]
+      (n, mean) = (len(present), math.fsum(present) / len(present) if present else 0.0)
+      m2 = math.fsum((v - mean) ** 2 for v in present)
+    if n == 0:
+      return output
+    #fold the batch into the running figures (Chan et al.)
+    total = self.count + n
+    delta = mean - self.mean
+    self.mean += delta * n / total
+    self.m2 += m2 + delta * delta * self.count * n / total
+    self.count = total
+    #the deviation is taken with the mean as an extra value, as remove_stddev_outliers always has
+    limit = self.threshold * math.sqrt(self.m2 / (self.count + 1))
+    ref = self.mean if self.last == None else self.last
+    if vectorize:
+      keep = self.screenNumpy(values, ref, limit)
+      if keep.any():
+        self.last = float(values[keep][-1])
+      return output.fromNumpyColumns(times[keep], values[keep], qualities[keep])
+    keep = []
+    for (i, v) in enumerate(ts.values):
+      if abs(v - ref) < limit:
+        keep.append(i)
+        ref = self.last = v
+    return output.extendEpochs([ts.times[i] for i in keep], [ts.values[i] for i in keep],
+                               [ts.qualities[i] for i in keep])
+
+  @requires_numpy
+  def screenNumpy (self, values, ref, limit):
+    '''returns the mask of values screen keeps. Each value is tested against the last value kept
+       before it, which is solved for by iterating to the fixed point over whole arrays.'''
+    n = len(values)
+    index = np.arange(n)
+    keep = np.ones(n, dtype = bool)
+    for k in xrange(32):
+      before = np.concatenate(([-1], np.maximum.accumulate(np.where(keep, index, -1))[:-1]))
+      refs = np.where(before >= 0, values[np.maximum(before, 0)], ref)
+      test = np.abs(values - refs) < limit
+      changed = np.flatnonzero(test != keep)
+      keep = test
+      if not len(changed):
+        return keep
+    #everything before the first change has settled, long runs of outliers finish one by one
+    first = changed[0]
+    kept = np.flatnonzero(keep[:first])
+    if len(kept):
+      ref = values[kept[-1]]
+    for i in xrange(first, n):
+      keep[i] = abs(values[i] - ref) < limit
+      if keep[i]:
+        ref = values[i]
+    return keep
+
+  @requires_numpy
+  def smooth (self, ts, final):
+    '''adds ts to the pending timeslices and returns those whose smoothing window is complete,
+       all of them if final'''
+    half = (len(self.coefficients) - 1) // 2
+    if self.history == None:
+      if not ts.times:
+        return timeseries()
+      self.history = [ts.values[0]] * half # the start is padded with the first value
+      self.pending.tz = ts.tz
+    self.pending.extendEpochs(ts.times, ts.values, ts.qualities)
+    pending = self.pending
+    output = timeseries()
+    output.tz = pending.tz
+    if not pending.times:
+      return output
+    signal = np.concatenate((self.history, pending.values, [pending.values[-1]] * half if final else []))
+    if len(signal) < len(self.coefficients):
+      return output
+    smoothed = np.convolve(signal, self.coefficients[::-1], mode='valid')
+    k = len(smoothed)
+    self.history = signal[k:k + half].tolist()
+    self.pending = pending.indexSlice(k, len(pending.times))
+    return output.extendEpochs(pending.times[:k], smoothed.tolist(), [0] * k)
+
+
+def encodeChunk (times, values, qualities):
+  '''Compresses parallel columns of epoch seconds, values and qualities into a chunk that decodes on
+     its own (see decodeChunk). A chunk is a header (count, first and last time, stream lengths)
+     followed by three zlib streams:
+       times: delta-of-delta, which is all zeros for a regular series
+       values: the float64 bits XORed with the previous value's (as in Facebook's Gorilla), which
+               is zero for a repeated value and repeats itself for steps of the same size
+       qualities: (quality, run length) pairs
+     zlib does the bit packing that Gorilla does by hand, far faster than a Python bit writer could.
+  '''
+  n = len(times)
+  if _NUMPY_AVAILABLE and n >= _NUMPY_MIN:
+    (deltas, xors, runs) = encodeChunkNumpy(times, values, qualities)
+  else:
+    (deltas, step, previous) = ([], 0, 0)
+    for t in times:
+      t = int(t)
+      deltas.append(t - previous - step)
+      (step, previous) = (t - previous, t)
+    deltas = struct.pack("<%dq" % n, *deltas)
+    bits = struct.unpack("<%dQ" % n, struct.pack("<%dd" % n, *values))
+    xors = struct.pack("<%dQ" % n, *[a ^ b for (a, b) in izip(bits, (0,) + bits[:-1])])
+    runs = []
+    for (q, run) in groupby(qualities):
+      runs.extend((q, sum(1 for _ in run)))
+    runs = struct.pack("<%di" % len(runs), *runs)
+  streams = [zlib.compress(deltas), zlib.compress(xors), zlib.compress(runs)]
+  (first, last) = (int(times[0]), int(times[-1])) if n else (0, 0)
+  return _CHUNK_HEADER.pack(n, first, last, *[len(stream) for stream in streams]) + "".join(streams)
+
+@requires_numpy
+def encodeChunkNumpy (times, values, qualities):
+  t = np.frombuffer(times, dtype = np.int64 if _TIME_TYPE == "l" else np.float64).astype(np.int64)
+  deltas = np.diff(np.concatenate(([0], np.diff(np.concatenate(([0], t))))))
+  bits = np.frombuffer(values, dtype = np.float64).astype("<f8").view("<u8")
+  xors = bits ^ np.concatenate((np.zeros(1, "<u8"), bits[:-1]))
+  q = np.frombuffer(qualities, dtype = np.int32)
+  starts = np.flatnonzero(np.concatenate(([True], q[1:] != q[:-1])))
+  runs = np.column_stack((q[starts], np.diff(np.append(starts, len(q)))))
+  return (deltas.astype("<i8").tostring(), xors.tostring(), runs.astype("<i4").tostring())
+
+def decodeChunk (data, offset = 0):
+  '''returns the times, values and qualities arrays of the chunk encodeChunk wrote at offset in data'''
+  header = _CHUNK_HEADER.unpack_from(data, offset)
+  n = header[0]
+  offset += _CHUNK_HEADER.size
+  streams = []
+  for length in header[3:]:
+    streams.append(zlib.decompress(data[offset:offset + length]))
+    offset += length
+  (deltas, xors, runs) = streams
+  if _NUMPY_AVAILABLE and n >= _NUMPY_MIN:
+    return decodeChunkNumpy(deltas, xors, runs)
+  (times, step, t) = (array(_TIME_TYPE), 0, 0)
+  for delta in struct.unpack("<%dq" % n, deltas):
+    step += delta
+    t += step
+    times.append(t)
+  (bits, x) = ([], 0)
+  for xor in struct.unpack("<%dQ" % n, xors):
+    x ^= xor
+    bits.append(x)
+  values = array("d", struct.unpack("<%dd" % n, struct.pack("<%dQ" % n, *bits)))
+  runs = struct.unpack("<%di" % (len(runs) // 4), runs)
+  qualities = array("i")
+  for (q, count) in izip(runs[0::2], runs[1::2]):
+    qualities.extend(array("i", [q]) * count)
+  return (times, values, qualities)
+
+@requires_numpy
+def decodeChunkNumpy (deltas, xors, runs):
+  times = np.cumsum(np.cumsum(np.frombuffer(deltas, dtype = "<i8")))
+  values = np.bitwise_xor.accumulate(np.frombuffer(xors, dtype = "<u8")).view("<f8")
+  runs = np.frombuffer(runs, dtype = "<i4").reshape(-1, 2)
+  qualities = np.repeat(runs[:, 0], runs[:, 1])
+  return (array(_TIME_TYPE, times.astype(np.int64 if _TIME_TYPE == "l" else np.float64).tostring()),
+          array("d", values.astype(np.float64).tostring()),
+          array("i", qualities.astype(np.int32).tostring()))
+
+
+def metadataTz (metadata):
+  '''returns the tzinfo described by metadata from timeseries.metadata'''
+  if not metadata.get("aware"):
+    return None
+  name = metadata.get("tz")
+  tz = None
+  if name == "UTC":
+    tz = dateutil.tz.tzutc()
+  elif name != None:
+    tz = dateutil.tz.gettz(name)
+  if tz == None:
+    tz = dateutil.tz.tzoffset(None, metadata.get("utcoffset") or 0)
+  return tz
+
+
+class binaryfile:
+  '''A timeseries file in the tslite binary format, memory mapped so that nothing is read until it is
+     asked for. The file is a header (magic, version, metadata length, count), JSON metadata (tsid,
+     units, tz), then the int64 times, float64 values and int32 qualities each as one contiguous
+     little endian block. Times are sorted, so a time range is found with a binary search that only
+     touches a few pages, and read is proportional to the timeslices it returns.
+     A compressed file (saveBinary(compress = True)) holds chunks in place of the columns. Opening it
+     walks the chunk headers, and read only decompresses the chunks that overlap the range.
+     Attributes: version, count, tsid, units, tz, compressed
+  '''
+
+  def __init__ (self, path):
+    self.status = "OK"
+    self.path = path
+    self.file = open(path, "rb")
+    self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+    (magic, self.version, length, self.count) = _BINARY_HEADER.unpack_from(self.map, 0)
+    if magic not in (_BINARY_MAGIC, _ARCHIVE_MAGIC):
+      raise ValueError("%s is not a tslite binary file" % path)
+    self.compressed = magic == _ARCHIVE_MAGIC
+    if self.version > _BINARY_VERSION:
+      raise ValueError("%s is tslite binary version %d, only %d is supported" % (path, self.version, _BINARY_VERSION))
+    metadata = json.loads(self.map[_BINARY_HEADER.size:_BINARY_HEADER.size + length])
+    self.tsid = metadata.get("tsid")
+    self.units = metadata.get("units")
+    self.tz = metadataTz(metadata)
+    self.offsets = [_BINARY_HEADER.size + length]
+    if self.compressed:
+      self.chunks = [] # (offset, first time, last time)
+      (offset, count) = (self.offsets[0], 0)
+      while count < self.count:
+        header = _CHUNK_HEADER.unpack_from(self.map, offset)
+        self.chunks.append((offset, header[1], header[2]))
+        count += header[0]
+        offset += _CHUNK_HEADER.size + sum(header[3:])
+      return
+    for size in (8, 8):
+      self.offsets.append(self.offsets[-1] + size * self.count)
+
+  def close (self):
+    self.map.close()
+    self.file.close()
+
+  def __len__ (self):
+    return self.count
+
+  def __getitem__ (self, i):
+    '''returns the epoch time of timeslice i, which lets bisect search the file'''
+    return struct.unpack_from("<q", self.map, self.offsets[0] + 8 * i)[0]
+
+  def toEpoch (self, dt):
+    return timeseries().toEpoch(dt)
+
+  def indexRange (self, start_time = None, end_time = None):
+    '''returns the index range [a, b) of the timeslices between start_time and end_time'''
+    a = 0 if start_time == None else bisect.bisect_left(self, self.toEpoch(start_time))
+    b = self.count if end_time == None else bisect.bisect_right(self, self.toEpoch(end_time))
+    return (a, max(a, b))
+
+  def column (self, k, typecode, size, a, b):
+    output = array(typecode)
+    output.fromstring(self.map[self.offsets[k] + size * a:self.offsets[k] + size * b])
+    if not _LITTLE_ENDIAN:
+      output.byteswap()
+    return output
+
+  def readChunks (self, start_time = None, end_time = None):
+    '''read for a compressed file'''
+    first = None if start_time == None else self.toEpoch(start_time)
+    last = None if end_time == None else self.toEpoch(end_time)
+    output = timeseries()
+    output.tz = self.tz
+    for (offset, a, b) in self.chunks:
+      if (first != None and b < first) or (last != None and a > last):
+        continue
+      (times, values, qualities) = decodeChunk(self.map, offset)
+      i = 0 if first == None else bisect.bisect_left(times, first)
+      j = len(times) if last == None else bisect.bisect_right(times, last)
+      output.times.extend(times[i:j])
+      output.values.extend(values[i:j])
+      output.qualities.extend(qualities[i:j])
+    return output
+
+  def read (self, start_time = None, end_time = None):
+    '''returns a timeseries of the timeslices between start_time and end_time (inclusive, default all)'''
+    if self.compressed:
+      return self.readChunks(start_time, end_time)
+    (a, b) = self.indexRange(start_time, end_time)
+    output = timeseries()
+    output.tz = self.tz
+    if _TIME_TYPE == "l":
+      output.times = self.column(0, "l", 8, a, b)
+    else:
+      output.times = array(_TIME_TYPE, struct.unpack_from("<%dq" % (b - a), self.map, self.offsets[0] + 8 * a))
+    output.values = self.column(1, "d", 8, a, b)
+    output.qualities = self.column(2, "i", 4, a, b)
+    return output
+
+  @requires_numpy
+  def columns (self, start_time = None, end_time = None):
+    '''returns numpy views straight onto the mapped file (no copy) of the times, values and qualities
+       between start_time and end_time. They are read only and only valid until close.
+       A compressed file has to be decoded, so it returns copies instead.'''
+    if self.compressed:
+      ts = self.readChunks(start_time, end_time)
+      return ts.numpyColumns()
+    (a, b) = self.indexRange(start_time, end_time)
+    return tuple(np.frombuffer(self.map, dtype = dtype, count = b - a, offset = self.offsets[k] + size * a)
+                 for (k, dtype, size) in ((0, "<i8", 8), (1, "<f8", 8), (2, "<i4", 4)))
+
+
+class sqlitestore:
+  '''A SQLite store of any number of timeseries in one table, clustered on (tsid_id, t) so a range
+     of one series is a single index seek and a contiguous read:
+       tsids (id INTEGER PRIMARY KEY, tsid TEXT UNIQUE, units TEXT, metadata TEXT)
+       tsvalues (tsid_id INTEGER, t INTEGER, val REAL, qual INTEGER, PRIMARY KEY (tsid_id, t)) WITHOUT ROWID
+     t is epoch seconds as in timeseries.times, a missing value is NULL and tsids are upper case.
+     The tables are created by the first write; reads of a database without them find nothing.
+     Rows go in _SQLITE_ROWS to an INSERT, one executemany per series, and writeMulti/readMulti
+     handle many series in one transaction.
+     db: path to the database file, or an open sqlite3 connection. A store that opened the database
+     puts it in WAL mode, so readers don't block the writer, and commits each write itself. On a
+     connection it was handed, the store sets no PRAGMAs, leaves commit and rollback to the caller
+     and close leaves the connection open. Python 2's sqlite3 commits an open transaction before
+     the CREATE TABLEs, so a caller's transaction doesn't include the first write to a new database.
+  '''
+
+  @requires_SQLITE3
+  def __init__ (self, db, timeout = 60):
+    self.status = "OK"
+    self.owned = not isinstance(db, sqlite3.Connection)
+    self.conn = sqlite3.connect(db, timeout = timeout) if self.owned else db
+    if self.owned:
+      self.conn.execute("PRAGMA journal_mode=WAL")
+      self.conn.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, which is safe with WAL
+    self.ids = {}  # catalog ids by tsid, only kept when the store owns the transactions
+    self.ready = False
+
+  def close (self):
+    if self.owned:
+      self.conn.close()
+
+  def hasTables (self):
+    '''True once the tsids and tsvalues tables exist'''
+    if not self.ready:
+      self.ready = self.conn.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND "
+                                     "name IN ('tsids', 'tsvalues')").fetchone()[0] == 2
+    return self.ready
+
+  def createTables (self):
+    '''creates the tsids and tsvalues tables if they don't exist'''
+    if self.hasTables():
+      return
+    self.conn.execute("CREATE TABLE IF NOT EXISTS tsids "
+                      "(id INTEGER PRIMARY KEY, tsid TEXT UNIQUE, units TEXT, metadata TEXT)")
+    self.conn.execute("CREATE TABLE IF NOT EXISTS tsvalues (tsid_id INTEGER, t INTEGER, val REAL, "
+                      "qual INTEGER, PRIMARY KEY (tsid_id, t)) WITHOUT ROWID")
+    self.ready = True
+
+  def transact (self, f, *args):
+    '''returns f(*args), committing or rolling back the transaction it ran in if the store owns it'''
+    try:
+      result = f(*args)
+    except:
+      if self.owned:
+        self.conn.rollback()
+        self.ids = {} # ids added by the rolled back transaction are gone
+      raise
+    if self.owned:
+      self.conn.commit()
+    return result
+
+  def catalog (self):
+    '''returns [(tsid, units)] of every stored series'''
+    if not self.hasTables():
+      return []
+    return self.conn.execute("SELECT tsid, units FROM tsids ORDER BY tsid").fetchall()
+
+  def tsidId (self, tsid, ts = None, units = None):
+    '''returns the catalog id of tsid, adding it with ts's metadata if it is new and ts is given,
+       otherwise None for a tsid that isn't stored'''
+    tsid = tsid.upper()
+    k = self.ids.get(tsid)
+    if k == None:
+      row = self.conn.execute("SELECT id FROM tsids WHERE tsid = ?", (tsid,)).fetchone()
+      if row == None:
+        if ts == None:
+          return None
+        row = (self.conn.execute("INSERT INTO tsids (tsid, units, metadata) VALUES (?, ?, ?)",
+                                 (tsid, units, json.dumps(ts.metadata()))).lastrowid,)
+      k = row[0]
+      if self.owned:
+        self.ids[tsid] = k
+    if units != None:
+      self.conn.execute("UPDATE tsids SET units = ? WHERE id = ?", (units, k))
+    return k
+
+  def write (self, tsid, ts, units = None, replace = False):
+    '''stores ts as tsid, see writeMulti'''
+    return self.writeMulti([(tsid, ts, units)], replace)
+
+  def writeMulti (self, series, replace = False):
+    '''stores series, a list of (tsid, timeseries) or (tsid, timeseries, units), in one transaction.
+       Timeslices already stored at the same times are overwritten.
+       replace: delete everything stored for each tsid first
+       returns the number of timeslices written
+    '''
+    self.createTables()
+    return self.transact(self.insert, series, replace)
+
+  def insert (self, series, replace):
+    '''writeMulti's inserts, run in its transaction'''
+    count = 0
+    for item in series:
+      (tsid, ts, units) = (tuple(item) + (None,))[:3]
+      k = self.tsidId(tsid, ts, units)
+      if replace:
+        self.conn.execute("DELETE FROM tsvalues WHERE tsid_id = ?", (k,))
+      times = ts.times if _TIME_TYPE == "l" else [int(t) for t in ts.times]
+      n = len(times) - len(times) % _SQLITE_ROWS
+      rows = list(chain.from_iterable(izip(times[:n], ts.values[:n], ts.qualities[:n])))
+      size = 3 * _SQLITE_ROWS
+      self.conn.executemany("INSERT OR REPLACE INTO tsvalues VALUES " + ", ".join(["(%d, ?, ?, ?)" % k] * _SQLITE_ROWS),
+                            (rows[i:i + size] for i in xrange(0, len(rows), size)))
+      self.conn.executemany("INSERT OR REPLACE INTO tsvalues VALUES (%d, ?, ?, ?)" % k,
+                            izip(times[n:], ts.values[n:], ts.qualities[n:]))
+      count += len(times)
+    return count
+
+  def delete (self, tsid, start_time = None, end_time = None):
+    '''deletes the timeslices of tsid between start_time and end_time (inclusive, default all),
+       keeping its catalog entry. Returns the number of timeslices deleted.'''
+    if not self.hasTables():
+      return 0
+    (first, last) = self.epochRange(start_time, end_time)
+    return self.transact(lambda: self.conn.execute(
+        "DELETE FROM tsvalues WHERE tsid_id = (SELECT id FROM tsids WHERE tsid = ?) AND t >= ? AND t <= ?",
+        (tsid.upper(), first, last)).rowcount)
+
+  def epochRange (self, start_time, end_time):
+    '''returns start_time and end_time as epoch seconds, open ended when None'''
+    return (-2 ** 63 if start_time == None else timeseries().toEpoch(start_time),
+            2 ** 63 - 1 if end_time == None else timeseries().toEpoch(end_time))
+
+  def read (self, tsid, start_time = None, end_time = None):
+    '''returns the timeseries stored as tsid between start_time and end_time (inclusive, default all),
+       or None if tsid isn't stored'''
+    return self.readMulti([tsid], start_time, end_time).get(tsid)
+
+  def readMulti (self, tsids, start_time = None, end_time = None):
+    '''returns {tsid: timeseries} of tsids between start_time and end_time (inclusive, default all),
+       read in one transaction so that they are consistent with each other. tsids that aren't
+       stored are left out. On a connection it was handed, the store reads in the caller's
+       transaction, if any, and leaves it open.'''
+    (first, last) = self.epochRange(start_time, end_time)
+    output = {}
+    if not self.hasTables():
+      return output
+    if self.owned:
+      self.conn.execute("BEGIN")
+    try:
+      for tsid in tsids:
+        row = self.conn.execute("SELECT id, metadata FROM tsids WHERE tsid = ?", (tsid.upper(),)).fetchone()
+        if row == None:
+          continue
+        ts = timeseries()
+        ts.tz = metadataTz(json.loads(row[1]))
+        rows = self.conn.execute("SELECT t, val, qual FROM tsvalues WHERE tsid_id = ? AND t >= ? AND t <= ? "
+                                 "ORDER BY t", (row[0], first, last)).fetchall()
+        if rows:
+          (times, values, qualities) = izip(*rows)
+          if None in values:
+            values = [_NAN if v == None else v for v in values]
+          ts.times = array(_TIME_TYPE, times)
+          ts.values = array("d", values)
+          ts.qualities = array("i", qualities)
+        output[tsid] = ts
+    finally:
+      if self.owned:
+        self.conn.rollback() # ends the read transaction, nothing was written
+    return output
+
+
+class timeparser:
+  '''Parses timestamp strings, working out the format from the first string it
+     is given and matching a compiled regex for it from then on. Strings the
+     detected format does not match fall back to dateutil.
+     tz - optional pytz timezone (or tzinfo) applied to naive timestamps.
+     The tz offset is memoized per local hour so DST lookups happen once per hour.
+  '''
+
+  #Formats emitted by our fetchers: ISO 8601 (optionally with Z or an offset),
+  #USBR style MM/DD/YYYY HH:MM and the CWMS/tslite style DD-Mon-YYYY HHMM
+  formats = [
+    re.compile(r"(?P<Y>\d{4})-(?P<M>\d\d)-(?P<D>\d\d)(?:[T ](?P<h>\d\d):(?P<m>\d\d)"
+               r"(?::(?P<s>\d\d)(?:\.(?P<f>\d{1,6}))?)?)?\s*(?P<z>Z|[+-]\d\d:?\d\d)?$"),
+    re.compile(r"(?P<M>\d\d?)/(?P<D>\d\d?)/(?P<Y>\d{4})(?:\s+(?P<h>\d\d?):(?P<m>\d\d)"
+               r"(?::(?P<s>\d\d)(?:\.(?P<f>\d{1,6}))?)?)?\s*(?P<z>Z|[+-]\d\d:?\d\d)?$"),
+    re.compile(r"(?P<D>\d\d?)-(?P<M>[A-Za-z]{3})-(?P<Y>\d{4})(?:\s+(?P<h>\d\d):?(?P<m>\d\d)"
+               r"(?::?(?P<s>\d\d)(?:\.(?P<f>\d{1,6}))?)?)?\s*(?P<z>Z|[+-]\d\d:?\d\d)?$"),
+  ]
+  months = {"JAN":1, "FEB":2, "MAR":3, "APR":4, "MAY":5, "JUN":6,
+            "JUL":7, "AUG":8, "SEP":9, "OCT":10, "NOV":11, "DEC":12}
+
+  def __init__ (self, tz = None):
+    self.tz = tz
+    self.format = None
+    self.offsets = {"Z": dateutil.tz.tzutc()}
+    self.localized = {}
+    self.hits = 0
+    self.misses = 0
+
+  def parse (self, text):
+    '''returns a datetime for text, localized to self.tz if it is naive'''
+    if isinstance(text, datetime.datetime):
+      return self.localize(text)
+    if self.format == None:
+      self.format = self.detect(text)
+    dt = None
+    if self.format != None:
+      dt = self.match(self.format, text)
+    if dt == None:
+      self.misses += 1
+      dt = dateparser.parse(text, fuzzy=True)
+    else:
+      self.hits += 1
+    return self.localize(dt)
+
+  def detect (self, text):
+    '''returns the first known format that matches text, or None'''
+    for fmt in self.formats:
+      if self.match(fmt, text) != None:
+        return fmt
+    return None
+
+  def match (self, fmt, text):
+    '''returns a datetime if text matches the compiled format fmt, otherwise None'''
+    m = fmt.match(text.strip())
+    if m == None:
+      return None
+    (Y, M, D, h, mi, s, f, z) = m.group("Y", "M", "D", "h", "m", "s", "f", "z")
+    if not M.isdigit():
+      M = self.months.get(M.upper())
+      if M == None:
+        return None
+    try:
+      dt = datetime.datetime(int(Y), int(M), int(D), int(h or 0), int(mi or 0),
+                             int(s or 0), int((f or "0").ljust(6, "0")))
+    except ValueError:
+      return None
+    if z != None:
+      tzinfo = self.offsets.get(z)
+      if tzinfo == None:
+        sign = -1 if z[0] == "-" else 1
+        z2 = z[1:].replace(":", "")
+        tzinfo = dateutil.tz.tzoffset(None, sign * (int(z2[:2]) * 3600 + int(z2[2:]) * 60))
+        self.offsets[z] = tzinfo
+      dt = dt.replace(tzinfo = tzinfo)
+    return dt
+
+  def localize (self, dt):
+    '''applies self.tz to a naive datetime, memoizing the offset for each local hour'''
+    if dt.tzinfo != None or self.tz == None:
+      return dt
+    key = (dt.year, dt.month, dt.day, dt.hour)
+    tzinfo = self.localized.get(key)
+    if tzinfo == None:
+      if hasattr(self.tz, "localize"):
+        tzinfo = self.tz.localize(dt).tzinfo
+      else:
+        tzinfo = self.tz
+      self.localized[key] = tzinfo
+    return dt.replace(tzinfo = tzinfo)
+
+
 class rdb:
   #construtor rewrites a path to a RDB file
   def __init__ (self, path):
@@ -1242,19 +2736,35 @@ class rdb:
   
   rate2 = reverseRate ## backwards compatibility
   
+  def rateValues (self, values, indep, dep):
+    """ Rates a list of values on columns indep and dep of the table in one pass, like rate does one. """
+    x = [float(row[indep]) for row in self.data]
+    y = [float(row[dep]) for row in self.data]
+    if any(b < a for (a, b) in izip(x, x[1:])): # unsorted table, search it value by value
+      rate = self.rate if indep == 0 else self.reverseRate
+      return [rate(v) for v in values]
+    last = len(x) - 1
+    if _NUMPY_AVAILABLE and len(values) >= _NUMPY_MIN:
+      (x, y) = (np.array(x), np.array(y))
+      i = np.minimum(np.searchsorted(x[1:], values, "right") + 1, last) - 1
+      return (y[i] + (values - x[i]) * ((y[i + 1] - y[i]) / (x[i + 1] - x[i]))).tolist()
+    output = []
+    for v in values:
+      i = min(bisect.bisect_right(x, v, 1), last) - 1
+      output.append(self.interpolateValue(x[i], y[i], x[i + 1], y[i + 1], v))
+    return output
+
   def rateTS (self,ts):
     """ Generates a new time series with rated values from another """
-    output = []
-    for line in ts.data:
-      output.append([line[0],self.rate(line[1]),line[2]])
-    return timeseries(output)
+    output = timeseries()
+    output.tz = ts.tz
+    return output.extendEpochs(ts.times, self.rateValues(ts.values, 0, 2), ts.qualities)
 
   def reverseRateTS (self,ts):
     """ Generates a new time series with reverse-rated values from another """
-    output = []
-    for line in ts.data:
-      output.append([line[0],self.rate2(line[1]),line[2]])
-    return timeseries(output)
+    output = timeseries()
+    output.tz = ts.tz
+    return output.extendEpochs(ts.times, self.rateValues(ts.values, 2, 0), ts.qualities)
 
   rateTS2 = reverseRateTS ## backwards compatibility
 
@@ -1318,12 +2828,13 @@ class tablegrid:
   
   #this takes 2 timseries objects and rates them
   def rateTS (self,cols,rows):
-    output = []
-    for line in cols.data:
-      rowval = rows.findValue(line[0])
-      if rowval != None:
-        output.append([line[0],self.tableLookup(self.data,line[1],rowval),line[2]])
-    return timeseries(output)
+    (times, values, qualities) = alignColumns([cols, rows], vectorize = False)
+    output = timeseries()
+    output.tz = cols.tz
+    keep = [i for (i, rowval) in enumerate(values[1]) if rowval == rowval]
+    return output.extendEpochs([times[i] for i in keep],
+                               [self.tableLookup(self.data, values[0][i], values[1][i]) for i in keep],
+                               [qualities[0][i] for i in keep])
 
 #Alias so we don't break backward compatibility
 timeSeries = timeseries